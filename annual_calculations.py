@@ -1,170 +1,366 @@
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
 from data import *
-import mplfinance as mpf
-import matplotlib.pyplot as plt
+from result_cache import cached
+from price_index import PriceSeries, as_frame
 
-def compute_annual_returns_stocks(df):
+def yearly_close_means(years, close, first_year, last_year):
     """
-    Computes annual returns of stocks
+    Computes the mean close price of every year in a range in a single pass
     Parameters
     ----------
-    df: pd.DataFrame
-        The DataFrame containing the data
-    
+    years: array-like
+        The year of each row
+    close: array-like
+        The close price of each row
+    first_year: int
+        The first year of the range (inclusive)
+    last_year: int
+        The last year of the range (inclusive)
+
     Returns
     -------
-    results: pd.DataFrame
-        A DataFrame containing annual returns of SP500
+    means: np.ndarray
+        The mean close price of each year, NaN for the years without data
 
     """
-    investment_periods = range(1951, 2024)
-    annual_returns = []
-    for year in tqdm(investment_periods):
-        current_year_data = df[df['Year'] == year]
-        previous_year_data = df[df['Year'] == year - 1]
+    years = np.asarray(years)
+    close = np.asarray(close, dtype=float)
+    in_range = (years >= first_year) & (years <= last_year) & ~np.isnan(close)
+    offsets = years[in_range] - first_year
+    n_years = last_year - first_year + 1
+    sums = np.bincount(offsets, weights=close[in_range], minlength=n_years)
+    counts = np.bincount(offsets, minlength=n_years)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts
+
+
+def price_yearly_means(data, first_year, last_year):
+    """
+    Computes the yearly_close_means of a price frame, or of the rows of the range of a
+    PriceSeries found with its year offsets, without building its frame
+    Parameters
+    ----------
+    data: pd.DataFrame or PriceSeries
+        The prices, a frame without a Year column needs a Date column
+    first_year: int
+        The first year of the range (inclusive)
+    last_year: int
+        The last year of the range (inclusive)
 
-        current_year_mean = current_year_data['Close'].mean()
-        previous_year_mean = previous_year_data['Close'].mean()
-        dividend_return = divs[year-1] * previous_year_mean / 100
-        inflation_constant = cpi[year] / cpi[year-1]
+    Returns
+    -------
+    means: np.ndarray
+        The mean close price of each year, NaN for the years without data
+    """
+    if isinstance(data, PriceSeries):
+        rows = data.range_rows(first_year, last_year)
+        return yearly_close_means(data.years[rows], data.close[rows], first_year, last_year)
+    df = as_frame(data)
+    #the preprocessed files already carry the year, parsing the dates is only needed for raw frames
+    if "Year" in df.columns:
+        years = df["Year"].values
+    else:
+        years = pd.to_datetime(df["Date"]).dt.year.values
+    return yearly_close_means(years, df["Close"].values, first_year, last_year)
+
+
+def _annual_real_returns(yearly_means, start, end, dividends):
+    """
+    Computes the inflation adjusted annual returns of every year in [start, end)
+    from the yearly mean prices
+    Parameters
+    ----------
+    yearly_means: np.ndarray
+        The mean close price of every year in [start - 1, end - 1]
+    start: int
+        The first year whose return is computed
+    end: int
+        The end of the range (exclusive)
+    dividends: bool
+        Whether to also compute the returns with dividends
+
+    Returns
+    -------
+    periods: list
+        The (previous year, year) tuple of each return
+    returns: tuple
+        The return without dividends, followed by the return with dividends if requested
+
+    """
+    investment_periods = np.arange(start, end)
+    previous_year_mean = yearly_means[:-1]
+    current_year_mean = yearly_means[1:]
+    inflation_constant = inflation_ratios[investment_periods]
+
+    adjusted_previous_mean = previous_year_mean * inflation_constant
+    adjusted_annual_return = (current_year_mean - adjusted_previous_mean) / adjusted_previous_mean * 100
+    returns = (adjusted_annual_return,)
 
-        adjusted_previous_mean = previous_year_mean * inflation_constant
+    if dividends:
+        dividend_return = divs_table[investment_periods - 1] * previous_year_mean / 100
         adjusted_dividend_return = dividend_return * inflation_constant
-        adjusted_annual_return_without_dividends = (current_year_mean - adjusted_previous_mean) / adjusted_previous_mean * 100
         adjusted_annual_return_with_dividends = (current_year_mean + adjusted_dividend_return - adjusted_previous_mean) / adjusted_previous_mean * 100
-        annual_returns.append(((year-1, year), adjusted_annual_return_without_dividends, adjusted_annual_return_with_dividends))
+        returns += (adjusted_annual_return_with_dividends,)
 
-    results = pd.DataFrame(annual_returns, columns=["Period", "(%)Adjusted_Annual_Return_Without_Dividends", "(%)Adjusted_Annual_Return_With_Dividends"])
+    periods = [(int(year) - 1, int(year)) for year in investment_periods]
+    return periods, returns
+
+
+def stock_returns_frame(yearly_means, start, end):
+    """
+    Builds the table of compute_annual_returns_stocks from the mean price of every year in [start - 1, end - 1]
+    """
+    periods, (without_dividends, with_dividends) = _annual_real_returns(yearly_means, start, end, dividends=True)
+
+    results = pd.DataFrame({"Period": periods,
+                            "(%)Adjusted_Annual_Return_Without_Dividends": without_dividends,
+                            "(%)Adjusted_Annual_Return_With_Dividends": with_dividends})
     results = results.set_index("Period")
     return results
 
-def compute_annual_returns_stocks_individually(df):
+
+def commodity_returns_frame(yearly_means, start, end):
     """
-    Computes annual returns of stocks one by one for each month then combines the values
+    Builds the table of compute_annual_returns_commodity from the mean price of every year in [start - 1, end - 1]
+    """
+    periods, (adjusted_annual_return,) = _annual_real_returns(yearly_means, start, end, dividends=False)
+
+    results = pd.DataFrame({"Period": periods, "(%)Adjusted_Annual_Return": adjusted_annual_return})
+    results = results.set_index("Period")
+    return results
+
+
+def monthly_close_means(years, months, close, first_year, last_year):
+    """
+    Builds the year x month matrix of mean close prices in a single pass
     Parameters
     ----------
-    df: pd.DataFrame
-        A dataframe containing stock prices
+    years: array-like
+        The year of each row
+    months: array-like
+        The month (1-12) of each row
+    close: array-like
+        The close price of each row
+    first_year: int
+        The first year of the range (inclusive)
+    last_year: int
+        The last year of the range (inclusive)
 
     Returns
     -------
-    individual_return_df: pd.DataFrame
-        A dataframe containing the annual returns stocks monthly average
+    means: np.ndarray
+        A (years, 12) matrix of mean close prices, NaN for the months without data
+
+    """
+    years = np.asarray(years)
+    months = np.asarray(months)
+    close = np.asarray(close, dtype=float)
+    in_range = (years >= first_year) & (years <= last_year) & ~np.isnan(close)
+    cells = (years[in_range] - first_year) * 12 + months[in_range] - 1
+    n_cells = (last_year - first_year + 1) * 12
+    sums = np.bincount(cells, weights=close[in_range], minlength=n_cells)
+    counts = np.bincount(cells, minlength=n_cells)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(-1, 12)
+
+
+def price_monthly_means(data, first_year, last_year):
+    """
+    Computes the monthly_close_means of a price frame, or of the rows of the range of a
+    PriceSeries found with its year offsets, without building its frame
+    Parameters
+    ----------
+    data: pd.DataFrame or PriceSeries
+        The prices, a frame needs Year and Month columns
+    first_year: int
+        The first year of the range (inclusive)
+    last_year: int
+        The last year of the range (inclusive)
+
+    Returns
+    -------
+    means: np.ndarray
+        A (years, 12) matrix of mean close prices, NaN for the months without data
+    """
+    if isinstance(data, PriceSeries):
+        rows = data.range_rows(first_year, last_year)
+        return monthly_close_means(data.years[rows], data.months[rows], data.close[rows], first_year, last_year)
+    df = as_frame(data)
+    return monthly_close_means(df["Year"].values, df["Month"].values, df["Close"].values, first_year, last_year)
+
+
+def _monthly_real_returns(monthly_means, start, end, dividends):
+    """
+    Computes the inflation adjusted year over year return of every month in [start, end)
+    Parameters
+    ----------
+    monthly_means: np.ndarray
+        The (years, 12) matrix of mean close prices of the years in [start - 1, end - 1]
+    start: int
+        The first year whose returns are computed
+    end: int
+        The end of the range (exclusive)
+    dividends: bool
+        Whether to add the dividends of the previous year to the returns
+
+    Returns
+    -------
+    returns: np.ndarray
+        A (years, 12) matrix of returns, NaN where either month has no data
+
     """
+    investment_periods = np.arange(start, end)
+    previous_year_mean = monthly_means[:-1]
+    current_year_mean = monthly_means[1:]
+    inflation_constant = inflation_ratios[investment_periods][:, None]
+
+    adjusted_previous_mean = previous_year_mean * inflation_constant
+    if dividends:
+        dividend_return = divs_table[investment_periods - 1][:, None] * previous_year_mean / 100
+        adjusted_dividend_return = dividend_return * inflation_constant
+        return (current_year_mean + adjusted_dividend_return - adjusted_previous_mean) / adjusted_previous_mean * 100
 
-    investment_periods = range(1951, 2024)
-    annual_returns = []
-    for year in tqdm(investment_periods):
-        individual_returns = []
-        for month in range(1,13):
-            current_year_data = df[(df['Year'] == year) & (df['Month'] == month)]
-            previous_year_data = df[(df['Year'] == year-1) & (df['Month'] == month)]
+    return (current_year_mean - adjusted_previous_mean) / adjusted_previous_mean * 100
+
+
+def _average_monthly_returns(returns, skip_missing):
+    """
+    Averages the monthly returns of each year
+    Parameters
+    ----------
+    returns: np.ndarray
+        A (years, 12) matrix of returns
+    skip_missing: bool
+        Whether to leave the months without data out of the average instead of propagating NaN
 
-            current_year_mean = current_year_data['Close'].mean()
-            previous_year_mean = previous_year_data['Close'].mean()
-            dividend_return = divs[year-1] * previous_year_mean / 100 
-            inflation_constant = cpi[year] / cpi[year-1]
+    Returns
+    -------
+    mean_returns: np.ndarray
+        The mean return of each year
 
-            adjusted_previous_mean = previous_year_mean * inflation_constant
-            adjusted_dividend_return = dividend_return * inflation_constant
-            adjusted_annual_return = (current_year_mean + adjusted_dividend_return - adjusted_previous_mean) / adjusted_previous_mean * 100
+    """
+    if not skip_missing:
+        return returns.mean(axis=1)
 
-            individual_returns.append(adjusted_annual_return)
+    valid = ~np.isnan(returns)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(valid, returns, 0).sum(axis=1) / valid.sum(axis=1)
 
-        mean_returns = np.mean(individual_returns)
-        annual_returns.append(((year,year-1), mean_returns))
 
+@cached
+def compute_annual_returns_stocks(df, start = 1951, end = 2024):
+    """
+    Computes annual returns of stocks
+    Parameters
+    ----------
+    df: pd.DataFrame or PriceSeries
+        The DataFrame containing the data
+    start: int
+        The first year whose return is computed
+    end: int
+        The end of the investment periods (exclusive)
     
-    individual_return_df = pd.DataFrame(data = annual_returns,
-                                        columns = ['Period','(%)Adjusted_Real_Returns'],
+    Returns
+    -------
+    results: pd.DataFrame
+        A DataFrame containing annual returns of SP500
+
+    """
+    yearly_means = price_yearly_means(df, start - 1, end - 1)
+    return stock_returns_frame(yearly_means, start, end)
+
+@cached
+def compute_annual_returns_stocks_individually(df, start = 1951, end = 2024):
+    """
+    Computes annual returns of stocks one by one for each month then combines the values
+    Parameters
+    ----------
+    df: pd.DataFrame or PriceSeries
+        A dataframe containing stock prices
+    start: int
+        The first year whose returns are computed
+    end: int
+        The end of the investment periods (exclusive)
+
+    Returns
+    -------
+    individual_return_df: pd.DataFrame
+        A dataframe containing the annual returns stocks monthly average
+    """
+    monthly_means = price_monthly_means(df, start - 1, end - 1)
+    returns = _monthly_real_returns(monthly_means, start, end, dividends=True)
+    mean_returns = _average_monthly_returns(returns, skip_missing=False)
+
+    individual_return_df = pd.DataFrame({"Period": [(year, year - 1) for year in range(start, end)],
+                                         "(%)Adjusted_Real_Returns": mean_returns}
                                         ).set_index('Period')
     
     return individual_return_df
 
-def compute_annual_returns_stocks_individually_display(df):
+@cached
+def compute_annual_returns_stocks_individually_display(df, start = 1951, end = 2024):
     """
     Computes annual returns of stocks one by one for each month
     Parameters
     ----------
-    df: pd.DataFrame
+    df: pd.DataFrame or PriceSeries
         A dataframe containing stock prices
+    start: int
+        The first year whose returns are computed
+    end: int
+        The end of the investment periods (exclusive)
 
     Returns
     -------
     individual_return_display_df: pd.DataFrame
         A dataframe containing the annual returns stocks
     """
+    monthly_means = price_monthly_means(df, start - 1, end - 1)
+    returns = _monthly_real_returns(monthly_means, start, end, dividends=True)
 
-    investment_periods = range(1951, 2024)
-    annual_returns = []
-    for year in tqdm(investment_periods):
-        individual_returns = []
-        for month in range(1,13):
-            current_year_data = df[(df['Year'] == year) & (df['Month'] == month)]
-            previous_year_data = df[(df['Year'] == year-1) & (df['Month'] == month)]
-
-            current_year_mean = current_year_data['Close'].mean()
-            previous_year_mean = previous_year_data['Close'].mean()
-            dividend_return = divs[year-1] * previous_year_mean / 100 
-            inflation_constant = cpi[year] / cpi[year-1]
-
-            adjusted_previous_mean = previous_year_mean * inflation_constant
-            adjusted_dividend_return = dividend_return * inflation_constant
-            adjusted_annual_return = (current_year_mean + adjusted_dividend_return - adjusted_previous_mean) / adjusted_previous_mean * 100
-
-            individual_returns.append(((year-1,year),month,adjusted_annual_return))
-
-        annual_returns.extend(individual_returns)
-    
-    individual_return_display_df = pd.DataFrame(data = annual_returns,
-                                                columns = ["Period", "Month", "(%)Adjusted_Real_Returns"]).set_index("Period")
+    individual_return_display_df = pd.DataFrame({"Period": [(year - 1, year) for year in range(start, end) for _ in range(12)],
+                                                 "Month": np.tile(np.arange(1, 13), end - start),
+                                                 "(%)Adjusted_Real_Returns": returns.ravel()}
+                                                ).set_index("Period")
     
     return individual_return_display_df
 
 
 
+@cached
 def compute_annual_returns_commodity(df,start = 1951,end = 2024):
     """
     Computes the annual returns of commodity
     Parameters
     ----------
-    df: pd.DataFrame
+    df: pd.DataFrame or PriceSeries
         A dataframe containing commodity prices
+    start: int
+        The first year whose return is computed
+    end: int
+        The end of the investment periods (exclusive)
     
     Returns
     -------
     results: pd.DataFrame
         A dataframe containing the annual returns of a commodity
     """
-    df = df.copy()
-    df["Year"] = pd.to_datetime(df["Date"]).dt.year
-    investment_periods = range(start, end)
-    annual_returns = []
-    for year in tqdm(investment_periods):
-        current_year_data = df[df['Year'] == year]
-        previous_year_data = df[df['Year'] == year - 1]
-
-        current_year_mean = current_year_data['Close'].mean()
-        previous_year_mean = previous_year_data['Close'].mean()
-        inflation_constant = cpi[year] / cpi[year-1]
+    yearly_means = price_yearly_means(df, start - 1, end - 1)
+    return commodity_returns_frame(yearly_means, start, end)
 
-        adjusted_previous_mean = previous_year_mean * inflation_constant
-        adjusted_annual_return = (current_year_mean - adjusted_previous_mean) / adjusted_previous_mean * 100
-        annual_returns.append(((year-1, year), adjusted_annual_return))
-
-    results = pd.DataFrame(annual_returns, columns=["Period", "(%)Adjusted_Annual_Return"])
-    results = results.set_index("Period")
-    return results
-
-def compute_annual_returns_gold_individually(df):
+@cached
+def compute_annual_returns_gold_individually(df, start = 1951, end = 2024):
     """
     Computes annual returns of gold for each month then combines the results
     Parameters
     ----------
-    df: pd.DataFrame
+    df: pd.DataFrame or PriceSeries
         A dataframe containing gold prices
+    start: int
+        The first year whose returns are computed
+    end: int
+        The end of the investment periods (exclusive)
     
     Returns
     -------
@@ -172,32 +368,13 @@ def compute_annual_returns_gold_individually(df):
         A dataframe containing the annual returns of gold
         
     """
-    annual_returns = []
-    for year in tqdm(range(1951,2024)):
-        individual_returns = []
-        for month in range(1,13):
-            current_year_data = df[(df['Year'] == year) & (df['Month'] == month)]
-            previous_year_data = df[(df['Year'] == year-1) & (df['Month'] == month)]
-
-            if len(current_year_data) == 0 or len(previous_year_data) == 0:
-                    continue
+    #the months without data in either year are left out of the average
+    monthly_means = price_monthly_means(df, start - 1, end - 1)
+    returns = _monthly_real_returns(monthly_means, start, end, dividends=False)
+    mean_returns = _average_monthly_returns(returns, skip_missing=True)
 
-            current_year_mean = current_year_data['Close'].mean()
-            previous_year_mean = previous_year_data['Close'].mean()
-            inflation_constant = cpi[year] / cpi[year-1]
-
-            adjusted_previous_mean = previous_year_mean * inflation_constant
-            adjusted_annual_return = (current_year_mean - adjusted_previous_mean) / adjusted_previous_mean * 100
-
-            individual_returns.append(adjusted_annual_return)
-
-
-        mean_returns = np.mean(individual_returns)
-        annual_returns.append(((year-1,year), mean_returns))
-
-    
-    individual_return_df = pd.DataFrame(data = annual_returns,
-                                        columns = ['Period','(%)Adjusted_Real_Returns'],
+    individual_return_df = pd.DataFrame({"Period": [(year - 1, year) for year in range(start, end)],
+                                         "(%)Adjusted_Real_Returns": mean_returns}
                                         ).set_index('Period')
     
     return individual_return_df
@@ -0,0 +1,193 @@
+"""
+Benchmarks of the public analysis functions on synthetic prices.
+
+The synthetic data has the Date,Close,Year,Month layout of SP500_whole.csv over the
+same 1950-2024 business days; larger scales add intraday bars to every day, so a
+scale of 10 has 10x the rows of SP500_whole.csv. Every function is timed (best of
+--repeat runs) and its peak traced memory is measured in a separate run.
+
+    python benchmark.py --scales 1 10 100 --output benchmark_baseline.json
+    python benchmark.py --compare benchmark_baseline.json
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import annual_calculations
+import long_term_simulations
+import result_cache
+import trade_simulations
+
+#rows of SP500_whole.csv, the 1x scale
+reference_rows = 18699
+
+
+def synthetic_prices(scale=1, seed=0, start="1950-01-03", end="2024-04-25"):
+    """
+    Generates a geometric random walk in the layout of the preprocessed price files
+    Parameters
+    ----------
+    scale: int
+        The number of bars per business day
+    seed: int
+        The seed of the random walk
+    start: str
+        The first day
+    end: str
+        The last day
+
+    Returns
+    -------
+    df: pd.DataFrame
+        The Date, Close, Year and Month columns
+    """
+    days = pd.bdate_range(start, end)
+    if scale == 1:
+        dates = days
+        labels = dates.strftime("%Y-%m-%d")
+    else:
+        #bars spread over the 6.5 hour trading session
+        offsets = pd.to_timedelta(np.arange(scale) * (390 // scale), unit="min") + pd.Timedelta(hours=9, minutes=30)
+        dates = pd.DatetimeIndex((days.values[:, None] + offsets.values[None, :]).ravel())
+        labels = dates.strftime("%Y-%m-%d %H:%M:%S")
+
+    rng = np.random.default_rng(seed)
+    drift = 0.07 / 252 / scale
+    volatility = 0.16 / np.sqrt(252 * scale)
+    close = 17 * np.exp(np.cumsum(rng.normal(drift, volatility, len(dates))))
+
+    return pd.DataFrame({"Date": labels,
+                         "Close": close.round(4),
+                         "Year": dates.year.values,
+                         "Month": dates.month.values})
+
+
+def benchmark_cases():
+    """
+    Returns the (name, function of the synthetic frame) pairs that are benchmarked
+    """
+    return [
+        ("compute_annual_returns_stocks", annual_calculations.compute_annual_returns_stocks),
+        ("compute_annual_returns_commodity", annual_calculations.compute_annual_returns_commodity),
+        ("compute_annual_returns_stocks_individually", annual_calculations.compute_annual_returns_stocks_individually),
+        ("compute_annual_returns_stocks_individually_display", annual_calculations.compute_annual_returns_stocks_individually_display),
+        ("compute_annual_returns_gold_individually", annual_calculations.compute_annual_returns_gold_individually),
+        ("simulate_control_group", trade_simulations.simulate_control_group),
+        ("simulate_control_group_gold", trade_simulations.simulate_control_group_gold),
+        ("simulate_trade_EMA", lambda df: trade_simulations.simulate_trade_EMA(df, EMA1=3, EMA2=5)),
+        ("simulate_trade_EMA_gold", lambda df: trade_simulations.simulate_trade_EMA_gold(df.set_index("Date"), EMA1=3, EMA2=5)),
+        ("simulate_twenty_years_of_investment", lambda df: long_term_simulations.simulate_twenty_years_of_investment(df, sample_size=30, seed=0)),
+        ("simulate_twenty_years_of_investment_gold", lambda df: long_term_simulations.simulate_twenty_years_of_investment_gold(df, sample_size=30)),
+        ("horizon_returns_stocks", long_term_simulations.horizon_returns_stocks),
+        ("horizon_returns_gold", long_term_simulations.horizon_returns_gold),
+    ]
+
+
+def run_benchmarks(scales=(1, 10, 100), repeat=3, names=None):
+    """
+    Times every benchmark case at every scale
+    Parameters
+    ----------
+    scales: iterable
+        The data sizes, as multiples of SP500_whole.csv
+    repeat: int
+        The number of timed runs, the best one is kept
+    names: iterable
+        The cases to run, all of them by default
+
+    Returns
+    -------
+    results: list
+        One record per case and scale with the rows, seconds and peak memory in bytes
+    """
+    #every run has to compute its result
+    result_cache.enabled = False
+    results = []
+    for scale in scales:
+        df = synthetic_prices(scale)
+        for name, function in benchmark_cases():
+            if names and name not in names:
+                continue
+
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function(df)
+                timings.append(time.perf_counter() - start)
+
+            #memory is traced in its own run, tracing slows the timed runs down
+            tracemalloc.start()
+            function(df)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results.append({"function": name, "scale": scale, "rows": len(df), "seconds": min(timings), "peak_bytes": peak})
+            print(f"{name:<52} x{scale:<4} {min(timings) * 1000:>10.2f} ms {peak / 2**20:>9.2f} MiB", file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, tolerance=1.25, noise_floor=0.005):
+    """
+    Compares results with a saved baseline
+    Parameters
+    ----------
+    results: list
+        The records of run_benchmarks
+    baseline: dict
+        A document written by this script
+    tolerance: float
+        The slowdown or memory growth ratio reported as a regression
+    noise_floor: float
+        Timings below this many seconds are too noisy to be reported as regressions
+
+    Returns
+    -------
+    regressions: list
+        The (function, scale, metric, ratio) of every regression
+    """
+    reference = {(record["function"], record["scale"]): record for record in baseline["results"]}
+    regressions = []
+    for record in results:
+        previous = reference.get((record["function"], record["scale"]))
+        if previous is None:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            ratio = record[metric] / previous[metric] if previous[metric] else float("inf")
+            print(f"{record['function']:<52} x{record['scale']:<4} {metric:<10} {ratio:>6.2f}x")
+            if ratio > tolerance and not (metric == "seconds" and record[metric] < noise_floor):
+                regressions.append((record["function"], record["scale"], metric, ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", help="names of the functions to benchmark")
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument("--compare", help="baseline JSON file the results are compared with")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scales, args.repeat, args.only)
+    document = {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "pandas": pd.__version__,
+                "machine": platform.platform(),
+                "results": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(document, file, indent=1)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for function, scale, metric, ratio in regressions:
+            print(f"regression: {function} x{scale} {metric} {ratio:.2f}x")
+        sys.exit(1 if regressions else 0)
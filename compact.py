@@ -0,0 +1,145 @@
+"""
+Compact in-memory layout of price histories.
+
+A CompactPrices holds datetime64[D] dates, int16 years, int8 months and float64 or,
+optionally, float32 closes (15 to 19 bytes per row against about 100 for a frame read
+from the CSV), plus boolean signal columns packed 8 rows to a byte. The analysis
+functions accept it like a price DataFrame. Running `python compact.py` prints the
+memory per million rows of each layout.
+"""
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+class CompactPrices:
+    """
+    Price history in compact typed arrays.
+
+    Parameters
+    ----------
+    dates: array-like
+        The date of each row
+    close: array-like
+        The close price of each row
+    years: array-like
+        The year of each row, derived from the dates when None
+    months: array-like
+        The month (1-12) of each row, derived from the dates when None
+    float32: bool
+        Whether to store the closes in single precision, halving their size at the cost
+        of about 7 significant digits
+    """
+
+    def __init__(self, dates, close, years=None, months=None, float32=False):
+        dates = np.asarray(dates)
+        if dates.dtype.kind != "M":
+            dates = pd.to_datetime(dates).values
+        self.dates = dates.astype("datetime64[D]")
+        self.close = np.ascontiguousarray(close, dtype=np.float32 if float32 else np.float64)
+        if years is None:
+            years = self.dates.astype("datetime64[Y]").astype(int) + 1970
+        if months is None:
+            months = self.dates.astype("datetime64[M]").astype(int) % 12 + 1
+        self.years = np.ascontiguousarray(years, dtype=np.int16)
+        self.months = np.ascontiguousarray(months, dtype=np.int8)
+        self.signals = {}
+        self._frame = None
+
+    @classmethod
+    def from_frame(cls, df, float32=False):
+        """
+        Builds the compact layout of a price frame with Close and Date (column or index)
+        and optionally Year and Month columns
+        """
+        return cls(df["Date"].values if "Date" in df.columns else df.index.values, df["Close"].values,
+                   df["Year"].values if "Year" in df.columns else None,
+                   df["Month"].values if "Month" in df.columns else None, float32)
+
+    def __len__(self):
+        return len(self.close)
+
+    def __repr__(self):
+        return f"CompactPrices({len(self)} rows, {self.close.dtype}, {self.nbytes / 2**20:.2f} MiB)"
+
+    def add_signal(self, name, values):
+        """
+        Stores a boolean column (e.g. the Buy or Sell signals) packed 8 rows to a byte
+        """
+        values = np.asarray(values, dtype=bool)
+        if len(values) != len(self):
+            raise ValueError(f"Signal {name!r} has {len(values)} rows, expected {len(self)}")
+        self.signals[name] = np.packbits(values)
+
+    def signal(self, name):
+        """
+        Returns a boolean column stored with add_signal
+        """
+        return np.unpackbits(self.signals[name], count=len(self)).astype(bool)
+
+    @property
+    def nbytes(self):
+        """
+        The bytes held by the arrays
+        """
+        return (self.dates.nbytes + self.close.nbytes + self.years.nbytes + self.months.nbytes
+                + sum(packed.nbytes for packed in self.signals.values()))
+
+    def frame(self):
+        """
+        Returns the Date, Close, Year and Month columns as a DataFrame indexed by date.
+        pandas has no day resolution, the dates are held as datetime64[s].
+        """
+        if self._frame is None:
+            dates = self.dates.astype("datetime64[s]")
+            self._frame = pd.DataFrame({"Date": dates, "Close": self.close, "Year": self.years, "Month": self.months},
+                                       index=pd.DatetimeIndex(dates, copy=False), copy=False)
+        return self._frame
+
+    def content_hash(self):
+        """
+        Returns a hash of the prices and signals
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        for values in [self.dates, self.close, self.years, self.months] + list(self.signals.values()):
+            digest.update(values.dtype.str.encode())
+            digest.update(np.ascontiguousarray(values).view(np.uint8))
+        digest.update(repr(sorted(self.signals)).encode())
+        return digest.hexdigest()
+
+
+def memory_per_million_rows(name="SP500_whole"):
+    """
+    Measures the memory of the layouts of a preprocessed price file, scaled to a million rows
+    Parameters
+    ----------
+    name: str
+        The preprocessed file measured
+
+    Returns
+    -------
+    sizes: pd.Series
+        The MiB per million rows of each layout
+    """
+    from loader import data_path, load_preprocessed
+
+    raw = pd.read_csv(data_path / (name + ".csv"))
+    rows = len(raw)
+    #the simulators of the notebook kept the EMAs and signals as float64 and bool columns
+    signals = pd.DataFrame({"EMA 12": np.zeros(rows), "EMA 26": np.zeros(rows),
+                            "Buy": np.zeros(rows, dtype=bool), "Sell": np.zeros(rows, dtype=bool)})
+    compact = load_preprocessed(name, compact=True)
+    compact32 = load_preprocessed(name, compact=True, float32=True)
+    compact32.add_signal("Buy", np.zeros(rows, dtype=bool))
+    compact32.add_signal("Sell", np.zeros(rows, dtype=bool))
+
+    sizes = {"CSV frame (string dates, int64)": raw.memory_usage(deep=True).sum(),
+             "CSV frame + EMA and signal columns": raw.memory_usage(deep=True).sum() + signals.memory_usage().sum(),
+             "typed frame (load_preprocessed)": load_preprocessed(name).memory_usage(deep=True).sum(),
+             "compact": compact.nbytes,
+             "compact float32 + 2 packed signals": compact32.nbytes}
+    return pd.Series({layout: size / rows * 1e6 / 2**20 for layout, size in sizes.items()}, name="MiB per million rows")
+
+
+if __name__ == "__main__":
+    print(memory_per_million_rows().round(2).to_string())
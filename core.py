@@ -0,0 +1,84 @@
+"""
+Numeric entry point of the analysis.
+
+Importing this module only loads NumPy, pandas and the data tables; plotting
+(display_EMA) loads its libraries on first use, and the daily total-return and
+rolling-window functions their modules on first access. Running
+`python core.py` measures the import time against import_time_budget.
+"""
+from annual_calculations import (compute_annual_returns_commodity, compute_annual_returns_gold_individually,
+                                 compute_annual_returns_stocks, compute_annual_returns_stocks_individually,
+                                 compute_annual_returns_stocks_individually_display, monthly_close_means,
+                                 price_monthly_means, price_yearly_means, yearly_close_means)
+from long_term_simulations import (holding_period_returns_gold, holding_period_returns_stocks, horizon_returns_gold,
+                                   horizon_returns_stocks, simulate_twenty_years_of_investment,
+                                   simulate_twenty_years_of_investment_gold)
+from compact import CompactPrices
+from price_index import PriceSeries
+from panel import AssetSpec, align_prices, gold_spec, panel_annual_returns, panel_control_group, panel_trade_EMA, spy_spec
+from trade_simulations import (simulate_control_group, simulate_control_group_gold, simulate_trade_EMA,
+                               simulate_trade_EMA_gold, sweep_trade_EMA, trade_statistics)
+
+#re-exported on first access, their modules are not imported with core
+_lazy_exports = {"rolling_returns": "rolling_returns",
+                 "TotalReturnIndex": "total_return",
+                 "load_total_return": "total_return"}
+
+
+def __getattr__(name):
+    if name not in _lazy_exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    return getattr(importlib.import_module(_lazy_exports[name]), name)
+
+
+#seconds allowed for importing core on top of numpy and pandas
+import_time_budget = 0.05
+
+#libraries that must not be loaded by importing core
+heavy_modules = ("matplotlib", "mplfinance", "tqdm", "scipy")
+
+
+def measure_import_time(module="core", repeat=5):
+    """
+    Measures the time to import a module in fresh interpreters, after numpy and pandas are loaded
+    Parameters
+    ----------
+    module: str
+        The module imported
+    repeat: int
+        The number of interpreters started
+
+    Returns
+    -------
+    seconds: float
+        The median import time
+    loaded: list
+        The heavy modules loaded by the import
+    """
+    import json
+    import os
+    import statistics
+    import subprocess
+    import sys
+
+    code = ("import json, sys, time, numpy, pandas\n"
+            "start = time.perf_counter()\n"
+            f"import {module}\n"
+            "elapsed = time.perf_counter() - start\n"
+            f"print(json.dumps([elapsed, [name for name in {heavy_modules!r} if name in sys.modules]]))")
+    runs = [json.loads(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                      cwd=os.path.dirname(os.path.abspath(__file__))).stdout)
+            for _ in range(repeat)]
+    return statistics.median(elapsed for elapsed, _ in runs), sorted({name for _, loaded in runs for name in loaded})
+
+
+if __name__ == "__main__":
+    import sys
+
+    seconds, loaded = measure_import_time()
+    print(f"import core: {seconds * 1000:.1f} ms (budget {import_time_budget * 1000:.0f} ms)")
+    if loaded:
+        print("heavy modules loaded:", ", ".join(loaded))
+    sys.exit(seconds > import_time_budget or bool(loaded))
@@ -1,265 +1,79 @@
-cpi = {1913: 9.9,
- 1914: 10.0,
- 1915: 10.1,
- 1916: 10.9,
- 1917: 12.8,
- 1918: 15.0,
- 1919: 17.3,
- 1920: 20.0,
- 1921: 17.9,
- 1922: 16.8,
- 1923: 17.1,
- 1924: 17.1,
- 1925: 17.5,
- 1926: 17.7,
- 1927: 17.4,
- 1928: 17.2,
- 1929: 17.2,
- 1930: 16.7,
- 1931: 15.2,
- 1932: 13.6,
- 1933: 12.9,
- 1934: 13.4,
- 1935: 13.7,
- 1936: 13.9,
- 1937: 14.4,
- 1938: 14.1,
- 1939: 13.9,
- 1940: 14.0,
- 1941: 14.7,
- 1942: 16.3,
- 1943: 17.3,
- 1944: 17.6,
- 1945: 18.0,
- 1946: 19.5,
- 1947: 22.3,
- 1948: 24.0,
- 1949: 23.8,
- 1950: 24.1,
- 1951: 26.0,
- 1952: 26.6,
- 1953: 26.8,
- 1954: 26.9,
- 1955: 26.8,
- 1956: 27.2,
- 1957: 28.1,
- 1958: 28.9,
- 1959: 29.2,
- 1960: 29.6,
- 1961: 29.9,
- 1962: 30.3,
- 1963: 30.6,
- 1964: 31.0,
- 1965: 31.5,
- 1966: 32.5,
- 1967: 33.4,
- 1968: 34.8,
- 1969: 36.7,
- 1970: 38.8,
- 1971: 40.5,
- 1972: 41.8,
- 1973: 44.4,
- 1974: 49.3,
- 1975: 53.8,
- 1976: 56.9,
- 1977: 60.6,
- 1978: 65.2,
- 1979: 72.6,
- 1980: 82.4,
- 1981: 90.9,
- 1982: 96.5,
- 1983: 99.6,
- 1984: 103.9,
- 1985: 107.6,
- 1986: 109.6,
- 1987: 113.6,
- 1988: 118.3,
- 1989: 124.0,
- 1990: 130.7,
- 1991: 136.2,
- 1992: 140.3,
- 1993: 144.5,
- 1994: 148.2,
- 1995: 152.4,
- 1996: 156.9,
- 1997: 160.5,
- 1998: 163.0,
- 1999: 166.6,
- 2000: 172.2,
- 2001: 177.1,
- 2002: 179.9,
- 2003: 184.0,
- 2004: 188.9,
- 2005: 195.3,
- 2006: 201.6,
- 2007: 207.3,
- 2008: 215.3,
- 2009: 214.5,
- 2010: 218.1,
- 2011: 224.9,
- 2012: 229.6,
- 2013: 233.0,
- 2014: 236.7,
- 2015: 237.0,
- 2016: 240.0,
- 2017: 245.1,
- 2018: 251.1,
- 2019: 255.7,
- 2020: 258.8,
- 2021: 271.0,
- 2022: 292.7,
- 2023: 304.7}
+import csv
+import pathlib
+import numpy as np
 
-divs = {2023: 1.5,
- 2022: 1.71,
- 2021: 1.29,
- 2020: 1.58,
- 2019: 1.83,
- 2018: 2.09,
- 2017: 1.84,
- 2016: 2.03,
- 2015: 2.11,
- 2014: 1.92,
- 2013: 1.94,
- 2012: 2.2,
- 2011: 2.13,
- 2010: 1.83,
- 2009: 2.02,
- 2008: 3.23,
- 2007: 1.87,
- 2006: 1.76,
- 2005: 1.76,
- 2004: 1.62,
- 2003: 1.61,
- 2002: 1.79,
- 2001: 1.37,
- 2000: 1.22,
- 1999: 1.17,
- 1998: 1.36,
- 1997: 1.61,
- 1996: 2.0,
- 1995: 2.24,
- 1994: 2.89,
- 1993: 2.7,
- 1992: 2.84,
- 1991: 3.14,
- 1990: 3.68,
- 1989: 3.17,
- 1988: 3.53,
- 1987: 3.66,
- 1986: 3.33,
- 1985: 3.81,
- 1984: 4.58,
- 1983: 4.31,
- 1982: 4.93,
- 1981: 5.36,
- 1980: 4.61,
- 1979: 5.24,
- 1978: 5.28,
- 1977: 4.98,
- 1976: 3.87,
- 1975: 4.15,
- 1974: 5.37,
- 1973: 3.57,
- 1972: 2.68,
- 1971: 3.1,
- 1970: 3.49,
- 1969: 3.47,
- 1968: 2.88,
- 1967: 3.06,
- 1966: 3.53,
- 1965: 2.97,
- 1964: 2.98,
- 1963: 3.07,
- 1962: 3.4,
- 1961: 2.82,
- 1960: 3.43,
- 1959: 3.1,
- 1958: 3.27,
- 1957: 4.44,
- 1956: 3.75,
- 1955: 3.61,
- 1954: 4.4,
- 1953: 5.84,
- 1952: 5.41,
- 1951: 6.02,
- 1950: 7.44,
- 1949: 6.89,
- 1948: 6.12,
- 1947: 5.59,
- 1946: 4.69,
- 1945: 3.81,
- 1944: 4.89,
- 1943: 5.31,
- 1942: 6.2,
- 1941: 8.11,
- 1940: 6.36,
- 1939: 5.01,
- 1938: 4.02,
- 1937: 7.26,
- 1936: 4.22,
- 1935: 3.6,
- 1934: 4.86,
- 1933: 4.41,
- 1932: 7.33,
- 1931: 9.72,
- 1930: 6.32,
- 1929: 4.53,
- 1928: 3.67,
- 1927: 4.41,
- 1926: 5.11,
- 1925: 4.82,
- 1924: 5.41,
- 1923: 6.2,
- 1922: 5.81,
- 1921: 6.29,
- 1920: 7.49,
- 1919: 5.94,
- 1918: 7.22,
- 1917: 10.15,
- 1916: 5.71,
- 1915: 4.54,
- 1914: 5.71,
- 1913: 5.97,
- 1912: 5.12,
- 1911: 5.16,
- 1910: 5.19,
- 1909: 4.27,
- 1908: 4.43,
- 1907: 6.7,
- 1906: 4.07,
- 1905: 3.46,
- 1904: 3.76,
- 1903: 5.33,
- 1902: 4.1,
- 1901: 4.03,
- 1900: 4.37,
- 1899: 3.49,
- 1898: 3.54,
- 1897: 3.79,
- 1896: 4.27,
- 1895: 4.4,
- 1894: 4.88,
- 1893: 5.67,
- 1892: 4.36,
- 1891: 4.07,
- 1890: 4.78,
- 1889: 4.14,
- 1888: 4.47,
- 1887: 4.74,
- 1886: 3.9,
- 1885: 4.62,
- 1884: 7.14,
- 1883: 6.18,
- 1882: 5.48,
- 1881: 5.32,
- 1880: 4.45,
- 1879: 4.07,
- 1878: 5.22,
- 1877: 5.85,
- 1876: 8.38,
- 1875: 6.86,
- 1874: 7.27,
- 1873: 7.47,
- 1872: 5.92,
- 1871: 5.49}
\ No newline at end of file
+__all__ = ["cpi", "divs", "YearTable", "cpi_table", "divs_table", "inflation_ratios", "deflators"]
+
+data_path = pathlib.Path(__file__).resolve().parent / "Preprocessed Data"
+
+
+class YearTable:
+    """
+    Yearly values stored in a contiguous array offset by the first year.
+
+    Indexing with a year returns its value, indexing with an array of years returns
+    the values of the whole array in one fancy-indexing operation. Years outside the
+    table raise KeyError like the dictionaries do.
+
+    Parameters
+    ----------
+    first_year: int
+        The year of values[0]
+    values: array-like
+        The value of each consecutive year, NaN for the missing years
+    """
+
+    def __init__(self, first_year, values):
+        self.first_year = first_year
+        self.values = np.ascontiguousarray(values, dtype=float)
+        self.values.flags.writeable = False
+
+    @property
+    def last_year(self):
+        return self.first_year + len(self.values) - 1
+
+    @property
+    def years(self):
+        return np.arange(self.first_year, self.last_year + 1)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, years):
+        offsets = np.asarray(years) - self.first_year
+        if np.any((offsets < 0) | (offsets >= len(self.values))):
+            raise KeyError(years)
+        values = self.values[offsets]
+        if np.any(np.isnan(values)):
+            raise KeyError(years)
+        return values
+
+    def to_dict(self):
+        return {int(year): float(value) for year, value in zip(self.years, self.values) if not np.isnan(value)}
+
+    @classmethod
+    def from_csv(cls, path, value_column):
+        """
+        Builds the table from a CSV with a Year column
+        """
+        with open(path, newline="") as file:
+            rows = {int(row["Year"]): float(row[value_column]) for row in csv.DictReader(file)}
+        first_year = min(rows)
+        values = np.full(max(rows) - first_year + 1, np.nan)
+        for year, value in rows.items():
+            values[year - first_year] = value
+        return cls(first_year, values)
+
+
+#annual average CPI and SP500 year end dividend yield (%), see ingestion.py
+cpi_table = YearTable.from_csv(data_path / "CPI_adjusted.csv", "CPI")
+divs_table = YearTable.from_csv(data_path / "Dividend_yield.csv", "Yield")
+
+#cpi[year] / cpi[year - 1]
+inflation_ratios = YearTable(cpi_table.first_year + 1, cpi_table.values[1:] / cpi_table.values[:-1])
+
+#multiplying a value of a year by its deflator expresses it in the prices of the last CPI year (2023)
+deflators = YearTable(cpi_table.first_year, cpi_table.values[-1] / cpi_table.values)
+
+cpi = cpi_table.to_dict()
+divs = divs_table.to_dict()
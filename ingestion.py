@@ -0,0 +1,249 @@
+import argparse
+import csv
+import datetime
+import io
+import os
+import pathlib
+import pandas as pd
+from loader import data_path
+
+raw_path = pathlib.Path(__file__).resolve().parent / "Raw Data"
+
+#raw price files of each preprocessed file, in priority order: a source only contributes
+#the dates after the last date of the sources before it (the 2014-2023 file repeats
+#2014-2018 and carries holiday rows the 1950-2018 file does not have)
+price_sources = {
+    "SP500_whole": [
+        {"file": "SPX500 (1950-2018).csv", "close": "Close", "date_format": "%Y-%m-%d", "newest_first": False},
+        {"file": "SPX500 (2014-2023).csv", "close": "Close/Last", "date_format": "%m/%d/%Y", "newest_first": True},
+    ],
+    "Gold_prices": [
+        {"file": "Gold_prices.csv", "close": "Close", "date_format": "%Y-%m-%d", "newest_first": False},
+    ],
+}
+first_year = 1950
+
+
+def _reverse_lines(path, block_size=1 << 16):
+    """
+    Yields the lines of a file from the last one to the first one without reading the whole file
+    """
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        remainder = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            lines = (file.read(step) + remainder).split(b"\n")
+            remainder = lines[0]
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    yield line.decode("utf-8-sig")
+        if remainder.strip():
+            yield remainder.decode("utf-8-sig")
+
+
+def _last_date(path, date_format="%Y-%m-%d", newest_first=False):
+    """
+    Returns the most recent date of a CSV file, None when the file has no rows
+    """
+    with open(path, encoding="utf-8-sig") as file:
+        header = next(csv.reader(file))
+        if newest_first:
+            row = next(csv.reader(file), None)
+            return None if row is None else datetime.datetime.strptime(row[header.index("Date")], date_format).date()
+
+    for line in _reverse_lines(path):
+        row = next(csv.reader([line]))
+        if row == header:
+            return None
+        return datetime.datetime.strptime(row[header.index("Date")], date_format).date()
+
+
+def _read_prices(source, after=None):
+    """
+    Reads the Date and Close columns of a raw price file, normalized to ISO dates in ascending order
+    Parameters
+    ----------
+    source: dict
+        The description of the raw file, see price_sources
+    after: datetime.date
+        When given, only the rows after this date are parsed
+
+    Returns
+    -------
+    prices: pd.DataFrame
+        The Date (datetime64) and Close columns
+    """
+    path = raw_path / source["file"]
+    if after is None:
+        raw = pd.read_csv(path, usecols=["Date", source["close"]])
+    else:
+        #walk from the newest row backwards and stop at the first row already ingested
+        with open(path, encoding="utf-8-sig") as file:
+            header = next(csv.reader(file))
+            lines = file if source["newest_first"] else _reverse_lines(path)
+            date_column = header.index("Date")
+            new_lines = []
+            for line in lines:
+                row = next(csv.reader([line]))
+                if not row or row == header:
+                    continue
+                if datetime.datetime.strptime(row[date_column], source["date_format"]).date() <= after:
+                    break
+                new_lines.append(line.rstrip("\n"))
+        raw = pd.read_csv(io.StringIO("\n".join([",".join(header)] + new_lines)), usecols=["Date", source["close"]])
+
+    prices = pd.DataFrame({"Date": pd.to_datetime(raw["Date"], format=source["date_format"]),
+                           "Close": raw[source["close"]].values})
+    return prices.dropna().sort_values("Date", kind="stable")
+
+
+def _format(prices):
+    """
+    Converts normalized prices to the Date,Close,Year,Month layout of Preprocessed Data
+    """
+    prices = prices[prices["Date"].dt.year >= first_year]
+    return pd.DataFrame({"Date": prices["Date"].dt.strftime("%Y-%m-%d"),
+                         "Close": prices["Close"].values,
+                         "Year": prices["Date"].dt.year.values,
+                         "Month": prices["Date"].dt.month.values})
+
+
+def ingest_prices(name, full=False):
+    """
+    Brings a preprocessed price file up to date with its raw sources.
+
+    Every source is normalized to ISO dates, deduplicated against the sources before
+    it and the result is appended to the preprocessed file. Unless full is set only
+    the raw rows newer than the last ingested date are parsed.
+
+    Parameters
+    ----------
+    name: str
+        The preprocessed file, one of price_sources
+    full: bool
+        Whether to rebuild the preprocessed file from every raw row
+
+    Returns
+    -------
+    appended: int
+        The number of rows written
+    """
+    target = data_path / (name + ".csv")
+    last_ingested = None if full or not target.exists() else _last_date(target)
+
+    frames = []
+    covered_until = None
+    for source in price_sources[name]:
+        prices = _read_prices(source, after=last_ingested)
+        if covered_until is not None:
+            prices = prices[prices["Date"] > covered_until]
+        frames.append(prices)
+
+        source_end = _last_date(raw_path / source["file"], source["date_format"], source["newest_first"])
+        if source_end is not None:
+            source_end = pd.Timestamp(source_end)
+            covered_until = source_end if covered_until is None else max(covered_until, source_end)
+
+    new_rows = _format(pd.concat(frames).sort_values("Date", kind="stable"))
+    if last_ingested is None:
+        new_rows.to_csv(target, index=False)
+    else:
+        new_rows.to_csv(target, mode="a", header=False, index=False)
+    return len(new_rows)
+
+
+def _parse_percentage(value):
+    """
+    Parses values such as "1.50%" or "†\n1.36%" into floats
+    """
+    return float(value.replace("†", "").replace("%", "").strip())
+
+
+def ingest_dividend_yield(full=False):
+    """
+    Brings Preprocessed Data/Dividend_yield.csv (Year, Yield in %) up to date with the
+    year end values of the raw SP500 dividend yield file. The partial current year is skipped.
+    Parameters
+    ----------
+    full: bool
+        Whether to rebuild the file from every raw row
+
+    Returns
+    -------
+    appended: int
+        The number of years written
+    """
+    target = data_path / "Dividend_yield.csv"
+    last_year = None
+    if not full and target.exists():
+        last_line = next(_reverse_lines(target))
+        last_year = None if last_line.startswith("Year") else int(last_line.split(",")[0])
+
+    #newest first, the values of the current year carry a footnote mark and a line break
+    years = []
+    with open(raw_path / "SPX500 Dividend Yield.csv", encoding="utf-8-sig", newline="") as file:
+        for row in csv.DictReader(file):
+            date = datetime.datetime.strptime(row["Date"], "%b %d, %Y").date()
+            if (date.month, date.day) != (12, 31):
+                continue
+            if last_year is not None and date.year <= last_year:
+                break
+            years.append((date.year, _parse_percentage(row["Value"])))
+
+    new_rows = pd.DataFrame(sorted(years), columns=["Year", "Yield"])
+    if last_year is None:
+        new_rows.to_csv(target, index=False)
+    else:
+        new_rows.to_csv(target, mode="a", header=False, index=False)
+    return len(new_rows)
+
+
+def ingest_cpi():
+    """
+    Rewrites Preprocessed Data/CPI_adjusted.csv (Year, CPI) from the raw annual average CPI file
+
+    Returns
+    -------
+    written: int
+        The number of years written
+    """
+    raw = pd.read_csv(raw_path / "CPI.csv", encoding="utf-8-sig").dropna()
+    cpi = pd.DataFrame({"Year": raw.iloc[:, 0].astype(int).values,
+                        "CPI": raw.iloc[:, 1].astype(float).values})
+    cpi.to_csv(data_path / "CPI_adjusted.csv", index=False)
+    return len(cpi)
+
+
+def refresh(full=False):
+    """
+    Runs every ingestion step
+    Parameters
+    ----------
+    full: bool
+        Whether to rebuild the preprocessed files from every raw row
+
+    Returns
+    -------
+    written: dict
+        The number of rows written to each preprocessed file
+    """
+    written = {name: ingest_prices(name, full=full) for name in price_sources}
+    written["Dividend_yield"] = ingest_dividend_yield(full=full)
+    written["CPI_adjusted"] = ingest_cpi()
+
+    #the daily total-return indexes depend on all the files above
+    from total_return import dividend_files, load_total_return
+
+    for name in dividend_files:
+        written[name + " total return"] = len(load_total_return(name))
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingests Raw Data into Preprocessed Data")
+    parser.add_argument("--full", action="store_true", help="rebuild the preprocessed files from every raw row")
+    print(refresh(full=parser.parse_args().full))
@@ -0,0 +1,220 @@
+"""
+Opt-in instrumentation of the simulation stages.
+
+The simulators mark their stages (load, indicators, signals, yearly loop, assembly)
+with stage(); nothing is recorded unless a recording is active, in which case every
+stage records its wall time, the rows it scanned, its filter calls and optionally the
+memory it allocated. Stages nest, the recorded events export as JSON or as a Chrome
+trace (chrome://tracing, Perfetto, speedscope).
+
+    with recording() as recorder:
+        simulate_trade_EMA(df)
+    recorder.to_chrome_trace("trade.trace.json")
+"""
+import json
+import time
+import tracemalloc
+
+_recorder = None
+
+
+class _NullStage:
+    """
+    The stage returned while nothing is recorded, every call is a no-op
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def add(self, rows=0, filter_calls=0):
+        pass
+
+
+_null_stage = _NullStage()
+
+
+class _Stage:
+    """
+    A stage being recorded, see stage
+    """
+
+    def __init__(self, recorder, name, rows):
+        self.recorder = recorder
+        self.name = name
+        self.rows = rows
+        self.filter_calls = 0
+        self.peak = 0
+
+    def add(self, rows=0, filter_calls=0):
+        """
+        Adds scanned rows and filter calls to the stage
+        """
+        self.rows += rows
+        self.filter_calls += filter_calls
+
+    def __enter__(self):
+        recorder = self.recorder
+        self.parent = recorder.stack[-1] if recorder.stack else None
+        self.path = self.parent.path + "/" + self.name if self.parent else self.name
+        recorder.stack.append(self)
+        if recorder.allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = current
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        recorder = self.recorder
+        recorder.stack.pop()
+        event = {"stage": self.path,
+                 "depth": len(recorder.stack),
+                 "start": self.start - recorder.origin,
+                 "seconds": end - self.start,
+                 "rows": self.rows,
+                 "filter_calls": self.filter_calls}
+        if recorder.allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            if self.parent is not None:
+                self.parent.peak = max(self.parent.peak, self.peak)
+            event["allocated_bytes"] = current - self.start_memory
+            event["peak_bytes"] = self.peak - self.start_memory
+        recorder.events.append(event)
+        return False
+
+
+class Recorder:
+    """
+    Collects the stage events of a recording.
+
+    Parameters
+    ----------
+    allocations: bool
+        Whether to trace the memory allocated by every stage (net allocation and peak),
+        tracing slows the stages down
+    """
+
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self.events = []
+        self.stack = []
+        self.origin = time.perf_counter()
+
+    def to_dict(self):
+        return {"allocations": self.allocations, "events": list(self.events)}
+
+    def to_json(self, path=None):
+        """
+        Exports the events as JSON
+        Parameters
+        ----------
+        path: str or pathlib.Path
+            The file written, the JSON is returned as a string when None
+        """
+        document = json.dumps(self.to_dict(), indent=1)
+        if path is None:
+            return document
+        with open(path, "w") as file:
+            file.write(document)
+
+    def to_chrome_trace(self, path=None):
+        """
+        Exports the events in the Chrome trace event format
+        Parameters
+        ----------
+        path: str or pathlib.Path
+            The file written, the trace is returned as a dict when None
+        """
+        trace = {"traceEvents": [{"name": event["stage"].rsplit("/", 1)[-1],
+                                  "cat": event["stage"].split("/", 1)[0],
+                                  "ph": "X",
+                                  "ts": event["start"] * 1e6,
+                                  "dur": event["seconds"] * 1e6,
+                                  "pid": 1,
+                                  "tid": 1,
+                                  "args": {key: value for key, value in event.items()
+                                           if key not in ("stage", "depth", "start", "seconds")}}
+                                 for event in self.events],
+                 "displayTimeUnit": "ms"}
+        if path is None:
+            return trace
+        with open(path, "w") as file:
+            json.dump(trace, file)
+
+    def summary(self):
+        """
+        Aggregates the events of every stage
+        Returns
+        -------
+        summary: pd.DataFrame
+            The calls, total seconds, rows and filter calls (and allocations) per stage
+        """
+        import pandas as pd
+
+        columns = ["seconds", "rows", "filter_calls"]
+        if self.allocations:
+            columns += ["allocated_bytes", "peak_bytes"]
+        events = pd.DataFrame(self.events, columns=["stage"] + columns)
+        aggregations = {column: "sum" for column in columns}
+        if self.allocations:
+            aggregations["peak_bytes"] = "max"
+        summary = events.groupby("stage", sort=False).agg(aggregations)
+        summary.insert(0, "calls", events.groupby("stage", sort=False).size())
+        return summary
+
+
+def stage(name, rows=0):
+    """
+    Marks a stage of a simulation
+    Parameters
+    ----------
+    name: str
+        The name of the stage, nested stages are recorded as "outer/inner"
+    rows: int
+        The number of rows scanned by the stage, more can be added with add()
+
+    Returns
+    -------
+    stage: context manager
+        Records the stage on exit when a recording is active, does nothing otherwise
+    """
+    if _recorder is None:
+        return _null_stage
+    return _Stage(_recorder, name, rows)
+
+
+class recording:
+    """
+    Records the stages run inside the with block, the Recorder is returned by __enter__.
+
+    Parameters
+    ----------
+    allocations: bool
+        Whether to trace the memory allocated by every stage
+    """
+
+    def __init__(self, allocations=False):
+        self.recorder = Recorder(allocations)
+
+    def __enter__(self):
+        global _recorder
+        self.previous = _recorder
+        self.started_tracing = self.recorder.allocations and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        _recorder = self.recorder
+        return self.recorder
+
+    def __exit__(self, *exc_info):
+        global _recorder
+        _recorder = self.previous
+        if self.started_tracing:
+            tracemalloc.stop()
+        return False
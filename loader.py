@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import pathlib
+import numpy as np
+import pandas as pd
+
+data_path = pathlib.Path(__file__).resolve().parent / "Preprocessed Data"
+cache_path = data_path / ".cache"
+
+#typed layout of the known columns, every other column is stored as float64
+column_types = {"Date": "datetime64[D]",
+                "Year": np.int16,
+                "Month": np.int8}
+
+
+def file_hash(path):
+    """
+    Computes the sha256 of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_stamp(path):
+    """
+    Returns the modification time and size of a file
+    """
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _convert(csv_file, array_file, meta_file):
+    """
+    Converts a preprocessed CSV into a typed structured array saved as .npy
+    Parameters
+    ----------
+    csv_file: pathlib.Path
+        The source CSV
+    array_file: pathlib.Path
+        The .npy file written
+    meta_file: pathlib.Path
+        The JSON file recording the state of the source
+    """
+    df = pd.read_csv(csv_file)
+    dtype = np.dtype([(column, column_types.get(column, np.float64)) for column in df.columns])
+    table = np.empty(len(df), dtype=dtype)
+    for column in df.columns:
+        if column == "Date":
+            table[column] = pd.to_datetime(df[column]).values.astype("datetime64[D]")
+        else:
+            table[column] = df[column].values
+
+    #written under a temporary name so that concurrent readers never see a partial file
+    cache_path.mkdir(exist_ok=True)
+    temporary_file = array_file.with_name(array_file.name + f".{os.getpid()}.tmp")
+    with open(temporary_file, "wb") as file:
+        np.save(file, table)
+    os.replace(temporary_file, array_file)
+
+    meta = dict(source_stamp(csv_file), sha256=file_hash(csv_file))
+    temporary_file = meta_file.with_name(meta_file.name + f".{os.getpid()}.tmp")
+    temporary_file.write_text(json.dumps(meta))
+    os.replace(temporary_file, meta_file)
+
+
+def _is_fresh(csv_file, array_file, meta_file):
+    """
+    Checks whether the cached array still matches its source CSV.
+    An unchanged mtime and size is trusted, otherwise the content hash decides.
+    """
+    if not array_file.exists() or not meta_file.exists():
+        return False
+
+    meta = json.loads(meta_file.read_text())
+    stamp = source_stamp(csv_file)
+    if stamp["mtime_ns"] == meta["mtime_ns"] and stamp["size"] == meta["size"]:
+        return True
+    if file_hash(csv_file) != meta["sha256"]:
+        return False
+
+    #touched but unchanged, remember the new mtime to skip hashing next time
+    meta_file.write_text(json.dumps(dict(meta, **stamp)))
+    return True
+
+
+def load_preprocessed(name, as_frame=True, compact=False, float32=False):
+    """
+    Loads a file of Preprocessed Data through its binary cache.
+
+    The first load converts the CSV into a typed .npy file (datetime64 dates, int16
+    years, int8 months, float64 prices) under Preprocessed Data/.cache, later loads
+    memory-map that file. The cache is rebuilt when the CSV changes.
+
+    Only as_frame=False is zero-copy. The DataFrame and the CompactPrices copy every
+    column out of the memory-mapped file into private memory of the process; they skip
+    the CSV parsing but not the copy (pandas has no day resolution dates either).
+
+    Parameters
+    ----------
+    name: str
+        The name of the file, e.g. "SP500_whole" or "SP500_whole.csv"
+    as_frame: bool
+        Whether to return a DataFrame, a writable copy of the columns. Otherwise the
+        read-only memory-mapped structured array is returned without copying, its pages
+        are shared by every process loading it.
+    compact: bool
+        Whether to return the Date, Close, Year and Month columns as a CompactPrices
+        (see compact.py), copied out of the memory-mapped file
+    float32: bool
+        Whether the CompactPrices stores its closes in single precision
+
+    Returns
+    -------
+    data: pd.DataFrame, np.ndarray or CompactPrices
+        The contents of the file
+    """
+    stem = name[:-4] if name.endswith(".csv") else name
+    csv_file = data_path / (stem + ".csv")
+    array_file = cache_path / (stem + ".npy")
+    meta_file = cache_path / (stem + ".json")
+
+    if not _is_fresh(csv_file, array_file, meta_file):
+        _convert(csv_file, array_file, meta_file)
+
+    table = np.load(array_file, mmap_mode="r")
+    if compact:
+        from compact import CompactPrices
+
+        if "Close" not in table.dtype.names:
+            raise ValueError(f"{stem} has no Close column, only price files have a compact layout")
+        return CompactPrices(table["Date"], table["Close"], table["Year"], table["Month"], float32=float32)
+    if not as_frame:
+        return table
+
+    #copied: the frame must stay writable and the Date column is converted to datetime64[s] anyway
+    return pd.DataFrame({column: np.array(table[column]) for column in table.dtype.names})
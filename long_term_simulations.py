@@ -1,76 +1,445 @@
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
 from data import *
-import mplfinance as mpf
-import matplotlib.pyplot as plt
+from annual_calculations import price_yearly_means, yearly_close_means
+from instrumentation import stage
+from result_cache import cached
+from price_index import as_frame, close_prices, year_rows
+from sampling import PurchaseSampler
+from streaming_stats import RunningStats, period_summary
 
-def simulate_twenty_years_of_investment(df, purchase_times=10, sample_size=1, etf_per_purchase=2, expense_ratio=0.00095):
+
+#the result columns of simulate_twenty_years_of_investment
+_twenty_year_columns = ['Capital Invested', 'Portfolio Value', 'Capital Gained', 'Capital Invested Adjusted',
+                        'Portfolio Value Adjusted', '% Change w.o. Dividend', '% Change with Dividend', 'Real Returns']
+
+
+def _twenty_year_results(capital_invested, growth_with_divs, growth_without_divs, start_cpi, end_cpi):
+    """
+    Computes the result columns of simulate_twenty_years_of_investment from the capital
+    invested by each simulation and the growth and CPI of its period (broadcast against it)
+    """
+    portfolio_value = capital_invested * growth_with_divs
+    portfolio_value_not_invested = capital_invested * growth_without_divs
+
+    portfolio_value_adjusted = portfolio_value * cpi[2023] / end_cpi
+    portfolio_value_adjusted_not_invested = portfolio_value_not_invested * cpi[2023] / end_cpi
+    capital_invested_adjusted = capital_invested * cpi[2023] / start_cpi
+
+    percentage_change_not_invested = (portfolio_value_adjusted_not_invested - capital_invested_adjusted) * 100 / capital_invested_adjusted
+    percent_change = (portfolio_value_adjusted - capital_invested_adjusted) * 100 / capital_invested_adjusted
+    return dict(zip(_twenty_year_columns, [capital_invested, portfolio_value, portfolio_value - capital_invested,
+                                           capital_invested_adjusted, portfolio_value_adjusted,
+                                           percentage_change_not_invested, percent_change,
+                                           portfolio_value_adjusted_not_invested - capital_invested_adjusted]))
+
+
+def _total_return_means(df, first_year, last_year, dividends=True):
+    """
+    Computes the yearly means of the daily nominal total return index of the SP500 prices
+    (the close prices when dividends is False). The index persisted by
+    total_return.load_total_return is used when df holds the same prices, it is only
+    built from df otherwise.
+    """
+    from total_return import TotalReturnIndex, load_total_return
+
+    index = df
+    if not isinstance(df, TotalReturnIndex):
+        df = as_frame(df)
+        index = load_total_return("SP500_whole")
+        if len(index) != len(df) or not np.array_equal(index.close, df['Close'].values):
+            index = TotalReturnIndex.from_frame(df, dividends=True)
+    return yearly_close_means(index.years, index.series(real=False, dividends=dividends), first_year, last_year)
+
+
+@cached(stochastic=True)
+def simulate_twenty_years_of_investment(df, purchase_times=10, sample_size=1, etf_per_purchase=2, expense_ratio=0.00095, seed=None,
+                                        aggregate=False, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), batch_size=10000,
+                                        source="annual"):
+    """
+    Simulates buying SPY ETFs at random days of a year and holding them for 20 years
+    Parameters
+    ----------
+    df: pd.DataFrame or PriceSeries
+        The DataFrame containing the SP500 prices
+    purchase_times: int
+        The number of purchases made in the starting year
+    sample_size: int
+        The number of simulations per investment period
+    etf_per_purchase: int
+        The number of ETFs bought by each purchase
+    expense_ratio: float
+        The expense ratio of SPY ETF
+    seed: int
+        The seed of the random purchase days, every start year draws from its own stream
+        (see sampling.PurchaseSampler)
+    aggregate: bool
+        Whether to return running statistics of every period instead of every simulation,
+        in memory independent of sample_size
+    quantiles: tuple
+        The quantiles estimated in aggregate mode
+    batch_size: int
+        The number of simulations drawn at once in aggregate mode; with sample_size <=
+        batch_size the draws are those of the default mode
+    source: str
+        "annual" grows the capital by the yearly mean prices plus the dividend yield minus
+        the expense ratio, "daily" by the yearly means of the daily total return index
+        (dividends reinvested every trading day) minus the expense ratio, see
+        holding_period_returns_stocks. The returns without dividends are the same.
+
+    Returns
+    -------
+    simulation_results: pd.DataFrame
+        One row per simulation with the nominal and real returns of the portfolio, or in
+        aggregate mode one row per period and column (see streaming_stats.period_summary)
+    """
     investment_periods = [(i, i+20) for i in range(1950, 2004)]
-    real_returns = []
+    first_year = investment_periods[0][0]
+    last_year = investment_periods[-1][1]
+
+    with stage("simulate_twenty_years_of_investment", rows=len(df)):
+        with stage("load", rows=len(df)):
+            #rows of each year, in order
+            order, year_offsets = year_rows(df, first_year, last_year)
+            sampler = PurchaseSampler(order, year_offsets, first_year, seed)
+            close = close_prices(df)
+
+        #yearly growth constants and their compounding over every period
+        with stage("indicators", rows=len(close)):
+            yearly_means = price_yearly_means(df, first_year, last_year)
+            annual_growth_constant = yearly_means[1:] / yearly_means[:-1]
+            #the sources only differ in the growth with the dividends, the expenses are subtracted alike
+            if source == "daily":
+                total_return_means = _total_return_means(df, first_year, last_year)
+                annual_return_with_divs_expenses = total_return_means[1:] / total_return_means[:-1] - expense_ratio
+            elif source == "annual":
+                dividend_yield = divs_table[np.arange(first_year, last_year)] / 100
+                annual_return_with_divs_expenses = annual_growth_constant + dividend_yield - expense_ratio
+            else:
+                raise ValueError(f"Unknown source {source!r}, expected 'annual' or 'daily'")
+            annual_return_without_divs_expenses = annual_growth_constant - expense_ratio
 
-    for start_year, end_year in tqdm(investment_periods):
-
-        start = df[df['Year'] == start_year]
-
-        for _ in range(sample_size):
-            buy_prices = start.sample(purchase_times, replace=False)['Close'].values / 10
-            portfolio_value = np.sum(etf_per_purchase * buy_prices)
-            portfolio_value_not_invested = portfolio_value
-            
-            for year in range(start_year + 1, end_year + 1):
-             
-                annual_growth_constant = df[df['Year'] == year]['Close'].mean() / df[df['Year'] == year - 1]['Close'].mean()
-                annual_return_with_divs = annual_growth_constant + divs[year - 1] / 100
-                annual_return_with_divs_expenses = annual_return_with_divs - expense_ratio
-                annual_return_without_divs_expenses = annual_growth_constant - expense_ratio
-                
-                portfolio_value *= annual_return_with_divs_expenses
-                portfolio_value_not_invested *= annual_return_without_divs_expenses 
-                
-            
-            portfolio_value_adjusted = portfolio_value * cpi[2023] / cpi[end_year]
-            portfolio_value_adjusted_not_invested = portfolio_value_not_invested * cpi[2023] / cpi[end_year]
-            capital_invested = np.sum(etf_per_purchase * buy_prices)
-            capital_invested_adjusted = capital_invested * cpi[2023] / cpi[start_year]
-            
-            percent_change_nominal = (portfolio_value - capital_invested) * 100 / capital_invested
-            percentage_change_not_invested = (portfolio_value_adjusted_not_invested - capital_invested_adjusted) * 100 / capital_invested_adjusted
-            percent_change = (portfolio_value_adjusted - capital_invested_adjusted) * 100 / capital_invested_adjusted
-
-            real_returns.append(("("+str(start_year)+", "+ str(end_year)+")", 
-                     capital_invested, portfolio_value, portfolio_value-capital_invested,
-                     capital_invested_adjusted, portfolio_value_adjusted, percentage_change_not_invested, percent_change,
-                     (portfolio_value_adjusted_not_invested - capital_invested_adjusted)))
-
-
-    simulation_results = pd.DataFrame(real_returns, columns=['Period', 'Capital Invested', 'Portfolio Value', 'Capital Gained', 'Capital Invested Adjusted', 'Portfolio Value Adjusted', '% Change w.o. Dividend', '% Change with Dividend', 'Real Returns'])
+            starts = np.array([start_year for start_year, _ in investment_periods]) - first_year
+            holding_years = starts[:, None] + np.arange(20)
+            growth_with_divs = np.cumprod(annual_return_with_divs_expenses[holding_years], axis=1)[:, -1]
+            growth_without_divs = np.cumprod(annual_return_without_divs_expenses[holding_years], axis=1)[:, -1]
+
+            start_cpi = cpi_table[starts + first_year]
+            end_cpi = cpi_table[starts + first_year + 20]
+
+        if aggregate:
+            stats = []
+            with stage("yearly loop") as current:
+                for period, (start_year, end_year) in enumerate(investment_periods):
+                    period_stats = RunningStats(_twenty_year_columns, seed=seed)
+                    for shard, done in enumerate(range(0, sample_size, batch_size)):
+                        purchases = sampler.draw(start_year, purchase_times, min(batch_size, sample_size - done), shard)
+                        capital_invested = np.sum(etf_per_purchase * (close[purchases] / 10), axis=1)
+                        columns = _twenty_year_results(capital_invested, growth_with_divs[period], growth_without_divs[period],
+                                                       start_cpi[period], end_cpi[period])
+                        period_stats.update(np.column_stack(list(columns.values())))
+                    stats.append(period_stats)
+                    current.add(rows=len(sampler.rows(start_year)))
+            with stage("assembly", rows=len(stats)):
+                return period_summary(investment_periods, stats, quantiles)
+
+        capital_invested = np.empty((len(investment_periods), sample_size))
+        with stage("yearly loop") as current:
+            for period, (start_year, end_year) in enumerate(investment_periods):
+                purchases = sampler.draw(start_year, purchase_times, sample_size)
+                capital_invested[period] = np.sum(etf_per_purchase * (close[purchases] / 10), axis=1)
+                current.add(rows=len(sampler.rows(start_year)))
+
+        with stage("assembly", rows=capital_invested.size):
+            columns = _twenty_year_results(capital_invested, growth_with_divs[:, None], growth_without_divs[:, None],
+                                           start_cpi[:, None], end_cpi[:, None])
+            periods = ["(" + str(start_year) + ", " + str(end_year) + ")" for start_year, end_year in investment_periods]
+            simulation_results = pd.DataFrame({'Period': np.repeat(periods, sample_size),
+                                               **{column: values.ravel() for column, values in columns.items()}})
     return simulation_results
 
-def simulate_twenty_years_of_investment_gold(df, sample_size=30,purchase_times = 10,ounce_per_purchase = 2):
+#the result columns of simulate_twenty_years_of_investment_gold
+_twenty_year_gold_columns = ['Capital Invested', 'Portfolio Value', 'Capital Gained', 'Capital Invested Adjusted',
+                             'Portfolio Value Adjusted', '% Change']
+
+
+def _twenty_year_gold_results(capital_invested, portfolio_value, start_year, end_year):
+    """
+    Computes the result columns of simulate_twenty_years_of_investment_gold from the capital
+    invested by each simulation and the value of its gold at the end of the period
+    """
+    portfolio_value = np.full(len(capital_invested), portfolio_value)
+    portfolio_value_adjusted = portfolio_value * cpi[2023] / cpi[end_year]
+    capital_invested_adjusted = capital_invested * cpi[2023] / cpi[start_year]
+    percentage_real_returns = (portfolio_value_adjusted - capital_invested_adjusted)/ capital_invested_adjusted * 100
+    return [capital_invested, portfolio_value, portfolio_value - capital_invested, capital_invested_adjusted,
+            portfolio_value_adjusted, percentage_real_returns]
+
+
+@cached(stochastic=True)
+def simulate_twenty_years_of_investment_gold(df, sample_size=30,purchase_times = 10,ounce_per_purchase = 2, seed=None,
+                                             aggregate=False, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95), batch_size=10000):
+    """
+    Simulates buying gold at random days of a year and selling it at the mean price of the year 20 years later
+    Parameters
+    ----------
+    df: pd.DataFrame or PriceSeries
+        The DataFrame containing the gold prices
+    sample_size: int
+        The number of simulations per investment period
+    purchase_times: int
+        The number of purchases made in the starting year, 1 in the years with fewer prices
+        (before 1968 there are 4 per year)
+    ounce_per_purchase: int
+        The ounces bought by each purchase
+    seed: int
+        The seed of the random purchase days, every start year draws from its own stream
+        (see sampling.PurchaseSampler)
+    aggregate: bool
+        Whether to return running statistics of every period instead of every simulation
+    quantiles: tuple
+        The quantiles estimated in aggregate mode
+    batch_size: int
+        The number of simulations drawn at once in aggregate mode; with sample_size <=
+        batch_size the draws are those of the default mode
+
+    Gold has no dividends, so there is no source option: the daily total return index of
+    gold is its close (see total_return.py) and would give the same numbers.
+
+    Returns
+    -------
+    simulation_results: pd.DataFrame
+        One row per simulation with the nominal and real returns, or in aggregate mode one
+        row per period and column (see streaming_stats.period_summary)
+    """
     investment_periods = [(i, i+20) for i in range(1950, 2004)]
+    first_year = investment_periods[0][0]
     real_returns = []
-    for start_year, end_year in tqdm(investment_periods):
-        start = df[df['Year'] == start_year]
-        end = df[df["Year"] == end_year]
-        
-        #for some of the years we only have 4 data points
-        if len(start) == 4:
-            purchase_times = 1
-
-        for _ in range(sample_size):
-            buy_prices = start.sample(purchase_times, replace=False)['Close'].values
-            capital_invested = np.sum(buy_prices) * ounce_per_purchase
-            portfolio_value = end.Close.mean() * purchase_times * ounce_per_purchase
-
-            portfolio_value_adjusted = portfolio_value * cpi[2023] / cpi[end_year]
-            capital_invested_adjusted = capital_invested * cpi[2023] / cpi[start_year]
-            percentage_real_returns = (portfolio_value_adjusted - capital_invested_adjusted)/ capital_invested_adjusted * 100
-
-            real_returns.append(("("+str(start_year)+", "+ str(end_year)+")", capital_invested, portfolio_value, portfolio_value - capital_invested, capital_invested_adjusted,
-                                 portfolio_value_adjusted, percentage_real_returns))
-            
-
-    simulation_results = pd.DataFrame(real_returns, columns=['Period', 'Capital Invested', 'Portfolio Value', 'Capital Gained', 'Capital Invested Adjusted',
-                                                             'Portfolio Value Adjusted', '% Change'])
+    stats = []
+    with stage("simulate_twenty_years_of_investment_gold", rows=len(df)):
+        with stage("load", rows=len(df)):
+            order, year_offsets = year_rows(df, first_year, investment_periods[-1][1])
+            sampler = PurchaseSampler(order, year_offsets, first_year, seed)
+            close = close_prices(df)
+
+        with stage("yearly loop") as current:
+            for start_year, end_year in investment_periods:
+                start_rows, end_rows = sampler.rows(start_year), sampler.rows(end_year)
+                end_mean = close[end_rows].mean() if len(end_rows) else np.nan
+                current.add(rows=len(start_rows) + len(end_rows))
+
+                #for some of the years we only have 4 data points, those buy once
+                period_purchases = purchase_times if len(start_rows) >= purchase_times else 1
+
+                portfolio_value = end_mean * period_purchases * ounce_per_purchase
+
+                if aggregate:
+                    #only the statistics of the period are kept, batch by batch
+                    period_stats = RunningStats(_twenty_year_gold_columns, seed=seed)
+                    for shard, done in enumerate(range(0, sample_size, batch_size)):
+                        purchases = sampler.draw(start_year, period_purchases, min(batch_size, sample_size - done), shard)
+                        capital_invested = np.sum(close[purchases], axis=1) * ounce_per_purchase
+                        period_stats.update(np.column_stack(_twenty_year_gold_results(capital_invested, portfolio_value,
+                                                                                      start_year, end_year)))
+                    stats.append(period_stats)
+                else:
+                    capital_invested = np.sum(close[sampler.draw(start_year, period_purchases, sample_size)], axis=1) * ounce_per_purchase
+                    real_returns.append(_twenty_year_gold_results(capital_invested, portfolio_value, start_year, end_year))
+
+        if aggregate:
+            with stage("assembly", rows=len(stats)):
+                return period_summary(investment_periods, stats, quantiles)
+
+        with stage("assembly", rows=len(real_returns) * sample_size):
+            periods = ["(" + str(start_year) + ", " + str(end_year) + ")" for start_year, end_year in investment_periods]
+            simulation_results = pd.DataFrame({'Period': np.repeat(periods, sample_size),
+                                               **{column: np.concatenate([columns[i] for columns in real_returns])
+                                                  for i, column in enumerate(_twenty_year_gold_columns)}})
     return simulation_results
+
+
+def _real_return_matrix(log_growth, years):
+    """
+    Builds the start year x end year matrix of real returns from yearly log growths
+    Parameters
+    ----------
+    log_growth: np.ndarray
+        The nominal log growth of each year over the previous one, starting with years[1]
+    years: np.ndarray
+        The consecutive years of the matrix
+
+    Returns
+    -------
+    returns: pd.DataFrame
+        The real return (%) of holding from the start year (index) to the end year (columns),
+        NaN unless the end year is after the start year or when a year without data is spanned
+    """
+    #prefix sums turn every holding period into a difference of two lookups
+    missing = np.isnan(log_growth)
+    prefix = np.concatenate([[0], np.cumsum(np.where(missing, 0, log_growth))])
+    missing_prefix = np.concatenate([[0], np.cumsum(missing)])
+    log_cpi = np.log(cpi_table[years])
+
+    log_real_growth = (prefix[None, :] - prefix[:, None]) - (log_cpi[None, :] - log_cpi[:, None])
+    valid = (years[None, :] > years[:, None]) & (missing_prefix[None, :] == missing_prefix[:, None])
+    returns = np.where(valid, np.expm1(log_real_growth) * 100, np.nan)
+
+    return pd.DataFrame(returns,
+                        index=pd.Index(years, name="Start Year"),
+                        columns=pd.Index(years, name="End Year"))
+
+
+@cached
+def holding_period_returns_stocks(df, first_year=1950, last_year=2023, dividends=True, expense_ratio=0.00095, source="annual"):
+    """
+    Computes the real returns of holding SPY ETFs between every pair of years, with the
+    yearly growth of simulate_twenty_years_of_investment
+    Parameters
+    ----------
+    df: pd.DataFrame or PriceSeries
+        The DataFrame containing the SP500 prices
+    first_year: int
+        The first start year of the matrix
+    last_year: int
+        The last end year of the matrix
+    dividends: bool
+        Whether the dividends are reinvested
+    expense_ratio: float
+        The expense ratio of SPY ETF
+    source: str
+        "annual" adds the dividend yield to the growth of the yearly mean prices, "daily"
+        compounds the yearly means of the daily total return index (see total_return.py),
+        with the dividends reinvested every trading day; the expense ratio is subtracted
+        from the yearly growth alike. df may be a TotalReturnIndex.
+
+    Returns
+    -------
+    returns: pd.DataFrame
+        The real return (%) from the start year (index) to the end year (columns)
+    """
+    years = np.arange(first_year, last_year + 1)
+    if source == "daily":
+        yearly_means = _total_return_means(df, first_year, last_year, dividends)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            log_growth = np.log(yearly_means[1:] / yearly_means[:-1] - expense_ratio)
+        return _real_return_matrix(log_growth, years)
+    if source != "annual":
+        raise ValueError(f"Unknown source {source!r}, expected 'annual' or 'daily'")
+
+    yearly_means = price_yearly_means(df, first_year, last_year)
+    annual_growth_constant = yearly_means[1:] / yearly_means[:-1] - expense_ratio
+    if dividends:
+        annual_growth_constant = annual_growth_constant + divs_table[years[:-1]] / 100
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        log_growth = np.log(annual_growth_constant)
+    return _real_return_matrix(log_growth, years)
+
+
+@cached
+def holding_period_returns_gold(df, first_year=1950, last_year=2023):
+    """
+    Computes the real returns of holding gold between every pair of years, bought and
+    sold at the yearly mean prices
+    Parameters
+    ----------
+    df: pd.DataFrame or PriceSeries
+        The DataFrame containing the gold prices
+    first_year: int
+        The first start year of the matrix
+    last_year: int
+        The last end year of the matrix
+
+    Gold has no dividends, so there is no source option: the daily total return index of
+    gold is its close and would give the same matrix.
+
+    Returns
+    -------
+    returns: pd.DataFrame
+        The real return (%) from the start year (index) to the end year (columns)
+    """
+    years = np.arange(first_year, last_year + 1)
+    log_means = np.log(price_yearly_means(df, first_year, last_year))
+    return _real_return_matrix(np.diff(log_means), years)
+
+
+def _horizon_periods(returns, horizon):
+    """
+    Picks the holding periods of a given length out of a return matrix
+    Parameters
+    ----------
+    returns: pd.DataFrame
+        A matrix of holding_period_returns_*
+    horizon: int
+        The number of years held
+
+    Returns
+    -------
+    periods: list
+        The "(start, end)" label of each period
+    values: np.ndarray
+        The return of each period
+    """
+    start_years = returns.index.values[:len(returns) - horizon]
+    values = np.diagonal(returns.values, offset=horizon)
+    periods = ["(" + str(start_year) + ", " + str(start_year + horizon) + ")" for start_year in start_years]
+    return periods, values
+
+
+@cached
+def horizon_returns_stocks(df, horizon=20, first_year=1950, last_year=2023, expense_ratio=0.00095, source="annual"):
+    """
+    Computes the real returns of every holding period of SPY ETFs lasting a given number of years.
+    With the default arguments it reproduces the return columns of simulate_twenty_years_of_investment.
+    Parameters
+    ----------
+    df: pd.DataFrame or PriceSeries
+        The DataFrame containing the SP500 prices
+    horizon: int
+        The number of years held
+    first_year: int
+        The first start year
+    last_year: int
+        The last end year
+    expense_ratio: float
+        The expense ratio of SPY ETF
+    source: str
+        "annual" or "daily", see holding_period_returns_stocks
+
+    Returns
+    -------
+    results: pd.DataFrame
+        One row per period with the real returns with and without dividends
+    """
+    periods, without_dividends = _horizon_periods(holding_period_returns_stocks(df, first_year, last_year, False, expense_ratio, source), horizon)
+    _, with_dividends = _horizon_periods(holding_period_returns_stocks(df, first_year, last_year, True, expense_ratio, source), horizon)
+    return pd.DataFrame({'Period': periods,
+                         '% Change w.o. Dividend': without_dividends,
+                         '% Change with Dividend': with_dividends})
+
+
+@cached
+def horizon_returns_gold(df, horizon=20, first_year=1950, last_year=2023):
+    """
+    Computes the real returns of every holding period of gold lasting a given number of years.
+    With the default arguments it gives the periods of simulate_twenty_years_of_investment_gold,
+    buying at the mean price of the start year instead of at sampled days. Like
+    holding_period_returns_gold it has no source option.
+    Parameters
+    ----------
+    df: pd.DataFrame or PriceSeries
+        The DataFrame containing the gold prices
+    horizon: int
+        The number of years held
+    first_year: int
+        The first start year
+    last_year: int
+        The last end year
+
+    Returns
+    -------
+    results: pd.DataFrame
+        One row per period with the real return
+    """
+    periods, values = _horizon_periods(holding_period_returns_gold(df, first_year, last_year), horizon)
+    return pd.DataFrame({'Period': periods, '% Change': values})
@@ -0,0 +1,277 @@
+import struct
+import numpy as np
+import pandas as pd
+from trade_simulations import trade_results_frame
+
+_day = 86400 * 10**9
+_header = struct.Struct("<B5i2d")
+_state = struct.Struct("<?2d?i2?3dqiq2di")
+_version = 1
+
+
+class OnlineEMACrossover:
+    """
+    Runs the EMA Crossover Trading of simulate_trade_EMA on a stream of bars.
+
+    Bars are consumed one at a time (update) or in chunks (update_many) in
+    chronological order and every update is O(1) per bar. Each traded year starts
+    flat with a fixed amount of units, later purchases of the year reinvest the cash
+    in whole units and an open position is sold at the last bar of the year, like
+    the batch simulation. The state can be serialized with to_bytes and restored
+    with from_bytes to resume a feed without replaying it.
+
+    Parameters
+    ----------
+    EMA1: int
+        Span of the fast EMA.
+    EMA2: int
+        Span of the slow EMA.
+    units: int
+        The number of units bought by the first purchase of a year.
+    expense_rate: float
+        The annual expense rate, 0 for gold.
+    price_scale: int
+        The divisor converting the close price to the trading price, 10 for SPY and 1 for gold.
+    first_year: int
+        The first year traded.
+    last_year: int
+        The last year traded (inclusive).
+    """
+
+    def __init__(self, EMA1=12, EMA2=26, units=20, expense_rate=0.00095, price_scale=10, first_year=1950, last_year=2022):
+        self.EMA1, self.EMA2 = EMA1, EMA2
+        self.units, self.expense_rate, self.price_scale = units, expense_rate, price_scale
+        self.first_year, self.last_year = first_year, last_year
+
+        self.started = False
+        self.fast = self.slow = 0.0
+        #bars of the current year
+        self.year_started = False
+        self.year = 0
+        self.position = False
+        self.year_traded = False
+        self.cash_balance = self.etfs_holding = self.capital_invested = 0.0
+        self.buy_date = 0
+        self.trade_counts = 0
+        self.last_date = 0
+        self.last_price = self.total_expenses = 0.0
+        self.completed = []
+
+    def _alpha(self, span):
+        return 2 / (span + 1)
+
+    def _price(self, close):
+        return close / self.price_scale if self.price_scale != 1 else close
+
+    def _buy(self, date, price):
+        #first purchase
+        if self.cash_balance == 0:
+            self.etfs_holding = float(self.units)
+            self.capital_invested = self.units * price
+        #remaining purchases
+        else:
+            self.etfs_holding = self.cash_balance // price
+            self.cash_balance = self.cash_balance - self.etfs_holding * price
+        self.position = True
+        self.buy_date = date
+        return ("Buy", date, price, self.etfs_holding, self.cash_balance)
+
+    def _sell(self, date, price):
+        days_held = (date - self.buy_date) // _day
+        expense = self.etfs_holding * price * self.expense_rate * days_held / 365
+        self.cash_balance = self.cash_balance + self.etfs_holding * price
+        self.cash_balance = self.cash_balance - expense
+        self.total_expenses += expense
+        self.trade_counts += 1
+        self.position = False
+        fill = ("Sell", date, price, self.etfs_holding, self.cash_balance)
+        self.etfs_holding = 0.0
+        return fill
+
+    def _close_year(self):
+        """
+        Sells an open position at the last bar of the year and records the yearly result
+        """
+        fills = []
+        if self.position:
+            fills.append(self._sell(self.last_date, self.last_price))
+        if self.year_traded and self.capital_invested != 0:
+            self.completed.append((self.year, self.trade_counts, self.capital_invested, self.cash_balance, self.total_expenses))
+        self.year_traded = False
+        self.cash_balance = self.etfs_holding = self.capital_invested = self.total_expenses = 0.0
+        self.trade_counts = 0
+        return fills
+
+    def _start_year(self, year):
+        fills = self._close_year() if self.year_started else []
+        self.year_started = True
+        self.year = year
+        self.year_traded = self.first_year <= year <= self.last_year
+        return fills
+
+    def _fill(self, date, price, buy, sell):
+        if not self.year_traded:
+            return None
+        if not self.position and buy:
+            return self._buy(date, price)
+        if self.position and sell:
+            return self._sell(date, price)
+        return None
+
+    def update(self, date, close):
+        """
+        Consumes one bar
+        Parameters
+        ----------
+        date: datetime-like
+            The date of the bar
+        close: float
+            The close price of the bar
+
+        Returns
+        -------
+        fills: list
+            The ("Buy" | "Sell", date, price, units, cash after the trade) fills caused by the bar,
+            including the forced sale closing the previous year
+        """
+        date = int(np.datetime64(pd.Timestamp(date), "ns").astype(np.int64))
+        close = float(close)
+        year = int(np.datetime64(date, "ns").astype("datetime64[Y]").astype(int)) + 1970
+
+        fills = []
+        if not self.year_started or year != self.year:
+            fills.extend(self._start_year(year))
+
+        if not self.started:
+            self.fast = self.slow = close
+            self.started = True
+            buy = sell = False
+        else:
+            previous_fast, previous_slow = self.fast, self.slow
+            #written as pandas ewm(adjust=False).mean() computes it, the EMAs have to match it bit for bit
+            alpha = self._alpha(self.EMA1)
+            self.fast = ((1 - alpha) * self.fast + alpha * close) / ((1 - alpha) + alpha)
+            alpha = self._alpha(self.EMA2)
+            self.slow = ((1 - alpha) * self.slow + alpha * close) / ((1 - alpha) + alpha)
+            buy = self.fast > self.slow and previous_fast <= previous_slow
+            sell = self.fast < self.slow and previous_fast >= previous_slow
+
+        price = self._price(close)
+        fill = self._fill(date, price, buy, sell)
+        if fill is not None:
+            fills.append(fill)
+        self.last_date, self.last_price = date, price
+        return fills
+
+    def update_many(self, dates, closes):
+        """
+        Consumes a chunk of bars. The EMAs and signals of the chunk are computed as arrays,
+        only the bars with a signal or a new year are visited one by one.
+        Parameters
+        ----------
+        dates: array-like
+            The dates of the bars
+        closes: array-like
+            The close prices of the bars
+
+        Returns
+        -------
+        fills: list
+            The fills caused by the chunk, see update
+        """
+        dates = pd.to_datetime(np.asarray(dates)).values.astype("datetime64[ns]").astype(np.int64)
+        closes = np.asarray(closes, dtype=float)
+        if len(closes) == 0:
+            return []
+
+        #seeding ewm with the current EMA continues the same recurrence as the full history
+        if self.started:
+            fast = pd.Series(np.concatenate([[self.fast], closes])).ewm(span=self.EMA1, adjust=False).mean().values
+            slow = pd.Series(np.concatenate([[self.slow], closes])).ewm(span=self.EMA2, adjust=False).mean().values
+        else:
+            fast = np.concatenate([closes[:1], pd.Series(closes).ewm(span=self.EMA1, adjust=False).mean().values])
+            slow = np.concatenate([closes[:1], pd.Series(closes).ewm(span=self.EMA2, adjust=False).mean().values])
+        buy = (fast[1:] > slow[1:]) & (fast[:-1] <= slow[:-1])
+        sell = (fast[1:] < slow[1:]) & (fast[:-1] >= slow[:-1])
+        if not self.started:
+            buy[0] = sell[0] = False
+            self.started = True
+
+        years = dates.astype("datetime64[ns]").astype("datetime64[Y]").astype(int) + 1970
+        previous_year = np.concatenate([[self.year if self.year_started else years[0] - 1], years[:-1]])
+        new_year = years != previous_year
+        prices = closes / self.price_scale if self.price_scale != 1 else closes
+
+        fills = []
+        for row in np.flatnonzero(buy | sell | new_year):
+            if new_year[row]:
+                if row > 0:
+                    self.last_date, self.last_price = int(dates[row - 1]), float(prices[row - 1])
+                fills.extend(self._start_year(int(years[row])))
+            fill = self._fill(int(dates[row]), float(prices[row]), bool(buy[row]), bool(sell[row]))
+            if fill is not None:
+                fills.append(fill)
+
+        self.fast, self.slow = float(fast[-1]), float(slow[-1])
+        self.last_date, self.last_price = int(dates[-1]), float(prices[-1])
+        return fills
+
+    def finalize(self):
+        """
+        Ends the stream: sells an open position at the last bar and records the current year
+
+        Returns
+        -------
+        fills: list
+            The forced sale, if any
+        """
+        fills = self._close_year() if self.year_started else []
+        self.year_started = False
+        return fills
+
+    def results(self, gold=False):
+        """
+        Returns the completed years in the layout of simulate_trade_EMA
+        Parameters
+        ----------
+        gold: bool
+            Whether to use the layout of simulate_trade_EMA_gold
+
+        Returns
+        -------
+        results: pd.DataFrame
+            The yearly results of the strategy
+        """
+        completed = np.array(self.completed, dtype=float).reshape(-1, 5)
+        return trade_results_frame(completed[:, 0].astype(int), completed[:, 1].astype(int), completed[:, 2],
+                                    completed[:, 3], completed[:, 4], gold)
+
+    def to_bytes(self):
+        """
+        Serializes the settings, the running state and the completed years
+        """
+        header = _header.pack(_version, self.EMA1, self.EMA2, self.units, self.first_year, self.last_year,
+                              float(self.expense_rate), float(self.price_scale))
+        state = _state.pack(self.started, self.fast, self.slow, self.year_started, self.year, self.position,
+                            self.year_traded, self.cash_balance, self.etfs_holding, self.capital_invested,
+                            self.buy_date, self.trade_counts, self.last_date, self.last_price, self.total_expenses,
+                            len(self.completed))
+        completed = np.array(self.completed, dtype=float).reshape(-1, 5).tobytes()
+        return header + state + completed
+
+    @classmethod
+    def from_bytes(cls, payload):
+        """
+        Restores an engine serialized with to_bytes
+        """
+        version, EMA1, EMA2, units, first_year, last_year, expense_rate, price_scale = _header.unpack_from(payload)
+        if version != _version:
+            raise ValueError(f"Unsupported state version: {version}")
+        engine = cls(EMA1, EMA2, units, expense_rate, price_scale, first_year, last_year)
+        (engine.started, engine.fast, engine.slow, engine.year_started, engine.year, engine.position,
+         engine.year_traded, engine.cash_balance, engine.etfs_holding, engine.capital_invested, engine.buy_date,
+         engine.trade_counts, engine.last_date, engine.last_price, engine.total_expenses,
+         n_completed) = _state.unpack_from(payload, _header.size)
+        completed = np.frombuffer(payload, dtype=float, count=n_completed * 5, offset=_header.size + _state.size)
+        engine.completed = [(int(row[0]), int(row[1]), row[2], row[3], row[4]) for row in completed.reshape(-1, 5)]
+        return engine
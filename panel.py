@@ -0,0 +1,296 @@
+import numpy as np
+import pandas as pd
+from data import *
+from instrumentation import stage
+from trade_simulations import backtest_crossover, crossover_signals, trade_results_frame
+
+
+class AssetSpec:
+    """
+    How an asset of a price panel is traded.
+
+    Parameters
+    ----------
+    price_scale: float
+        The divisor converting the close price to the trading price, 10 for SPY from the SP500 index
+    expense_ratio: float
+        The annual expense ratio, 0 for gold
+    dividends: YearTable
+        The year end dividend yield (%), None for assets without dividends. Assets with
+        dividends get the stock layout of the tables, the others the commodity layout
+    first_year: int
+        The first year traded
+    last_year: int
+        The last year traded (inclusive)
+    units: int
+        The number of units bought by the first purchase of a year
+    """
+
+    def __init__(self, price_scale=1, expense_ratio=0, dividends=None, first_year=1950, last_year=2022, units=20):
+        self.price_scale = price_scale
+        self.expense_ratio = expense_ratio
+        self.dividends = dividends
+        self.first_year = first_year
+        self.last_year = last_year
+        self.units = units
+
+    def __repr__(self):
+        return (f"AssetSpec(price_scale={self.price_scale}, expense_ratio={self.expense_ratio}, "
+                f"dividends={'None' if self.dividends is None else 'YearTable'}, first_year={self.first_year}, "
+                f"last_year={self.last_year}, units={self.units})")
+
+
+#the settings of simulate_trade_EMA and simulate_trade_EMA_gold
+spy_spec = AssetSpec(price_scale=10, expense_ratio=0.00095, dividends=divs_table, first_year=1950, last_year=2022)
+gold_spec = AssetSpec(first_year=1970, last_year=2022)
+
+
+def align_prices(frames):
+    """
+    Aligns the close prices of several assets on their dates
+    Parameters
+    ----------
+    frames: dict
+        The price DataFrame of each asset, with a Date column or indexed by date
+
+    Returns
+    -------
+    prices: pd.DataFrame
+        The date x asset matrix of close prices, NaN where an asset has no price
+    """
+    columns = {}
+    for asset, df in frames.items():
+        dates = pd.to_datetime(df["Date"] if "Date" in df.columns else df.index)
+        columns[asset] = pd.Series(df["Close"].values.astype(float), index=dates)
+    prices = pd.concat(columns, axis=1).sort_index()
+    prices.index.name = "Date"
+    return prices
+
+
+def _panel_arrays(prices, specs):
+    """
+    Extracts the dates, years, months, close matrix and specs of a panel
+    """
+    missing = [asset for asset in prices.columns if asset not in specs]
+    if missing:
+        raise KeyError(f"No AssetSpec for {missing}")
+    dates = pd.to_datetime(prices.index).values
+    years = dates.astype("datetime64[Y]").astype(int) + 1970
+    months = dates.astype("datetime64[M]").astype(int) % 12 + 1
+    close = prices.values.astype(float)
+    return dates, years, months, close, [specs[asset] for asset in prices.columns]
+
+
+def _panel_means(cells, close, n_cells):
+    """
+    Averages every column of the close matrix over the cells (years or months) of the rows
+    Parameters
+    ----------
+    cells: np.ndarray
+        The cell of each row, rows with a negative cell are left out
+    close: np.ndarray
+        The (rows, assets) matrix of close prices
+    n_cells: int
+        The number of cells
+
+    Returns
+    -------
+    means: np.ndarray
+        The (cells, assets) matrix of mean close prices, NaN where an asset has no price
+    """
+    n_assets = close.shape[1]
+    valid = (cells >= 0)[:, None] & ~np.isnan(close)
+    #every (cell, asset) pair is a bin of a single bincount
+    bins = (cells[:, None] * n_assets + np.arange(n_assets))[valid]
+    sums = np.bincount(bins, weights=close[valid], minlength=n_cells * n_assets)
+    counts = np.bincount(bins, minlength=n_cells * n_assets)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).reshape(n_cells, n_assets)
+
+
+def _concat_assets(frames):
+    return pd.concat(frames, names=["Asset"])
+
+
+def panel_annual_returns(prices, specs, start=1951, end=2024):
+    """
+    Computes the annual returns of every asset of a price panel in one pass. The rows of
+    an asset are the ones of compute_annual_returns_stocks (assets with dividends) or
+    compute_annual_returns_commodity (the others).
+    Parameters
+    ----------
+    prices: pd.DataFrame
+        The date x asset matrix of close prices, see align_prices
+    specs: dict
+        The AssetSpec of each asset
+    start: int
+        The first year whose return is computed
+    end: int
+        The end of the investment periods (exclusive)
+
+    Returns
+    -------
+    results: pd.DataFrame
+        The annual returns indexed by Asset and Period
+    """
+    with stage("panel_annual_returns", rows=prices.size):
+        with stage("load", rows=len(prices)):
+            _, years, _, close, asset_specs = _panel_arrays(prices, specs)
+
+        with stage("indicators", rows=close.size):
+            cells = np.where((years >= start - 1) & (years <= end - 1), years - (start - 1), -1)
+            yearly_means = _panel_means(cells, close, end - start + 1)
+
+        with stage("yearly loop", rows=yearly_means.size):
+            investment_periods = np.arange(start, end)
+            previous_year_mean = yearly_means[:-1]
+            current_year_mean = yearly_means[1:]
+            inflation_constant = inflation_ratios[investment_periods][:, None]
+
+            adjusted_previous_mean = previous_year_mean * inflation_constant
+            without_dividends = (current_year_mean - adjusted_previous_mean) / adjusted_previous_mean * 100
+
+            dividend_yield = np.column_stack([spec.dividends[investment_periods - 1] if spec.dividends is not None
+                                              else np.full(len(investment_periods), np.nan) for spec in asset_specs])
+            dividend_return = dividend_yield * previous_year_mean / 100
+            adjusted_dividend_return = dividend_return * inflation_constant
+            with_dividends = (current_year_mean + adjusted_dividend_return - adjusted_previous_mean) / adjusted_previous_mean * 100
+
+        with stage("assembly", rows=yearly_means.size):
+            periods = pd.Index([(int(year) - 1, int(year)) for year in investment_periods], name="Period", tupleize_cols=False)
+            frames = {}
+            for column, (asset, spec) in enumerate(zip(prices.columns, asset_specs)):
+                if spec.dividends is None:
+                    frames[asset] = pd.DataFrame({"(%)Adjusted_Annual_Return": without_dividends[:, column]}, index=periods)
+                else:
+                    frames[asset] = pd.DataFrame({"(%)Adjusted_Annual_Return_Without_Dividends": without_dividends[:, column],
+                                                  "(%)Adjusted_Annual_Return_With_Dividends": with_dividends[:, column]},
+                                                 index=periods)
+            return _concat_assets(frames)
+
+
+def panel_control_group(prices, specs):
+    """
+    Simulates the control group of every asset of a price panel in one pass: buying at
+    the January mean and selling at the December mean of every traded year. The rows of
+    an asset are the ones of simulate_control_group (assets with dividends) or
+    simulate_control_group_gold (the others).
+    Parameters
+    ----------
+    prices: pd.DataFrame
+        The date x asset matrix of close prices, see align_prices
+    specs: dict
+        The AssetSpec of each asset
+
+    Returns
+    -------
+    results: pd.DataFrame
+        The control group results indexed by Asset and Period
+    """
+    with stage("panel_control_group", rows=prices.size):
+        with stage("load", rows=len(prices)):
+            _, years, months, close, asset_specs = _panel_arrays(prices, specs)
+            first_year = min(spec.first_year for spec in asset_specs)
+            last_year = max(spec.last_year for spec in asset_specs)
+            n_years = last_year - first_year + 1
+
+        with stage("monthly means", rows=close.size):
+            cells = np.where((years >= first_year) & (years <= last_year), (years - first_year) * 12 + months - 1, -1)
+            monthly_means = _panel_means(cells, close, n_years * 12).reshape(n_years, 12, -1)
+
+        with stage("yearly loop", rows=n_years * len(asset_specs)):
+            price_scale = np.array([spec.price_scale for spec in asset_specs], dtype=float)
+            units = np.array([spec.units for spec in asset_specs])
+            expense_ratio = np.array([spec.expense_ratio for spec in asset_specs], dtype=float)
+
+            buy_price = np.where(price_scale != 1, monthly_means[:, 0] / price_scale, monthly_means[:, 0])
+            sell_price = np.where(price_scale != 1, monthly_means[:, 11] / price_scale, monthly_means[:, 11])
+            portfolio_value_start = buy_price * units
+            portfolio_value_end = sell_price * units
+            expenses = portfolio_value_start * expense_ratio * 335/365
+            capital_earned = portfolio_value_end - portfolio_value_start - expenses
+            nominal_return = capital_earned / portfolio_value_start * 100
+
+        with stage("assembly", rows=n_years * len(asset_specs)):
+            frames = {}
+            for column, (asset, spec) in enumerate(zip(prices.columns, asset_specs)):
+                traded = slice(spec.first_year - first_year, spec.last_year - first_year + 1)
+                periods = pd.Index(np.arange(spec.first_year, spec.last_year + 1), name="Period")
+                if spec.dividends is None:
+                    frames[asset] = pd.DataFrame({"Capital Invested": portfolio_value_start[traded, column],
+                                                  "Final Capital": portfolio_value_end[traded, column] - expenses[traded, column],
+                                                  "Capital Gained": capital_earned[traded, column],
+                                                  "(%)Annual_Return": nominal_return[traded, column]}, index=periods)
+                else:
+                    frames[asset] = pd.DataFrame({"Capital Invested": portfolio_value_start[traded, column],
+                                                  "Final Capital": portfolio_value_end[traded, column] - expenses[traded, column],
+                                                  "Expenses": expenses[traded, column],
+                                                  "Capital Gained": capital_earned[traded, column],
+                                                  "(%)Annual_Return_Without_Dividends": nominal_return[traded, column]},
+                                                 index=periods)
+            return _concat_assets(frames)
+
+
+def panel_trade_EMA(prices, specs, EMA1=12, EMA2=26):
+    """
+    Computes the EMA Crossover Trading of every asset of a price panel in one pass. The
+    EMAs of an asset skip the dates it has no price, so the rows of an asset are the ones
+    of simulate_trade_EMA (assets with dividends) or simulate_trade_EMA_gold (the others)
+    on its own prices.
+    Parameters
+    ----------
+    prices: pd.DataFrame
+        The date x asset matrix of close prices, see align_prices
+    specs: dict
+        The AssetSpec of each asset
+    EMA1: int
+        Span of the fast EMA.
+    EMA2: int
+        Span of the slow EMA.
+
+    Returns
+    -------
+    results: pd.DataFrame
+        The yearly trading results indexed by Asset and Period
+    """
+    with stage("panel_trade_EMA", rows=prices.size):
+        with stage("load", rows=len(prices)):
+            dates, years, _, close, asset_specs = _panel_arrays(prices, specs)
+            first_year = min(spec.first_year for spec in asset_specs)
+            last_year = max(spec.last_year for spec in asset_specs)
+            n_years = last_year - first_year + 1
+            n_assets = len(asset_specs)
+
+        with stage("indicators", rows=2 * close.size):
+            #ignore_na weighs the prices of an asset as if the dates without a price did not exist
+            fast = pd.DataFrame(close).ewm(span=EMA1, adjust=False, ignore_na=True).mean().values
+            slow = pd.DataFrame(close).ewm(span=EMA2, adjust=False, ignore_na=True).mean().values
+
+        with stage("signals", rows=close.size):
+            buy, sell = crossover_signals(fast, slow)
+
+        with stage("yearly loop", rows=close.size):
+            #one group per (asset, year), the rows of an asset are laid out contiguously
+            first_years = np.array([spec.first_year for spec in asset_specs])
+            last_years = np.array([spec.last_year for spec in asset_specs])
+            traded = (years[:, None] >= first_years) & (years[:, None] <= last_years) & ~np.isnan(close)
+            groups = np.where(traded, np.arange(n_assets) * n_years + (years - first_year)[:, None], -1)
+
+            price_scale = np.array([spec.price_scale for spec in asset_specs], dtype=float)
+            price = np.where(price_scale != 1, close / price_scale, close)
+            units = np.repeat([spec.units for spec in asset_specs], n_years)
+            expense_rate = np.repeat([spec.expense_ratio for spec in asset_specs], n_years)
+            summary, _ = backtest_crossover(np.tile(dates, n_assets), groups.T.ravel(), price.T.ravel(),
+                                             buy.T.ravel(), sell.T.ravel(), n_assets * n_years, units, expense_rate)
+
+        with stage("assembly", rows=n_assets * n_years):
+            summary = {key: value.reshape(n_assets, n_years) for key, value in summary.items()}
+            periods = np.arange(first_year, last_year + 1)
+            frames = {}
+            for column, (asset, spec) in enumerate(zip(prices.columns, asset_specs)):
+                traded = summary["capital_invested"][column] != 0
+                frames[asset] = trade_results_frame(periods[traded], summary["trade_counts"][column][traded],
+                                                     summary["capital_invested"][column][traded],
+                                                     summary["final_capital"][column][traded],
+                                                     summary["expenses"][column][traded], gold=spec.dividends is None)
+            return _concat_assets(frames)
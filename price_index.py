@@ -0,0 +1,167 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from compact import CompactPrices
+
+
+class PriceSeries:
+    """
+    Prices sorted by date with the row offsets of every year and month.
+
+    The offsets are found once with searchsorted, so the rows of a year or a month are a
+    contiguous slice and selecting them costs O(1) instead of a scan of the whole frame.
+    The arrays are read-only; the analysis functions accept a PriceSeries wherever they
+    accept a price DataFrame.
+
+    Parameters
+    ----------
+    dates: array-like
+        The date of each row
+    close: array-like
+        The close price of each row
+    years: array-like
+        The year of each row, derived from the dates when None
+    months: array-like
+        The month (1-12) of each row, derived from the dates when None
+    """
+
+    def __init__(self, dates, close, years=None, months=None):
+        dates = np.asarray(dates).astype("datetime64[ns]", copy=False)
+        close = np.asarray(close).astype(np.float64, copy=False)
+        years = dates.astype("datetime64[Y]").astype(int) + 1970 if years is None else np.asarray(years)
+        months = dates.astype("datetime64[M]").astype(int) % 12 + 1 if months is None else np.asarray(months)
+        if len(dates) > 1 and not (dates[1:] >= dates[:-1]).all():
+            order = np.argsort(dates, kind="stable")
+            dates, close, years, months = dates[order], close[order], years[order], months[order]
+
+        #read-only views, the arrays of the source frame stay writeable
+        self.dates, self.close, self.years, self.months = (values.view() for values in (dates, close, years, months))
+        for values in (self.dates, self.close, self.years, self.months):
+            values.flags.writeable = False
+
+        self.first_year = int(years[0]) if len(years) else 0
+        self.last_year = int(years[-1]) if len(years) else -1
+        n_years = self.last_year - self.first_year + 1
+        #row offsets: year y spans year_offsets[y - first_year]:year_offsets[y - first_year + 1]
+        self.year_offsets = np.searchsorted(years, np.arange(self.first_year, self.last_year + 2))
+        cells = (years - self.first_year) * 12 + months - 1
+        self.month_offsets = np.searchsorted(cells, np.arange(n_years * 12 + 1))
+        self._frame = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Builds the series from a price frame with Close and Date (column or index) and
+        optionally Year and Month columns
+        """
+        dates = df["Date"] if "Date" in df.columns else df.index
+        dates = np.asarray(dates) if np.asarray(dates).dtype.kind == "M" else pd.to_datetime(dates).values
+        return cls(dates, df["Close"].values,
+                   df["Year"].values if "Year" in df.columns else None,
+                   df["Month"].values if "Month" in df.columns else None)
+
+    def __len__(self):
+        return len(self.close)
+
+    def __repr__(self):
+        return f"PriceSeries({len(self)} rows, {self.first_year}-{self.last_year})"
+
+    def year_rows(self, year):
+        """
+        Returns the slice of the rows of a year, empty for a year without prices
+        """
+        if not self.first_year <= year <= self.last_year:
+            return slice(0, 0)
+        offset = year - self.first_year
+        return slice(int(self.year_offsets[offset]), int(self.year_offsets[offset + 1]))
+
+    def month_rows(self, year, month):
+        """
+        Returns the slice of the rows of a month of a year, empty for a month without prices
+        """
+        if not self.first_year <= year <= self.last_year:
+            return slice(0, 0)
+        cell = (year - self.first_year) * 12 + month - 1
+        return slice(int(self.month_offsets[cell]), int(self.month_offsets[cell + 1]))
+
+    def year_close(self, year):
+        """
+        Returns a view of the close prices of a year
+        """
+        return self.close[self.year_rows(year)]
+
+    def month_close(self, year, month):
+        """
+        Returns a view of the close prices of a month of a year
+        """
+        return self.close[self.month_rows(year, month)]
+
+    def range_rows(self, first_year, last_year):
+        """
+        Returns the slice of the rows of a range of years (inclusive)
+        """
+        first_year, last_year = max(first_year, self.first_year), min(last_year, self.last_year)
+        if first_year > last_year:
+            return slice(0, 0)
+        return slice(self.year_rows(first_year).start, self.year_rows(last_year).stop)
+
+    def frame(self):
+        """
+        Returns the Date, Close, Year and Month columns as a DataFrame indexed by date,
+        built on the arrays without copying them
+        """
+        if self._frame is None:
+            self._frame = pd.DataFrame({"Date": self.dates, "Close": self.close, "Year": self.years, "Month": self.months},
+                                       index=pd.DatetimeIndex(self.dates, copy=False), copy=False)
+        return self._frame
+
+    def content_hash(self):
+        """
+        Returns a hash of the prices
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        for values in (self.dates, self.close, self.years, self.months):
+            digest.update(values.dtype.str.encode())
+            digest.update(np.ascontiguousarray(values).view(np.uint8))
+        return digest.hexdigest()
+
+
+def as_frame(data):
+    """
+    Returns the DataFrame view of a PriceSeries or CompactPrices, other inputs unchanged
+    """
+    return data.frame() if isinstance(data, (PriceSeries, CompactPrices)) else data
+
+
+def close_prices(data):
+    """
+    Returns the close prices of a PriceSeries or CompactPrices without building its frame,
+    the Close column of a frame
+    """
+    return data.close if isinstance(data, (PriceSeries, CompactPrices)) else data["Close"].values
+
+
+def year_rows(data, first_year, last_year):
+    """
+    Returns the rows of every year of a range
+    Parameters
+    ----------
+    data: pd.DataFrame, PriceSeries or CompactPrices
+        The prices, a frame needs a Year column
+    first_year: int
+        The first year of the range
+    last_year: int
+        The last year of the range (inclusive)
+
+    Returns
+    -------
+    order: np.ndarray
+        The rows sorted by year, in their original order within a year
+    year_offsets: np.ndarray
+        The rows of year y are order[year_offsets[y - first_year]:year_offsets[y - first_year + 1]]
+    """
+    if isinstance(data, PriceSeries):
+        return np.arange(len(data)), np.searchsorted(data.years, np.arange(first_year, last_year + 2))
+    years = as_frame(data)["Year"].values
+    order = np.argsort(years, kind="stable")
+    return order, np.searchsorted(years[order], np.arange(first_year, last_year + 2))
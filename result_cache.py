@@ -0,0 +1,299 @@
+"""
+Memoization of the analysis results.
+
+Functions decorated with cached() look their result up by a key made of the function,
+a content hash of every DataFrame / array argument, the other arguments (defaults
+included, so the seed of a stochastic function is part of the key) and a hash of the
+code and of the CPI and dividend tables. Results are kept in an in-process LRU and in
+zlib compressed pickles under cache_path, evicted least recently used first once the
+directory grows over max_disk_bytes. Callers always get a copy of the cached result;
+results over max_entry_bytes are returned without being stored.
+
+The content hash of a frame argument is remembered per frame object. The entry keeps
+a shallow copy of the frame, so with pandas copy-on-write (pandas 3) any edit of the
+frame copies the blocks it writes to: a column whose buffer moved, or a new index or
+set of columns, has the frame hashed again, and editing a frame in place never
+returns a stale result. Without copy-on-write every call hashes the frame.
+"""
+import collections
+import functools
+import hashlib
+import inspect
+import os
+import pathlib
+import pickle
+import weakref
+import zlib
+import numpy as np
+import pandas as pd
+
+cache_path = pathlib.Path(__file__).resolve().parent / ".result_cache"
+
+#set to False to always recompute, e.g. when benchmarking
+enabled = True
+max_memory_entries = 256
+max_disk_bytes = 256 * 2**20
+#larger results (e.g. simulations with a big sample_size) cost more to store than to recompute
+max_entry_bytes = 16 * 2**20
+
+_memory = collections.OrderedDict()
+_code_version = None
+
+#with copy-on-write a write to a frame copies the blocks it shares with another frame
+_copy_on_write = int(pd.__version__.split(".")[0]) >= 3 or pd.get_option("mode.copy_on_write") is True
+#id of a frame -> (weak reference, shallow copy, buffer addresses, content hash)
+_frame_hashes = {}
+
+
+def _hash_array(digest, values):
+    """
+    Adds the content of an array to a hash
+    """
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = pd.util.hash_array(values)
+    digest.update(str(values.dtype).encode() + str(values.shape).encode())
+    digest.update(np.ascontiguousarray(values).view(np.uint8).ravel())
+
+
+def _buffers(df):
+    """
+    Returns the index, the columns and the address of the values of every column of a frame
+    """
+    if isinstance(df, pd.Series):
+        return df.index, df.name, (np.asarray(df.values).__array_interface__["data"][0],)
+    return df.index, df.columns, tuple(np.asarray(df[column].values).__array_interface__["data"][0]
+                                       for column in df.columns)
+
+
+def _frame_hash(df):
+    """
+    Returns the content hash of a DataFrame or Series, remembered per object while its
+    index, columns and column buffers are those it was hashed with (see the module docstring)
+    """
+    if not _copy_on_write:
+        return _content_hash(df)
+    buffers = _buffers(df)
+    entry = _frame_hashes.get(id(df))
+    if (entry is not None and entry[0]() is df and entry[2][0] is buffers[0] and entry[2][1] is buffers[1]
+            and entry[2][2] == buffers[2]):
+        return entry[3]
+
+    digest = _content_hash(df)
+    key = id(df)
+    _frame_hashes[key] = (weakref.ref(df, lambda _: _frame_hashes.pop(key, None)), df.copy(deep=False), buffers, digest)
+    return digest
+
+
+def _content_hash(df):
+    """
+    Hashes the content of a DataFrame or Series
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(df, pd.Series):
+        digest.update(repr((df.shape, df.name, df.dtype.str)).encode())
+        _hash_array(digest, df.index.values)
+        _hash_array(digest, df.values)
+    else:
+        digest.update(repr((df.shape, tuple(df.columns))).encode())
+        _hash_array(digest, df.index.values)
+        for column in df.columns:
+            _hash_array(digest, df[column].values)
+    return digest.hexdigest()
+
+
+def _version():
+    """
+    Hashes the analysis code and the CPI and dividend tables, a change to either invalidates the results
+    """
+    global _code_version
+    if _code_version is None:
+        from data import cpi_table, divs_table
+
+        digest = hashlib.blake2b(digest_size=20)
+        for source in sorted(pathlib.Path(__file__).resolve().parent.glob("*.py")):
+            digest.update(source.read_bytes())
+        for table in (cpi_table, divs_table):
+            digest.update(str(table.first_year).encode())
+            _hash_array(digest, table.values)
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def _normalize(value):
+    """
+    Converts an argument to a hashable description of its content
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return ("frame", _frame_hash(value))
+    if hasattr(value, "content_hash"):
+        return (type(value).__name__, value.content_hash())
+    if isinstance(value, np.ndarray):
+        digest = hashlib.blake2b(digest_size=20)
+        _hash_array(digest, value)
+        return ("array", digest.hexdigest())
+    if isinstance(value, range):
+        return ("range", value.start, value.stop, value.step)
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_normalize(item) for item in value)
+    if isinstance(value, dict):
+        return ("dict",) + tuple(sorted((repr(key), _normalize(item)) for key, item in value.items()))
+    if isinstance(value, (np.integer, np.floating, np.bool_)):
+        return value.item()
+    return value
+
+
+def _key(function, arguments):
+    description = (function.__module__, function.__qualname__, _version(),
+                   tuple((name, _normalize(value)) for name, value in arguments.items()))
+    return hashlib.blake2b(repr(description).encode(), digest_size=20).hexdigest()
+
+
+def _copy(result):
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray)):
+        return result.copy()
+    if isinstance(result, tuple):
+        return tuple(_copy(item) for item in result)
+    if isinstance(result, dict):
+        return {key: _copy(item) for key, item in result.items()}
+    return result
+
+
+def _size(result):
+    """
+    Estimates the in-memory size of a result without inspecting the Python objects it holds
+    """
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True, deep=False).sum())
+    if isinstance(result, pd.Series):
+        return int(result.memory_usage(index=True, deep=False))
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, (tuple, list)):
+        return sum(_size(item) for item in result)
+    if isinstance(result, dict):
+        return sum(_size(item) for item in result.values())
+    return 0
+
+
+def _remember(key, result):
+    _memory[key] = result
+    _memory.move_to_end(key)
+    while len(_memory) > max_memory_entries:
+        _memory.popitem(last=False)
+
+
+def _read(key):
+    path = cache_path / (key + ".pkl.z")
+    try:
+        with open(path, "rb") as file:
+            result = pickle.loads(zlib.decompress(file.read()))
+        #the modification time orders the entries for the LRU eviction
+        os.utime(path)
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+        return None
+    return result
+
+
+def _evict():
+    """
+    Deletes the least recently used results until the directory fits in max_disk_bytes
+    """
+    entries = []
+    for path in cache_path.glob("*.pkl.z"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_disk_bytes:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+
+
+def _write(key, result):
+    try:
+        payload = zlib.compress(pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        if len(payload) > max_disk_bytes:
+            return
+        cache_path.mkdir(exist_ok=True)
+        #written under a temporary name so that concurrent readers never see a partial file
+        temporary_file = cache_path / f"{key}.{os.getpid()}.tmp"
+        with open(temporary_file, "wb") as file:
+            file.write(payload)
+        os.replace(temporary_file, cache_path / (key + ".pkl.z"))
+        _evict()
+    except (OSError, pickle.PicklingError):
+        pass
+
+
+def cached(function=None, stochastic=False, side_effects=(), execution=()):
+    """
+    Memoizes a function of price frames
+    Parameters
+    ----------
+    function: callable
+        The decorated function
+    stochastic: bool
+        Whether the function draws random numbers, it is only cached when its seed argument is an int
+    side_effects: tuple
+        The flag arguments (e.g. verbose) whose truthy values make the function print, those calls are not cached
+    execution: tuple
+        The arguments that only choose how the result is computed (e.g. max_workers), left out of the key
+
+    Returns
+    -------
+    wrapper: callable
+        The memoized function, wrapper.__wrapped__ is the original
+    """
+    if function is None:
+        return functools.partial(cached, stochastic=stochastic, side_effects=side_effects, execution=execution)
+
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return function(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        if stochastic and not isinstance(arguments.get("seed"), (int, np.integer)):
+            return function(*args, **kwargs)
+        if any(arguments.get(name) for name in side_effects):
+            return function(*args, **kwargs)
+
+        key = _key(function, {name: value for name, value in arguments.items() if name not in execution})
+        result = _memory.get(key)
+        if result is not None:
+            _memory.move_to_end(key)
+            return _copy(result)
+        result = _read(key)
+        if result is None:
+            result = function(*args, **kwargs)
+            if _size(result) > max_entry_bytes:
+                return result
+            _write(key, result)
+        _remember(key, result)
+        return _copy(result)
+
+    return wrapper
+
+
+def clear(disk=True):
+    """
+    Empties the in-process cache and, when disk is True, the cache directory
+    """
+    _memory.clear()
+    if disk:
+        for path in cache_path.glob("*.pkl.z"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
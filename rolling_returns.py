@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+from instrumentation import stage
+from result_cache import cached
+from price_index import as_frame
+from total_return import TotalReturnIndex
+
+
+def _rolling_means(values, average):
+    """
+    Computes the mean of every run of average consecutive values with a prefix sum
+    Parameters
+    ----------
+    values: np.ndarray
+        The values
+    average: int
+        The length of a run
+
+    Returns
+    -------
+    means: np.ndarray
+        means[i] is the mean of values[i:i + average], len(values) - average + 1 runs
+    """
+    prefix = np.concatenate([[0], np.cumsum(values)])
+    return (prefix[average:] - prefix[:-average]) / average
+
+
+def window_returns(values, window=252, average=None):
+    """
+    Computes the return of every window of a daily series with shifted arrays
+    Parameters
+    ----------
+    values: np.ndarray
+        The daily values of an index
+    window: int
+        The number of trading days between the start and the end of a window
+    average: int
+        When given, a window runs from the mean of the average days starting at its start
+        day to the mean of the average days starting window days later (average=window
+        compares consecutive yearly means like the annual returns)
+
+    Returns
+    -------
+    returns: np.ndarray
+        The return (%) of the window starting at each day, for the
+        len(values) - window - (average or 1) + 1 complete windows; a ValueError is
+        raised for a window shorter than a day or without any complete window
+    """
+    values = np.asarray(values, dtype=float)
+    if window < 1:
+        raise ValueError(f"window must be at least 1 day, got {window}")
+    if window + (average or 1) > len(values):
+        raise ValueError(f"A window of {window} days (averaged over {average or 1}) is longer than "
+                         f"the {len(values)} days of the series")
+    if average:
+        values = _rolling_means(values, average)
+    return (values[window:] / values[:-window] - 1) * 100
+
+
+@cached
+def rolling_returns(data, window=252, real=True, dividends=None, average=None):
+    """
+    Computes the return of holding for a fixed number of trading days from every start day,
+    instead of one return per calendar year
+    Parameters
+    ----------
+    data: TotalReturnIndex, pd.DataFrame or dict
+        The daily index of an asset (see total_return.load_total_return), a price frame,
+        or a dict of them by asset
+    window: int
+        The number of trading days held
+    real: bool
+        Whether the returns are adjusted for inflation
+    dividends: bool
+        Whether the dividends are reinvested. By default those of the index, and none for
+        a price frame, which does not tell its asset; True reinvests the SP500 yields of
+        data.py. Compare assets through their load_total_return indexes.
+    average: int
+        The number of days averaged at both ends of a window, None for day to day returns.
+        average=window mimics the year mean to year mean annual returns, e.g. average=21
+        with window=231 the January mean to December mean of the control groups
+
+    Returns
+    -------
+    results: pd.DataFrame
+        One row per window with its Start Date, End Date (first days of the averaged runs)
+        and (%)Return; indexed by Asset and window for a dict
+    """
+    if isinstance(data, dict):
+        return pd.concat({asset: rolling_returns(values, window, real, dividends, average) for asset, values in data.items()},
+                         names=["Asset"])
+
+    index = data if isinstance(data, TotalReturnIndex) else TotalReturnIndex.from_frame(as_frame(data), dividends=dividends)
+    with stage("rolling_returns", rows=len(index)):
+        with stage("windows", rows=len(index)):
+            #the total return of an index built without dividends is its price
+            returns = window_returns(index.series(real, dividends is not False), window, average)
+        with stage("assembly", rows=len(returns)):
+            return pd.DataFrame({"Start Date": index.dates[:len(returns)],
+                                 "End Date": index.dates[window:window + len(returns)],
+                                 "(%)Return": returns})
@@ -0,0 +1,110 @@
+"""
+Seeded purchase-day sampling for the long-term simulations.
+
+Every (year, shard) pair draws from its own numpy Generator whose SeedSequence is
+derived from the sampler seed and that key, so a run gives the same purchases
+whichever process draws a year or in which order, and shards of a Monte Carlo run
+split across workers are reproducible bit for bit. spawn() gives independent child
+samplers, e.g. one per replication.
+"""
+import numpy as np
+
+
+def draw_purchase_indices(rng, n_candidates, purchase_times, sample_size):
+    """
+    Draws sample_size sets of purchase_times distinct row positions out of n_candidates.
+    Every set is a uniform sample without replacement (Floyd's algorithm, run for all
+    the samples at once).
+    Parameters
+    ----------
+    rng: np.random.Generator
+        The random number generator
+    n_candidates: int
+        The number of rows to choose from
+    purchase_times: int
+        The number of rows chosen by each sample
+    sample_size: int
+        The number of samples
+
+    Returns
+    -------
+    indices: np.ndarray
+        A (sample_size, purchase_times) array of positions in [0, n_candidates)
+    """
+    if purchase_times > n_candidates:
+        raise ValueError("Cannot take a larger sample than population when 'replace=False'")
+
+    indices = np.empty((sample_size, purchase_times), dtype=np.intp)
+    for i, j in enumerate(range(n_candidates - purchase_times, n_candidates)):
+        candidate = rng.integers(0, j + 1, size=sample_size)
+        taken = (indices[:, :i] == candidate[:, None]).any(axis=1)
+        indices[:, i] = np.where(taken, j, candidate)
+    return indices
+
+
+class PurchaseSampler:
+    """
+    Draws purchase rows of a year straight from the row offsets of year_rows.
+
+    Parameters
+    ----------
+    order: np.ndarray
+        The rows sorted by year, see price_index.year_rows
+    year_offsets: np.ndarray
+        The offsets of every year in order, see price_index.year_rows
+    first_year: int
+        The year of the first offset
+    seed: int or np.random.SeedSequence
+        The seed of the draws, fresh entropy when None
+    """
+
+    def __init__(self, order, year_offsets, first_year, seed=None):
+        self.order = order
+        self.year_offsets = year_offsets
+        self.first_year = first_year
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+
+    def spawn(self, n):
+        """
+        Returns n samplers of the same years with independent streams
+        """
+        return [PurchaseSampler(self.order, self.year_offsets, self.first_year, child)
+                for child in self.seed_sequence.spawn(n)]
+
+    def generator(self, year, shard=0):
+        """
+        Returns the random number generator of a year and shard
+        """
+        sequence = np.random.SeedSequence(self.seed_sequence.entropy,
+                                          spawn_key=self.seed_sequence.spawn_key + (year, shard),
+                                          pool_size=self.seed_sequence.pool_size)
+        return np.random.Generator(np.random.PCG64(sequence))
+
+    def rows(self, year):
+        """
+        Returns the rows of a year
+        """
+        offset = year - self.first_year
+        return self.order[self.year_offsets[offset]:self.year_offsets[offset + 1]]
+
+    def draw(self, year, purchase_times, sample_size, shard=0):
+        """
+        Draws the purchase rows of sample_size simulations
+        Parameters
+        ----------
+        year: int
+            The year of the purchases
+        purchase_times: int
+            The number of distinct purchase days of each simulation
+        sample_size: int
+            The number of simulations
+        shard: int
+            The shard of the simulations of the year, each shard has its own stream
+
+        Returns
+        -------
+        rows: np.ndarray
+            A (sample_size, purchase_times) array of rows
+        """
+        rows = self.rows(year)
+        return rows[draw_purchase_indices(self.generator(year, shard), len(rows), purchase_times, sample_size)]
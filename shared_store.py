@@ -0,0 +1,168 @@
+"""
+Arrays published once into shared memory and attached by worker processes without copying.
+
+The owner publishes a dict of arrays with SharedArrays and passes its handle, a small
+picklable description of the segment, to the workers; attach(handle) returns read-only
+views of the arrays in the shared segment. share_prices publishes the Date, Close,
+Year and Month columns of a price frame and price_frame rebuilds a DataFrame on the
+views that the analysis functions accept like the CSV frames.
+
+    with share_prices(df) as store:
+        with ProcessPoolExecutor(initializer=..., initargs=(store.handle,)) as executor:
+            ...
+    #in a worker
+    df = price_frame(handle)
+"""
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+#offsets of the arrays are aligned for any dtype
+_alignment = 64
+
+#segments attached by the current process, kept open while their views are in use
+_attached = {}
+
+
+class SharedHandle:
+    """
+    Describes the arrays of a shared memory segment
+
+    Parameters
+    ----------
+    name: str
+        The name of the segment
+    fields: tuple
+        The (key, dtype, shape, offset) of every array
+    """
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __repr__(self):
+        return f"SharedHandle({self.name!r}, {[key for key, *_ in self.fields]})"
+
+
+class SharedArrays:
+    """
+    Copies arrays into a new shared memory segment owned by the current process. The
+    segment is released by close(), or on leaving the with block.
+
+    Parameters
+    ----------
+    arrays: dict
+        The arrays published, by key
+    """
+
+    def __init__(self, arrays):
+        arrays = {key: np.ascontiguousarray(values) for key, values in arrays.items()}
+        fields = []
+        size = 0
+        for key, values in arrays.items():
+            fields.append((key, values.dtype.str, values.shape, size))
+            size += -(-values.nbytes // _alignment) * _alignment
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.handle = SharedHandle(self.memory.name, tuple(fields))
+        for (key, dtype, shape, offset), values in zip(fields, arrays.values()):
+            np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)[...] = values
+
+    def arrays(self):
+        """
+        Returns read-only views of the published arrays
+        """
+        return _views(self.memory, self.handle)
+
+    def close(self):
+        _attached.pop(self.handle.name, None)
+        self.memory.unlink()
+        try:
+            self.memory.close()
+        except BufferError:
+            #views still in use keep the mapping alive until they are collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def _views(memory, handle):
+    views = {}
+    for key, dtype, shape, offset in handle.fields:
+        values = np.ndarray(shape, dtype=dtype, buffer=memory.buf, offset=offset)
+        values.flags.writeable = False
+        views[key] = values
+    return views
+
+
+def attach(handle):
+    """
+    Attaches the segment of a handle
+    Parameters
+    ----------
+    handle: SharedHandle
+        The handle of a SharedArrays
+
+    Returns
+    -------
+    arrays: dict
+        Read-only views of the arrays, valid for the life of the segment
+    """
+    memory = _attached.get(handle.name)
+    if memory is None:
+        try:
+            #the owner unlinks the segment, workers must not register it for cleanup (Python 3.13+)
+            memory = shared_memory.SharedMemory(name=handle.name, track=False)
+        except TypeError:
+            memory = shared_memory.SharedMemory(name=handle.name)
+        _attached[handle.name] = memory
+    return _views(memory, handle)
+
+
+def share_prices(df):
+    """
+    Publishes the price columns of a frame
+    Parameters
+    ----------
+    df: pd.DataFrame
+        A price frame with Close and Date (column or index) and optionally Year and Month columns
+
+    Returns
+    -------
+    store: SharedArrays
+        The segment holding Date (datetime64[ns]), Close (float64), Year (int16) and Month (int8)
+    """
+    dates = pd.to_datetime(df["Date"] if "Date" in df.columns else df.index).values.astype("datetime64[ns]")
+    years = df["Year"].values if "Year" in df.columns else dates.astype("datetime64[Y]").astype(int) + 1970
+    months = df["Month"].values if "Month" in df.columns else dates.astype("datetime64[M]").astype(int) % 12 + 1
+    return SharedArrays({"Date": dates,
+                         "Close": df["Close"].values.astype(np.float64),
+                         "Year": np.asarray(years, dtype=np.int16),
+                         "Month": np.asarray(months, dtype=np.int8)})
+
+
+def price_frame(handle, index=None):
+    """
+    Builds a price frame on the shared arrays of share_prices, without copying them
+    Parameters
+    ----------
+    handle: SharedHandle
+        The handle of the store
+    index: str
+        The column used as the index, e.g. "Date" for simulate_trade_EMA_gold
+
+    Returns
+    -------
+    df: pd.DataFrame
+        The Date, Close, Year and Month columns as views of the shared segment
+    """
+    arrays = attach(handle)
+    if index is None:
+        return pd.DataFrame(arrays, copy=False)
+    index_values = arrays.pop(index)
+    return pd.DataFrame(arrays, index=pd.Index(index_values, name=index, copy=False), copy=False)
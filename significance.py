@@ -0,0 +1,259 @@
+import itertools
+import numpy as np
+import pandas as pd
+from instrumentation import stage
+
+_resample_state = {}
+
+
+def _init_resample_worker(state):
+    """
+    Stores the paired differences once per worker process
+    """
+    _resample_state.update(state)
+
+
+def _paired_differences(returns, pairs):
+    """
+    Builds the matrix of paired differences of a return table
+    Parameters
+    ----------
+    returns: pd.DataFrame
+        One column of yearly returns per strategy, like joinDF
+    pairs: list
+        The (strategy, baseline) column pairs compared, every pair of columns when None
+
+    Returns
+    -------
+    differences: np.ndarray
+        The (years, pairs) matrix of strategy - baseline returns over the years at least
+        one pair has both returns, NaN where a pair misses either return
+    pairs: list
+        The pairs compared
+    """
+    if pairs is None:
+        pairs = list(itertools.combinations(returns.columns, 2))
+    pairs = [tuple(pair) for pair in pairs]
+    columns = list(dict.fromkeys(column for pair in pairs for column in pair))
+    values = returns[columns].values.astype(float)
+    position = {column: i for i, column in enumerate(columns)}
+    differences = (values[:, [position[a] for a, _ in pairs]] - values[:, [position[b] for _, b in pairs]])
+    differences = differences[~np.isnan(differences).all(axis=1)]
+
+    #every pair is compared over its own years, the other pairs do not remove any
+    counts = (~np.isnan(differences)).sum(axis=0)
+    for pair, count in zip(pairs, counts):
+        if count < 2:
+            raise ValueError(f"Pair {pair} has {count} years with both returns, at least 2 are needed")
+    return differences, pairs
+
+
+def _block_length(n, block_length):
+    #the n^(1/3) rule of thumb for the block length of a block bootstrap
+    if block_length is None:
+        block_length = max(int(round(n ** (1 / 3))), 1)
+    return min(block_length, n)
+
+
+def block_bootstrap_indices(rng, n, n_resamples, block_length):
+    """
+    Draws the rows of every resample of a circular block bootstrap
+    Parameters
+    ----------
+    rng: np.random.Generator
+        The random number generator
+    n: int
+        The number of rows (years)
+    n_resamples: int
+        The number of resamples
+    block_length: int
+        The number of consecutive rows of a block
+
+    Returns
+    -------
+    indices: np.ndarray
+        A (n_resamples, n) matrix of row positions, all the resamples at once
+    """
+    n_blocks = -(-n // block_length)
+    starts = rng.integers(0, n, size=(n_resamples, n_blocks))
+    indices = (starts[:, :, None] + np.arange(block_length)) % n
+    return indices.reshape(n_resamples, -1)[:, :n]
+
+
+def block_sign_flips(rng, n, n_resamples, block_length):
+    """
+    Draws the signs of every resample of a sign-flip permutation test, flipping blocks
+    of consecutive rows together
+    Parameters
+    ----------
+    rng: np.random.Generator
+        The random number generator
+    n: int
+        The number of rows (years)
+    n_resamples: int
+        The number of resamples
+    block_length: int
+        The number of consecutive rows sharing a sign
+
+    Returns
+    -------
+    signs: np.ndarray
+        A (n_resamples, n) matrix of +1 / -1
+    """
+    n_blocks = -(-n // block_length)
+    signs = rng.integers(0, 2, size=(n_resamples, n_blocks), dtype=np.int8) * 2 - 1
+    return np.repeat(signs, block_length, axis=1)[:, :n]
+
+
+def _reduce_batch(state, kind, batch):
+    """
+    Computes the mean paired difference of a batch of resamples
+    Parameters
+    ----------
+    state: dict
+        The paired differences (0 where missing) and the mask of the years each pair has
+    kind: str
+        "bootstrap" for a batch of row indices, "sign_flip" for a batch of signs
+    batch: np.ndarray
+        A slice of the index or sign matrix
+
+    Returns
+    -------
+    means: np.ndarray
+        The (resamples, pairs) matrix of mean differences, NaN for a resample without
+        any year of a pair
+    """
+    differences = state["differences"]
+    n = len(differences)
+    if kind == "bootstrap":
+        #the mean of a resample is the row counts times the differences, one matrix product per batch
+        cells = (np.arange(len(batch))[:, None] * n + batch).ravel()
+        weights = np.bincount(cells, minlength=len(batch) * n).reshape(len(batch), n)
+        counts = weights @ state["valid"]
+    else:
+        weights = batch
+        counts = state["valid"].sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weights @ differences) / counts
+
+
+def _reduce_worker(task):
+    return _reduce_batch(_resample_state, *task)
+
+
+def _reduce(differences, kind, resamples, batch_size, max_workers):
+    """
+    Reduces the resample matrix in batches, across a process pool unless max_workers is 1
+    """
+    valid = ~np.isnan(differences)
+    state = {"differences": np.where(valid, differences, 0), "valid": valid.astype(float)}
+    tasks = [(kind, resamples[i:i + batch_size]) for i in range(0, len(resamples), batch_size)]
+    if max_workers == 1:
+        return np.concatenate([_reduce_batch(state, *task) for task in tasks])
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_resample_worker, initargs=(state,)) as executor:
+        return np.concatenate(list(executor.map(_reduce_worker, tasks)))
+
+
+def paired_bootstrap(returns, pairs=None, n_resamples=10000, block_length=None, confidence=0.95, seed=None,
+                     batch_size=1000, max_workers=None):
+    """
+    Computes block bootstrap confidence intervals of the mean difference between paired strategies.
+
+    All the pairs are resampled with the same years, so the intervals of different pairs
+    come from the same resamples. Each pair only averages the years where both of its
+    columns have a return, the missing returns of other columns do not change it.
+
+    Parameters
+    ----------
+    returns: pd.DataFrame
+        One column of yearly returns per strategy, like joinDF
+    pairs: list
+        The (strategy, baseline) column pairs compared, every pair of columns when None
+    n_resamples: int
+        The number of bootstrap resamples
+    block_length: int
+        The number of consecutive years resampled together, n^(1/3) when None
+    confidence: float
+        The confidence level of the intervals
+    seed: int
+        The seed of the resamples
+    batch_size: int
+        The number of resamples reduced by a worker at once
+    max_workers: int
+        The number of worker processes, 1 reduces the resamples in the current process
+
+    Returns
+    -------
+    results: pd.DataFrame
+        One row per pair with its number of years, the mean difference and its percentile
+        confidence interval
+    """
+    with stage("paired_bootstrap", rows=returns.size):
+        with stage("load", rows=returns.size):
+            differences, pairs = _paired_differences(returns, pairs)
+            n = len(differences)
+            block_length = _block_length(n, block_length)
+        with stage("resamples", rows=n_resamples * n):
+            indices = block_bootstrap_indices(np.random.default_rng(seed), n, n_resamples, block_length)
+        with stage("reduction", rows=n_resamples * n * len(pairs)):
+            means = _reduce(differences, "bootstrap", indices, batch_size, max_workers)
+        with stage("assembly", rows=len(pairs)):
+            alpha = (1 - confidence) / 2
+            lower, upper = np.nanquantile(means, [alpha, 1 - alpha], axis=0)
+            return pd.DataFrame({"Strategy": [a for a, _ in pairs],
+                                 "Baseline": [b for _, b in pairs],
+                                 "Years": (~np.isnan(differences)).sum(axis=0),
+                                 "Mean Difference": np.nanmean(differences, axis=0),
+                                 "CI Lower": lower,
+                                 "CI Upper": upper})
+
+
+def sign_flip_test(returns, pairs=None, n_resamples=10000, block_length=1, seed=None, batch_size=1000,
+                   max_workers=None):
+    """
+    Tests whether the mean difference between paired strategies is zero by randomly
+    flipping the signs of the yearly differences (a paired permutation test). Each pair
+    is tested over the years where both of its columns have a return.
+    Parameters
+    ----------
+    returns: pd.DataFrame
+        One column of yearly returns per strategy, like joinDF
+    pairs: list
+        The (strategy, baseline) column pairs compared, every pair of columns when None
+    n_resamples: int
+        The number of sign flips
+    block_length: int
+        The number of consecutive years sharing a sign, n^(1/3) when None
+    seed: int
+        The seed of the sign flips
+    batch_size: int
+        The number of sign flips reduced by a worker at once
+    max_workers: int
+        The number of worker processes, 1 reduces the flips in the current process
+
+    Returns
+    -------
+    results: pd.DataFrame
+        One row per pair with its number of years, the mean difference and its two-sided p-value
+    """
+    with stage("sign_flip_test", rows=returns.size):
+        with stage("load", rows=returns.size):
+            differences, pairs = _paired_differences(returns, pairs)
+            n = len(differences)
+            block_length = _block_length(n, block_length)
+        with stage("resamples", rows=n_resamples * n):
+            signs = block_sign_flips(np.random.default_rng(seed), n, n_resamples, block_length)
+        with stage("reduction", rows=n_resamples * n * len(pairs)):
+            means = _reduce(differences, "sign_flip", signs, batch_size, max_workers)
+        with stage("assembly", rows=len(pairs)):
+            observed = np.nanmean(differences, axis=0)
+            #the observed statistic counts as one of the flips, the tolerance keeps the
+            #flips reproducing it up to rounding among the extreme ones
+            extreme = (np.abs(means) >= np.abs(observed) - 1e-12 * np.abs(observed)).sum(axis=0)
+            return pd.DataFrame({"Strategy": [a for a, _ in pairs],
+                                 "Baseline": [b for _, b in pairs],
+                                 "Years": (~np.isnan(differences)).sum(axis=0),
+                                 "Mean Difference": observed,
+                                 "p-value": (extreme + 1) / (n_resamples + 1)})
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from annual_calculations import commodity_returns_frame, stock_returns_frame
+from online_ema import OnlineEMACrossover
+from trade_simulations import control_group_frame
+
+
+class _MonthlyAccumulator:
+    """
+    Running sums and counts of the close prices of every year and month seen so far
+    """
+
+    def __init__(self):
+        self.first_year = None
+        self.sums = np.zeros((0, 12))
+        self.counts = np.zeros((0, 12), dtype=np.int64)
+
+    def _extend(self, first_year, last_year):
+        if self.first_year is None:
+            self.first_year = first_year
+        before = max(self.first_year - first_year, 0)
+        after = max(last_year - (self.first_year + len(self.sums) - 1), 0)
+        if before or after:
+            self.sums = np.pad(self.sums, ((before, after), (0, 0)))
+            self.counts = np.pad(self.counts, ((before, after), (0, 0)))
+            self.first_year -= before
+
+    def add(self, years, months, close):
+        valid = ~np.isnan(close)
+        years, months, close = years[valid], months[valid], close[valid]
+        if len(close) == 0:
+            return
+        self._extend(int(years.min()), int(years.max()))
+        cells = (years - self.first_year) * 12 + months - 1
+        self.sums += np.bincount(cells, weights=close, minlength=self.sums.size).reshape(-1, 12)
+        self.counts += np.bincount(cells, minlength=self.counts.size).reshape(-1, 12)
+
+    def _window(self, values, first_year, last_year, fill):
+        window = np.full((last_year - first_year + 1, 12), fill, dtype=values.dtype)
+        if self.first_year is None:
+            return window
+        low = max(first_year, self.first_year)
+        high = min(last_year, self.first_year + len(values) - 1)
+        if low <= high:
+            window[low - first_year:high - first_year + 1] = values[low - self.first_year:high - self.first_year + 1]
+        return window
+
+    def monthly_means(self, first_year, last_year):
+        sums = self._window(self.sums, first_year, last_year, 0.0)
+        counts = self._window(self.counts, first_year, last_year, 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+
+    def yearly_means(self, first_year, last_year):
+        sums = self._window(self.sums, first_year, last_year, 0.0).sum(axis=1)
+        counts = self._window(self.counts, first_year, last_year, 0).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / counts
+
+
+def stream_analytics(path, chunksize=1_000_000, EMA1=12, EMA2=26, gold=False, units=20, expense_rate=0.00095,
+                     start=1951, end=2024):
+    """
+    Computes the annual returns, the EMA Crossover Trading results and the control group
+    of a price file too large for memory.
+
+    The file is read in blocks of chunksize rows; the EMAs, the open position and the
+    per-year and per-month price sums are carried across blocks, so the peak memory
+    depends on the chunk size and not on the file size. The tables are the ones of
+    compute_annual_returns_stocks, simulate_trade_EMA and simulate_control_group
+    (compute_annual_returns_commodity, simulate_trade_EMA_gold and
+    simulate_control_group_gold for gold).
+
+    Parameters
+    ----------
+    path: str or pathlib.Path
+        A CSV file with Date and Close columns in chronological order, any bar frequency
+    chunksize: int
+        The number of rows read at once
+    EMA1: int
+        Span of the fast EMA.
+    EMA2: int
+        Span of the slow EMA.
+    gold: bool
+        Whether the prices are gold prices (traded 1970-2022, no expenses, unscaled) instead of SP500
+    units: int
+        The number of ETFs / ounces bought.
+    expense_rate: float
+        The expense rate of SPY ETF, ignored for gold.
+    start: int
+        The first year whose annual return is computed
+    end: int
+        The end of the annual return periods (exclusive)
+
+    Returns
+    -------
+    results: dict
+        The "annual_returns", "trades" and "control_group" tables
+    """
+    if gold:
+        first_year, last_year, price_scale, expense_rate = 1970, 2022, 1, 0
+    else:
+        first_year, last_year, price_scale = 1950, 2022, 10
+
+    engine = OnlineEMACrossover(EMA1, EMA2, units, expense_rate, price_scale, first_year, last_year)
+    accumulator = _MonthlyAccumulator()
+    for chunk in pd.read_csv(path, usecols=["Date", "Close"], chunksize=chunksize):
+        dates = pd.to_datetime(chunk["Date"]).values
+        close = chunk["Close"].values.astype(float)
+        years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+        months = dates.astype("datetime64[M]").astype(np.int64) % 12 + 1
+        accumulator.add(years, months, close)
+        engine.update_many(dates, close)
+    engine.finalize()
+
+    yearly_means = accumulator.yearly_means(start - 1, end - 1)
+    if gold:
+        annual_returns = commodity_returns_frame(yearly_means, start, end)
+    else:
+        annual_returns = stock_returns_frame(yearly_means, start, end)
+
+    control_group = control_group_frame(accumulator.monthly_means(first_year, last_year), first_year, units,
+                                         expense_rate, price_scale, gold)
+    return {"annual_returns": annual_returns,
+            "trades": engine.results(gold=gold),
+            "control_group": control_group}
@@ -0,0 +1,227 @@
+"""
+Running summary statistics of samples that are never materialized together.
+
+RunningStats keeps the count, mean, variance, min and max of every column of a stream
+of sample batches, merging each batch with Chan's parallel form of Welford's update,
+and a QuantileSketch per column. Memory stays bounded by the sketch size whatever the
+number of samples.
+"""
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch:
+    """
+    KLL quantile sketch: a stack of compactors, level h holding items of weight 2^h.
+    A full compactor sorts its items and promotes every other one (from a random first
+    item) to the level above, so about k (2/3)^depth items are kept per level. The rank
+    error is O(1/k) with high probability; up to k items the quantiles are exact.
+
+    Compaction is lazy: the levels only shrink once the sketch holds lazy times the sum
+    of their capacities. A batch larger than 2k is sorted once and its successive
+    halvings are taken as one strided slice, so a stream of large batches costs one
+    sort per batch instead of a cascade of sorts.
+
+    Parameters
+    ----------
+    k: int
+        The capacity of the top compactor, the accuracy parameter
+    rng: np.random.Generator
+        The random number generator choosing the promoted items
+    lazy: int
+        The multiple of the total capacity held before compacting
+    """
+
+    def __init__(self, k=200, rng=None, lazy=4):
+        self.k = k
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.lazy = lazy
+        self.levels = [np.empty(0)]
+        self.count = 0
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        if sum(map(len, self.levels)) <= self.lazy * sum(map(self._capacity, range(len(self.levels)))):
+            return
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                #an odd item out stays at its level
+                kept, items = items[len(items) - len(items) % 2:], items[:len(items) - len(items) % 2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], items[self.rng.integers(2)::2]])
+                self.levels[level] = kept
+            level += 1
+
+    def update(self, values):
+        """
+        Adds a batch of values, NaNs are skipped
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        level = int(np.log2(len(values) / self.k)) if len(values) > 2 * self.k else 0
+        if level:
+            #a batch much larger than the sketch is sorted once and halved level times in
+            #one stride, like the cascade would; the largest len % 2^level items stay at level 0
+            stride = 2 ** level
+            values = np.sort(values)
+            whole = len(values) - len(values) % stride
+            self.levels[0] = np.concatenate([self.levels[0], values[whole:]])
+            values = values[self.rng.integers(stride):whole:stride]
+            while len(self.levels) <= level:
+                self.levels.append(np.empty(0))
+        self.levels[level] = np.concatenate([self.levels[level], values])
+        self._compress()
+
+    def merge(self, other):
+        """
+        Adds the items of another sketch
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compress()
+
+    def quantile(self, q):
+        """
+        Returns the estimated quantiles (inverted CDF definition), NaN for an empty sketch
+        """
+        q = np.asarray(q, dtype=float)
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2.0 ** level) for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        positions = np.searchsorted(cumulative, q * cumulative[-1], side="left")
+        return items[order][np.minimum(positions, len(items) - 1)]
+
+
+class RunningStats:
+    """
+    Count, mean, variance, min, max and quantile sketch of every column of a stream of batches.
+
+    Parameters
+    ----------
+    columns: list
+        The names of the columns
+    k: int
+        The accuracy parameter of the quantile sketches
+    seed: int
+        The seed of the sketches
+    """
+
+    def __init__(self, columns, k=200, seed=None):
+        self.columns = list(columns)
+        n_columns = len(self.columns)
+        self.count = np.zeros(n_columns, dtype=np.int64)
+        self.mean = np.zeros(n_columns)
+        self.m2 = np.zeros(n_columns)
+        self.min = np.full(n_columns, np.inf)
+        self.max = np.full(n_columns, -np.inf)
+        rng = np.random.default_rng(seed)
+        self.sketches = [QuantileSketch(k, rng) for _ in range(n_columns)]
+
+    def _combine(self, count, mean, m2):
+        #Chan et al.: the moments of the union of two sets from the moments of each
+        total = self.count + count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0)
+            self.m2 = np.where(total > 0, self.m2 + m2 + delta ** 2 * self.count * count / total, 0)
+        self.count = total
+
+    def update(self, values):
+        """
+        Adds a batch of samples
+        Parameters
+        ----------
+        values: np.ndarray
+            A (samples, columns) matrix, NaNs are skipped
+        """
+        #one contiguous row per column, the reductions then run along memory
+        values = np.ascontiguousarray(np.asarray(values, dtype=float).reshape(-1, len(self.columns)).T)
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, np.where(valid, values, 0).sum(axis=1) / count, 0)
+            m2 = np.where(valid, (values - mean[:, None]) ** 2, 0).sum(axis=1)
+        self._combine(count, mean, m2)
+        self.min = np.fmin(self.min, np.fmin.reduce(values, axis=1, initial=np.inf))
+        self.max = np.fmax(self.max, np.fmax.reduce(values, axis=1, initial=-np.inf))
+        for sketch, column in zip(self.sketches, values):
+            sketch.update(column)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another RunningStats of the same columns, e.g. from another process
+        """
+        self._combine(other.count, other.mean, other.m2)
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+
+    def summary(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        """
+        Returns the statistics of every column
+        Parameters
+        ----------
+        quantiles: tuple
+            The quantiles reported
+
+        Returns
+        -------
+        summary: pd.DataFrame
+            One row per column with Count, Mean, Variance (sample), Std, Min, Max and one
+            column per quantile ("5%", "50%", ...)
+        """
+        empty = self.count == 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = np.where(self.count > 1, self.m2 / (self.count - 1), np.nan)
+        summary = pd.DataFrame({"Column": self.columns,
+                                "Count": self.count,
+                                "Mean": np.where(empty, np.nan, self.mean),
+                                "Variance": variance,
+                                "Std": np.sqrt(variance),
+                                "Min": np.where(empty, np.nan, self.min),
+                                "Max": np.where(empty, np.nan, self.max)})
+        estimates = np.array([sketch.quantile(quantiles) for sketch in self.sketches]).reshape(len(self.columns), -1)
+        for q, values in zip(quantiles, estimates.T):
+            summary[f"{q * 100:g}%"] = values
+        return summary
+
+
+def period_summary(periods, stats, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """
+    Stacks the statistics of every investment period
+    Parameters
+    ----------
+    periods: list
+        The (start year, end year) of each period
+    stats: list
+        The RunningStats of each period
+    quantiles: tuple
+        The quantiles reported
+
+    Returns
+    -------
+    summary: pd.DataFrame
+        One row per period and column, with integer Start Year and End Year columns
+    """
+    frames = []
+    for (start_year, end_year), period_stats in zip(periods, stats):
+        frame = period_stats.summary(quantiles)
+        frame.insert(0, "Start Year", start_year)
+        frame.insert(1, "End Year", end_year)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from loader import load_preprocessed
+from rolling_returns import rolling_returns, window_returns
+from total_return import load_total_return
+
+
+def test_window_returns():
+    values = np.array([100, 110, 121, 100, 150])
+    np.testing.assert_allclose(window_returns(values, window=1), [10, 10, 100 / 121 * 100 - 100, 50])
+    np.testing.assert_allclose(window_returns(values, window=4), [50])
+    np.testing.assert_allclose(window_returns(values, window=2, average=2), [(110.5 / 105 - 1) * 100, (125 / 115.5 - 1) * 100])
+
+
+@pytest.mark.parametrize("window", [0, -1])
+def test_window_shorter_than_a_day(window):
+    with pytest.raises(ValueError, match="at least 1 day"):
+        window_returns(np.arange(1, 10), window=window)
+
+
+@pytest.mark.parametrize("window, average", [(5, None), (6, None), (4, 2), (3, 3)])
+def test_window_longer_than_the_series(window, average):
+    with pytest.raises(ValueError, match="longer than the 5 days"):
+        window_returns(np.arange(1, 6), window=window, average=average)
+
+
+def test_gold_frame_matches_its_persisted_index():
+    index = load_total_return("Gold_prices")
+    expected = rolling_returns(index)
+    from_frame = rolling_returns(load_preprocessed("Gold_prices"))
+    np.testing.assert_allclose(from_frame["(%)Return"], expected["(%)Return"])
+    by_asset = rolling_returns({"SPX": load_total_return("SP500_whole"), "Gold": load_preprocessed("Gold_prices")})
+    np.testing.assert_allclose(by_asset.loc["Gold", "(%)Return"], expected["(%)Return"])
+    assert from_frame["(%)Return"].mean() < by_asset.loc["SPX", "(%)Return"].mean()
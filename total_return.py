@@ -0,0 +1,287 @@
+"""
+Daily total-return indexes of the price files, with dividends and CPI.
+
+On every trading day the index holds the close, the nominal total return index (the
+close with the dividends reinvested every day), the real price and the real total
+return index (both in the dollars of the last CPI year). Any holding-period return
+between two dates is then two lookups and a division.
+
+The dividend yield of a year is the year end yield of the year before, as in the
+annual simulations, accrued geometrically over the trading days of the year. The
+annual average CPI is placed at the middle of its year and interpolated geometrically
+between years (held flat after the last one). load_total_return persists the index of
+a price file under Preprocessed Data/.cache and rebuilds it when the prices, the CPI
+or the dividend yields change; ingestion.refresh rebuilds them after every ingestion.
+
+holding_period_returns_stocks, horizon_returns_stocks and simulate_twenty_years_of_investment
+take source="daily" to grow the SP500 by the yearly means of the index instead of adding
+the dividend yield to the yearly mean prices. The gold functions have no such option,
+without dividends the index of gold is its close.
+"""
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import data
+from loader import cache_path, data_path, file_hash, load_preprocessed, source_stamp
+
+#whether the dividends of each price file are reinvested
+dividend_files = {"SP500_whole": True, "Gold_prices": False}
+
+#bump when the construction of the index changes, the persisted indexes are rebuilt
+_format_version = 1
+
+
+def _year_values(table, years):
+    """
+    Looks the values of a YearTable up, NaN outside the table
+    """
+    offsets = np.asarray(years) - table.first_year
+    inside = (offsets >= 0) & (offsets < len(table.values))
+    return np.where(inside, table.values[np.clip(offsets, 0, len(table.values) - 1)], np.nan)
+
+
+def _daily_cpi(dates, cpi_table):
+    """
+    Interpolates the annual average CPI at every date
+    """
+    valid = ~np.isnan(cpi_table.values)
+    years = cpi_table.years[valid]
+    #days since 1970 of the 1st of July of every year
+    anchors = (years - 1970).astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64) + 181
+    return np.exp(np.interp(dates.astype(np.int64), anchors, np.log(cpi_table.values[valid]), left=np.nan))
+
+
+def _build(dates, close, dividends, cpi_table, divs_table):
+    """
+    Computes the four series of a total-return index
+    Parameters
+    ----------
+    dates: np.ndarray
+        The sorted datetime64[D] date of each row
+    close: np.ndarray
+        The close price of each row
+    dividends: bool
+        Whether the dividends are reinvested
+    cpi_table: YearTable
+        The annual average CPI
+    divs_table: YearTable
+        The year end dividend yield (%)
+
+    Returns
+    -------
+    series: dict
+        The Close, Total Return, Real Price and Real Total Return of each row
+    """
+    close = np.asarray(close, dtype=float)
+    total_return = close.copy()
+    if dividends and len(close):
+        years = dates.astype("datetime64[Y]").astype(int) + 1970
+        _, year_index, trading_days = np.unique(years, return_inverse=True, return_counts=True)
+        daily_dividend = (1 + _year_values(divs_table, years - 1) / 100) ** (1 / trading_days[year_index])
+        growth = np.ones(len(close))
+        growth[1:] = close[1:] / close[:-1] * daily_dividend[1:]
+        total_return = close[0] * np.cumprod(growth)
+
+    deflator = cpi_table.values[~np.isnan(cpi_table.values)][-1] / _daily_cpi(dates, cpi_table)
+    return {"Close": close,
+            "Total Return": total_return,
+            "Real Price": close * deflator,
+            "Real Total Return": total_return * deflator}
+
+
+class TotalReturnIndex:
+    """
+    Daily nominal and real price and total return indexes, with an O(1) lookup of the row of any date.
+
+    Parameters
+    ----------
+    dates: array-like
+        The sorted date of each row
+    series: dict
+        The Close, Total Return, Real Price and Real Total Return of each row
+    """
+
+    def __init__(self, dates, series):
+        self.dates = np.asarray(dates).astype("datetime64[D]")
+        self.close = np.asarray(series["Close"], dtype=float)
+        self.total_return = np.asarray(series["Total Return"], dtype=float)
+        self.real_price = np.asarray(series["Real Price"], dtype=float)
+        self.real_total_return = np.asarray(series["Real Total Return"], dtype=float)
+        self.years = self.dates.astype("datetime64[Y]").astype(int) + 1970
+
+        days = self.dates.astype(np.int64)
+        self.first_day = int(days[0]) if len(days) else 0
+        #the row of the last trading day on or before every calendar day of the index
+        self.day_rows = np.searchsorted(days, np.arange(self.first_day, days[-1] + 1 if len(days) else 0), side="right") - 1
+
+    @classmethod
+    def from_frame(cls, df, dividends=None, cpi_table=None, divs_table=None):
+        """
+        Builds the index of a price frame with Close and Date (column or index), with
+        the CPI table of data.py unless given. A frame does not tell its asset, so the
+        dividends are only reinvested when divs_table is given or dividends is True, the
+        latter with the SP500 yields of data.py
+        """
+        if dividends is None:
+            dividends = divs_table is not None
+        dates = df["Date"] if "Date" in df.columns else df.index
+        dates = np.asarray(dates) if np.asarray(dates).dtype.kind == "M" else pd.to_datetime(dates).values
+        dates = dates.astype("datetime64[D]")
+        close = np.asarray(df["Close"].values, dtype=float)
+        if len(dates) > 1 and not (dates[1:] >= dates[:-1]).all():
+            order = np.argsort(dates, kind="stable")
+            dates, close = dates[order], close[order]
+        return cls(dates, _build(dates, close, dividends, data.cpi_table if cpi_table is None else cpi_table,
+                                 data.divs_table if divs_table is None else divs_table))
+
+    def __len__(self):
+        return len(self.close)
+
+    def __repr__(self):
+        return f"TotalReturnIndex({len(self)} rows, {self.dates[0] if len(self) else ''} - {self.dates[-1] if len(self) else ''})"
+
+    def rows(self, dates):
+        """
+        Returns the row of the last trading day on or before each date
+        """
+        days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64) - self.first_day
+        if np.any((days < 0) | (days >= len(self.day_rows))):
+            raise KeyError(dates)
+        return self.day_rows[days]
+
+    def series(self, real=True, dividends=True):
+        """
+        Returns the series of a kind of return: real or nominal, with or without the dividends
+        """
+        if real:
+            return self.real_total_return if dividends else self.real_price
+        return self.total_return if dividends else self.close
+
+    def holding_return(self, start, end, real=True, dividends=True):
+        """
+        Computes the return of holding between two dates (or arrays of dates)
+        Parameters
+        ----------
+        start: date-like or array-like
+            The buying dates, the last close on or before each is used
+        end: date-like or array-like
+            The selling dates
+        real: bool
+            Whether the return is adjusted for inflation
+        dividends: bool
+            Whether the dividends are reinvested
+
+        Returns
+        -------
+        returns: float or np.ndarray
+            The return (%) of each holding period
+        """
+        values = self.series(real, dividends)
+        return (values[self.rows(end)] / values[self.rows(start)] - 1) * 100
+
+    def frame(self):
+        """
+        Returns the index as a DataFrame with Date, Year and the four series
+        """
+        return pd.DataFrame({"Date": self.dates.astype("datetime64[s]"),
+                             "Year": self.years.astype(np.int16),
+                             "Close": self.close,
+                             "Total Return": self.total_return,
+                             "Real Price": self.real_price,
+                             "Real Total Return": self.real_total_return})
+
+    def content_hash(self):
+        """
+        Returns a hash of the index
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        for values in (self.dates, self.close, self.total_return, self.real_total_return):
+            digest.update(np.ascontiguousarray(values).view(np.uint8))
+        return digest.hexdigest()
+
+
+def _sources(stem, dividends):
+    files = [data_path / (stem + ".csv"), data_path / "CPI_adjusted.csv"]
+    if dividends:
+        files.append(data_path / "Dividend_yield.csv")
+    return files
+
+
+def _is_fresh(array_file, meta_file, sources, dividends):
+    """
+    Checks whether a persisted index still matches its sources, like loader._is_fresh for several files
+    """
+    if not array_file.exists() or not meta_file.exists():
+        return False
+
+    meta = json.loads(meta_file.read_text())
+    if meta.get("version") != _format_version or meta.get("dividends") != dividends:
+        return False
+    if [source.name for source in sources] != list(meta["sources"]):
+        return False
+    for source in sources:
+        recorded = meta["sources"][source.name]
+        stamp = source_stamp(source)
+        if stamp["mtime_ns"] == recorded["mtime_ns"] and stamp["size"] == recorded["size"]:
+            continue
+        if file_hash(source) != recorded["sha256"]:
+            return False
+    return True
+
+
+def load_total_return(name="SP500_whole", dividends=None):
+    """
+    Loads the daily total-return index of a price file, building and persisting it on
+    the first call and after every change of its sources
+    Parameters
+    ----------
+    name: str
+        The price file, "SP500_whole" or "Gold_prices"
+    dividends: bool
+        Whether the dividends are reinvested, by default those of dividend_files
+
+    Returns
+    -------
+    index: TotalReturnIndex
+        The index of the file
+    """
+    stem = name[:-4] if name.endswith(".csv") else name
+    if dividends is None:
+        dividends = dividend_files.get(stem, False)
+    suffix = "total_return" if dividends else "real_price"
+    array_file = cache_path / f"{stem}.{suffix}.npy"
+    meta_file = cache_path / f"{stem}.{suffix}.json"
+    sources = _sources(stem, dividends)
+
+    if not _is_fresh(array_file, meta_file, sources, dividends):
+        #the tables are read from their files, data.py may hold the ones before an ingestion
+        prices = load_preprocessed(stem, as_frame=False)
+        series = _build(np.asarray(prices["Date"]), np.asarray(prices["Close"]), dividends,
+                        data.YearTable.from_csv(data_path / "CPI_adjusted.csv", "CPI"),
+                        data.YearTable.from_csv(data_path / "Dividend_yield.csv", "Yield"))
+        table = np.empty(len(prices), dtype=[("Date", "datetime64[D]")] + [(column, np.float64) for column in series])
+        table["Date"] = prices["Date"]
+        for column, values in series.items():
+            table[column] = values
+
+        #written under temporary names so that concurrent readers never see a partial file
+        cache_path.mkdir(exist_ok=True)
+        temporary_file = array_file.with_name(array_file.name + f".{os.getpid()}.tmp")
+        with open(temporary_file, "wb") as file:
+            np.save(file, table)
+        os.replace(temporary_file, array_file)
+        meta = {"version": _format_version, "dividends": dividends,
+                "sources": {source.name: dict(source_stamp(source), sha256=file_hash(source)) for source in sources}}
+        temporary_file = meta_file.with_name(meta_file.name + f".{os.getpid()}.tmp")
+        temporary_file.write_text(json.dumps(meta))
+        os.replace(temporary_file, meta_file)
+
+    table = np.load(array_file, mmap_mode="r")
+    return TotalReturnIndex(table["Date"], {column: table[column] for column in table.dtype.names[1:]})
+
+
+if __name__ == "__main__":
+    for stem in dividend_files:
+        print(load_total_return(stem))
@@ -1,9 +1,10 @@
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
 from data import *
-import mplfinance as mpf
-import matplotlib.pyplot as plt
+from annual_calculations import price_monthly_means
+from instrumentation import stage
+from result_cache import cached
+from price_index import as_frame
 
 def display_EMA(df, start = 100,end = 200):
     """
@@ -16,7 +17,10 @@ def display_EMA(df, start = 100,end = 200):
     end: int
         The end (row) of the display period 
     """
-        
+    #plotting libraries are only needed here, importing them at module load dominates startup
+    import mplfinance as mpf
+    import matplotlib.pyplot as plt
+
     df = df.copy()
     df["Date"] = pd.to_datetime(df["Date"])
     df = df.set_index("Date")
@@ -34,12 +38,63 @@ def display_EMA(df, start = 100,end = 200):
     plt.rcdefaults()
 
 
+def control_group_frame(monthly_means, first_year, units, expense_rate, price_scale, gold):
+    """
+    Builds the control group table from the monthly mean prices: buying at the January
+    mean and selling at the December mean of every year
+    Parameters
+    ----------
+    monthly_means: np.ndarray
+        The (years, 12) matrix of mean close prices starting with first_year
+    first_year: int
+        The first year of the matrix
+    units: int
+        The number of ETFs / ounces purchased.
+    expense_rate: float
+        The expense rate of SPY ETF, ignored for gold.
+    price_scale: float
+        The divisor converting the close price to the trading price
+    gold: bool
+        Whether to use the layout of simulate_control_group_gold
+
+    Returns
+    -------
+    results: pd.DataFrame
+        The result of the control group simulations
+    """
+    buy_price = monthly_means[:, 0] / price_scale if price_scale != 1 else monthly_means[:, 0]
+    sell_price = monthly_means[:, 11] / price_scale if price_scale != 1 else monthly_means[:, 11]
+    portfolio_value_start = buy_price * units
+    portfolio_value_end = sell_price * units
+    periods = np.arange(first_year, first_year + len(monthly_means))
+
+    if gold:
+        capital_earned = portfolio_value_end - portfolio_value_start
+        nominal_return = capital_earned / portfolio_value_start * 100
+        return pd.DataFrame({"Period": periods,
+                             "Capital Invested": portfolio_value_start,
+                             "Final Capital": portfolio_value_end,
+                             "Capital Gained": capital_earned,
+                             "(%)Annual_Return": nominal_return}).set_index("Period")
+
+    expenses = portfolio_value_start * expense_rate * 335/365
+    capital_earned = portfolio_value_end - portfolio_value_start - expenses
+    nominal_return = capital_earned / portfolio_value_start * 100
+    return pd.DataFrame({"Period": periods,
+                         "Capital Invested": portfolio_value_start,
+                         "Final Capital": portfolio_value_end - expenses,
+                         "Expenses": expenses,
+                         "Capital Gained": capital_earned,
+                         "(%)Annual_Return_Without_Dividends": nominal_return}).set_index("Period")
+
+
+@cached
 def simulate_control_group(df, etf_purchased = 20, expense_rate=0.00095):
     """
     Simulates the nominal and real returns of a control group.
     Parameters
     ----------
-    df : pandas.DataFrame
+    df : pandas.DataFrame or PriceSeries
         The DataFrame containing the data.
     etf_purchased : int
         The number of ETFs purchased.
@@ -51,35 +106,426 @@ def simulate_control_group(df, etf_purchased = 20, expense_rate=0.00095):
     results: pd.DataFrame
         The result of the control group simulations
     """
-    
-    #20 years investment periods
-    investment_periods = range(1950, 2023)
-    data = []
-
-    for year in investment_periods:
-        buy_price = df[(df.Year == year) & (df["Month"] == 1)].Close.mean() / 10
-        sell_price = df[(df.Year == year) & (df["Month"] == 12)].Close.mean() / 10
-        portfolio_value_start = buy_price * etf_purchased
-        portfolio_value_end = sell_price * etf_purchased
-        expenses = portfolio_value_start * expense_rate * 335/365
-        capital_earned = portfolio_value_end - portfolio_value_start - expenses
-        nominal_return = capital_earned / portfolio_value_start * 100
-        data.append((year, portfolio_value_start, portfolio_value_end - expenses,expenses, capital_earned, nominal_return))
+    first_year, last_year = 1950, 2022
+    with stage("simulate_control_group", rows=len(df)):
+        with stage("monthly means", rows=len(df)):
+            monthly_means = price_monthly_means(df, first_year, last_year)
+        with stage("assembly", rows=len(monthly_means)):
+            return control_group_frame(monthly_means, first_year, etf_purchased, expense_rate, 10, gold=False)
 
-    results = pd.DataFrame(data = data,
-                           columns = ["Period","Capital Invested","Final Capital","Expenses","Capital Gained", "(%)Annual_Return_Without_Dividends"]
-                           ).set_index("Period")
-    
-    return results
-        
 
+def _ema(close, span):
+    """
+    Computes the exponential moving average of the close prices
+    Parameters
+    ----------
+    close: array-like
+        The close prices
+    span: int
+        Span of the EMA.
+
+    Returns
+    -------
+    ema: np.ndarray
+        The EMA of each row
+    """
+    return pd.Series(np.asarray(close, dtype=float)).ewm(span=span, adjust=False).mean().values
+
+
+def crossover_signals(fast, slow):
+    """
+    Computes the Buy and Sell signals of an EMA crossover
+    Parameters
+    ----------
+    fast: np.ndarray
+        The fast EMA, a (rows, assets) matrix crosses every column separately
+    slow: np.ndarray
+        The slow EMA
 
-def simulate_trade_EMA(df, etf_purchased=20, expense_rate=0.00095, EMA1 = 12, EMA2 =26, verbose = False):
+    Returns
+    -------
+    buy: np.ndarray
+        True where the fast EMA crosses above the slow EMA
+    sell: np.ndarray
+        True where the fast EMA crosses below the slow EMA
+    """
+    buy = np.zeros(fast.shape, dtype=bool)
+    sell = np.zeros(fast.shape, dtype=bool)
+    buy[1:] = (fast[1:] > slow[1:]) & (fast[:-1] <= slow[:-1])
+    sell[1:] = (fast[1:] < slow[1:]) & (fast[:-1] >= slow[:-1])
+    return buy, sell
+
+
+def backtest_crossover(dates, groups, price, buy, sell, n_groups, units, expense_rate):
+    """
+    Backtests the crossover signals independently within each group (year) of rows.
+
+    Every group starts flat, the first Buy opens a position, the first Sell after it
+    closes the position and a position still open at the last row of the group is
+    sold at that row. The first purchase of a group buys a fixed amount of units,
+    later purchases reinvest the cash in whole units. Only the trade ordinals are
+    looped over, the groups are updated together as arrays.
+
+    Parameters
+    ----------
+    dates: np.ndarray
+        datetime64 date of each row
+    groups: np.ndarray
+        The group of each row, rows with a negative group are left out
+    price: np.ndarray
+        The trading price of each row
+    buy: np.ndarray
+        The Buy signal of each row
+    sell: np.ndarray
+        The Sell signal of each row
+    n_groups: int
+        The number of groups
+    units: int or np.ndarray
+        The number of units bought by the first purchase of a group, or of each group
+    expense_rate: float or np.ndarray
+        The annual expense rate charged for the holding days, or the rate of each group
+
+    Returns
+    -------
+    summary: dict
+        The trade count, capital invested, final capital and expenses of each group
+    trades: dict
+        The group, buy/sell rows, holdings, expense and cash balances of each trade, and
+        whether a Sell signal (rather than the end of the group) closed it
+    """
+    units = np.broadcast_to(units, n_groups)
+    expense_rate = np.broadcast_to(expense_rate, n_groups)
+    rows = np.flatnonzero(groups >= 0)
+    rows = rows[np.argsort(groups[rows], kind="stable")]
+    row_groups = groups[rows]
+
+    #last row of every group for the forced liquidation
+    is_last = np.ones(len(rows), dtype=bool)
+    is_last[:-1] = row_groups[1:] != row_groups[:-1]
+    last_row = np.full(n_groups, -1)
+    last_row[row_groups[is_last]] = rows[is_last]
+
+    #effective signals: the first Buy while flat and the first Sell while holding
+    code = buy[rows].astype(np.int8) - sell[rows].astype(np.int8)
+    event = np.flatnonzero(code)
+    event_code = code[event]
+    event_group = row_groups[event]
+    new_group = np.ones(len(event), dtype=bool)
+    new_group[1:] = event_group[1:] != event_group[:-1]
+    previous_code = np.empty_like(event_code)
+    previous_code[0:1] = -1
+    previous_code[1:] = event_code[:-1]
+    previous_code[new_group] = -1
+    keep = event_code != previous_code
+    event = event[keep]
+    event_code = event_code[keep]
+    event_group = event_group[keep]
+
+    #a position is closed by the next effective signal of its group, otherwise at the last row
+    buy_event = np.flatnonzero(event_code == 1)
+    buy_rows = rows[event[buy_event]]
+    trade_group = event_group[buy_event]
+    next_event = np.minimum(buy_event + 1, len(event) - 1)
+    closed = (buy_event + 1 < len(event)) & (event_group[next_event] == trade_group)
+    sell_rows = np.where(closed, rows[event[next_event]], last_row[trade_group])
+
+    n_trades = len(buy_rows)
+    first_trade = np.ones(n_trades, dtype=bool)
+    first_trade[1:] = trade_group[1:] != trade_group[:-1]
+    trade_ordinal = np.arange(n_trades) - np.maximum.accumulate(np.where(first_trade, np.arange(n_trades), 0))
+
+    buy_price = price[buy_rows]
+    sell_price = price[sell_rows]
+    days_held = (dates[sell_rows] - dates[buy_rows]) // np.timedelta64(1, "D")
+
+    trade_counts = np.zeros(n_groups, dtype=int)
+    cash_balance = np.zeros(n_groups)
+    capital_invested = np.zeros(n_groups)
+    total_expenses = np.zeros(n_groups)
+    holdings = np.zeros(n_trades)
+    expenses = np.zeros(n_trades)
+    cash_after_buy = np.zeros(n_trades)
+    cash_after_sell = np.zeros(n_trades)
+
+    with stage("trade ordinals", rows=n_trades) as current:
+        for ordinal in range(trade_ordinal.max() + 1 if n_trades else 0):
+            trade = np.flatnonzero(trade_ordinal == ordinal)
+            current.add(filter_calls=1)
+            group = trade_group[trade]
+            cash = cash_balance[group]
+
+            #first purchase buys a fixed amount, remaining purchases reinvest the cash
+            first_purchase = cash == 0
+            holding = np.where(first_purchase, units[group], cash // buy_price[trade])
+            capital_invested[group] = np.where(first_purchase, units[group] * buy_price[trade], capital_invested[group])
+            cash = np.where(first_purchase, cash, cash - holding * buy_price[trade])
+            cash_after_buy[trade] = cash
+
+            expense = holding * sell_price[trade] * expense_rate[group] * days_held[trade] / 365
+            cash = cash + holding * sell_price[trade]
+            cash = cash - expense
+
+            holdings[trade] = holding
+            expenses[trade] = expense
+            cash_after_sell[trade] = cash
+            cash_balance[group] = cash
+            total_expenses[group] += expense
+            trade_counts[group] += 1
+
+    summary = {"trade_counts": trade_counts,
+               "capital_invested": capital_invested,
+               "final_capital": cash_balance,
+               "expenses": total_expenses}
+    trades = {"group": trade_group,
+              "buy_row": buy_rows,
+              "sell_row": sell_rows,
+              "holdings": holdings,
+              "days_held": days_held,
+              "expenses": expenses,
+              "cash_after_buy": cash_after_buy,
+              "cash_after_sell": cash_after_sell,
+              "signal_exit": closed}
+    return summary, trades
+
+
+def _as_dates(values):
+    """
+    Returns the datetime64 values of a date column or index, without copying the ones already parsed
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        return values
+    return pd.to_datetime(values).values
+
+
+def _year_groups(dates, first_year, last_year):
+    """
+    Maps each date to its year offset from first_year, -1 outside [first_year, last_year]
+    """
+    years = dates.astype("datetime64[Y]").astype(int) + 1970
+    return np.where((years >= first_year) & (years <= last_year), years - first_year, -1)
+
+
+def _simulate_crossover(dates, close, first_year, last_year, units, expense_rate, price_scale, EMA1, EMA2):
+    """
+    Runs the yearly EMA crossover backtest shared by the stock and gold simulations
+    Parameters
+    ----------
+    dates: np.ndarray
+        datetime64 date of each row
+    close: np.ndarray
+        The close price of each row
+    first_year: int
+        The first year traded
+    last_year: int
+        The last year traded (inclusive)
+    units: int
+        The number of units bought by the first purchase of a year
+    expense_rate: float
+        The annual expense rate
+    price_scale: float
+        The divisor converting the close price to the trading price
+    EMA1: int
+        Span of the fast EMA.
+    EMA2: int
+        Span of the slow EMA.
+
+    Returns
+    -------
+    summary: dict
+        The yearly results, see backtest_crossover
+    trades: dict
+        The individual trades, see backtest_crossover
+    price: np.ndarray
+        The trading price of each row
+    """
+    close = np.asarray(close, dtype=float)
+    price = close / price_scale if price_scale != 1 else close
+    with stage("indicators", rows=2 * len(close)):
+        fast, slow = _ema(close, EMA1), _ema(close, EMA2)
+    with stage("signals", rows=len(close)):
+        buy, sell = crossover_signals(fast, slow)
+    with stage("yearly loop", rows=len(close)):
+        groups = _year_groups(dates, first_year, last_year)
+        summary, trades = backtest_crossover(dates, groups, price, buy, sell, last_year - first_year + 1, units, expense_rate)
+    return summary, trades, price
+
+
+def _trade_ledger(trades, dates, price, first_year):
+    """
+    Builds the ledger of the individual trades of a simulation from the preallocated
+    trade arrays of backtest_crossover
+    Parameters
+    ----------
+    trades: dict
+        The individual trades, see backtest_crossover
+    dates: np.ndarray
+        datetime64 date of each row
+    price: np.ndarray
+        The trading price of each row
+    first_year: int
+        The year of group 0
+
+    Returns
+    -------
+    ledger: pd.DataFrame
+        One row per trade, in order, with typed columns: Year (int16), Trade (its ordinal
+        within the year, int16), Entry Date, Exit Date, Entry Price, Exit Price,
+        Quantity (int64), Holding Days (int32), Expense, Net Gain (sale - purchase -
+        expense), Cash After Entry and Cash After Exit
+    """
+    group = trades["group"]
+    first_trade = np.ones(len(group), dtype=bool)
+    first_trade[1:] = group[1:] != group[:-1]
+    trade_ordinal = np.arange(len(group)) - np.maximum.accumulate(np.where(first_trade, np.arange(len(group)), 0))
+
+    entry_price = price[trades["buy_row"]]
+    exit_price = price[trades["sell_row"]]
+    quantity = trades["holdings"]
+    return pd.DataFrame({"Year": (first_year + group).astype(np.int16),
+                         "Trade": trade_ordinal.astype(np.int16),
+                         "Entry Date": dates[trades["buy_row"]],
+                         "Exit Date": dates[trades["sell_row"]],
+                         "Entry Price": entry_price,
+                         "Exit Price": exit_price,
+                         "Quantity": quantity.astype(np.int64),
+                         "Holding Days": trades["days_held"].astype(np.int32),
+                         "Expense": trades["expenses"],
+                         "Net Gain": quantity * exit_price - quantity * entry_price - trades["expenses"],
+                         "Cash After Entry": trades["cash_after_buy"],
+                         "Cash After Exit": trades["cash_after_sell"]})
+
+
+def _print_trades(ledger, signal_exit, unit_name, first_unit_name, expenses=True):
+    """
+    Prints each trade of a simulation as the loop of the original simulators did
+    Parameters
+    ----------
+    ledger: pd.DataFrame
+        The trade ledger, see _trade_ledger
+    signal_exit: np.ndarray
+        Whether a Sell signal closed each trade, the others are the sales at the end of a year
+    unit_name: str
+        The name of the traded unit
+    first_unit_name: str
+        The name of the unit in the first purchase of a year
+    expenses: bool
+        Whether to print the expense of each sale
+    """
+    columns = ["Year", "Entry Date", "Exit Date", "Entry Price", "Exit Price", "Quantity", "Expense",
+               "Cash After Entry", "Cash After Exit"]
+    year, cash = None, 0
+    for (trade_year, entry_date, exit_date, entry_price, exit_price, quantity, expense, cash_after_entry,
+         cash_after_exit), closed in zip(zip(*(ledger[column].values for column in columns)), signal_exit):
+        if trade_year != year:
+            year, cash = trade_year, 0
+
+        #the first purchase of a year bought the fixed int amount, the others reinvested the cash
+        if cash == 0:
+            quantity = int(quantity)
+            print("Date:", pd.Timestamp(entry_date))
+            print("Bought", quantity, first_unit_name + " at a price of: ", entry_price)
+            print("Capital invested to this trade:", quantity * entry_price)
+            print("Cash in hand:", cash)
+            print()
+        else:
+            quantity = float(quantity)
+            print("Date:", pd.Timestamp(entry_date),
+                  "\nBought", quantity, unit_name, "at a price of:", entry_price,
+                  "\nCapital invested to this trade:", quantity * entry_price,
+                  "\nCash in hand:", cash_after_entry)
+            print()
+
+        lines = ["Date:", pd.Timestamp(exit_date),
+                 "\nSold", quantity, unit_name + " at a price of:", exit_price,
+                 "\nCapital gained from trade:", quantity * exit_price]
+        if expenses:
+            lines += ["\nExpense payment:", expense]
+        print(*lines, "\nNet cash:", cash_after_exit)
+        #the sale at the end of a year was not followed by a blank line
+        if closed:
+            print()
+        cash = cash_after_exit
+
+
+def trade_statistics(ledger):
+    """
+    Summarizes the trades of a ledger by year
+    Parameters
+    ----------
+    ledger: pd.DataFrame
+        The ledger returned by simulate_trade_EMA(..., ledger=True) or simulate_trade_EMA_gold
+
+    Returns
+    -------
+    statistics: pd.DataFrame
+        Per year: the number of trades, the win rate (% of trades with a positive net gain),
+        the mean, median and maximum holding days and the expense drag (expenses as a %
+        of the capital put into the trades)
+    """
+    capital = ledger["Quantity"].values * ledger["Entry Price"].values
+    frame = pd.DataFrame({"Year": ledger["Year"].values,
+                          "Win": ledger["Net Gain"].values > 0,
+                          "Holding Days": ledger["Holding Days"].values,
+                          "Expense": ledger["Expense"].values,
+                          "Capital": capital})
+    grouped = frame.groupby("Year")
+    statistics = pd.DataFrame({"Trades": grouped.size(),
+                               "Win Rate (%)": grouped["Win"].mean() * 100,
+                               "Mean Holding Days": grouped["Holding Days"].mean(),
+                               "Median Holding Days": grouped["Holding Days"].median(),
+                               "Max Holding Days": grouped["Holding Days"].max(),
+                               "Expense Drag (%)": grouped["Expense"].sum() / grouped["Capital"].sum() * 100})
+    return statistics
+
+
+def trade_results_frame(periods, trade_counts, capital_invested, final_capital, expenses, gold):
+    """
+    Builds the yearly table of the EMA Crossover Trading simulations
+    Parameters
+    ----------
+    periods: np.ndarray
+        The traded years
+    trade_counts: np.ndarray
+        The number of trades of each year
+    capital_invested: np.ndarray
+        The capital of the first purchase of each year
+    final_capital: np.ndarray
+        The cash at the end of each year
+    expenses: np.ndarray
+        The expenses paid in each year
+    gold: bool
+        Whether to use the layout of simulate_trade_EMA_gold
+
+    Returns
+    -------
+    results: pd.DataFrame
+        The results of the simulation
+    """
+    capital_earned = final_capital - capital_invested
+    nominal_return = capital_earned / capital_invested * 100
+
+    results = pd.DataFrame({"Period": periods,
+                            "Trade Counts": trade_counts,
+                            "Capital Invested": capital_invested,
+                            "Final Capital": final_capital})
+    if gold:
+        results["Capital Gained"] = capital_earned
+        results["(%)Annual_Return"] = nominal_return
+    else:
+        results["Expenses"] = expenses
+        results["Capital Gained"] = capital_earned
+        results["(%)Annual_Return_Without_Dividends"] = nominal_return
+    return results.set_index("Period")
+
+
+@cached(side_effects=("verbose",))
+def simulate_trade_EMA(df, etf_purchased=20, expense_rate=0.00095, EMA1 = 12, EMA2 =26, verbose = False, ledger = False):
     """
     Computes EMA Crossover Trading over price data
     Parameters
     ----------
-    df : pandas.DataFrame
+    df : pandas.DataFrame or PriceSeries
         The DataFrame containing the data.
     etf_purchased : int
         The number of ETFs purchased.
@@ -91,268 +537,252 @@ def simulate_trade_EMA(df, etf_purchased=20, expense_rate=0.00095, EMA1 = 12, EM
         Span of the slow EMA.
     verbose: bool
         To show a summary of the trading process.
+    ledger: bool
+        Whether to also return the ledger of the individual trades (see trade_statistics).
     
     Returns
     -------
     results: pd.DataFrame
         The results of the simulation
+    trades: pd.DataFrame
+        With ledger=True, one row per trade with its entry and exit dates and prices,
+        quantity, holding days, expense and cash after entry and exit
 
     """
-
-    #dataframe operations
-    df = df.copy().reset_index()
-    df["Date"] = pd.to_datetime(df["Date"])
-    df["Year"] = df["Date"].dt.year
-    df["ETF Price"] = df.Close / 10  
-    df[f"EMA{str(EMA1)}"] = df['Close'].ewm(span=EMA1, adjust=False).mean()
-    df[f"EMA{str(EMA2)}"] = df['Close'].ewm(span=EMA2, adjust=False).mean()
-
-    #buy-sell signals
-    df["Buy"] = (df[f"EMA{str(EMA1)}"] > df[f"EMA{str(EMA2)}"]) & (df[f"EMA{str(EMA1)}"].shift() <= df[f"EMA{str(EMA2)}"].shift())
-    df["Sell"] = (df[f"EMA{str(EMA1)}"] < df[f"EMA{str(EMA2)}"]) & (df[f"EMA{str(EMA1)}"].shift() >= df[f"EMA{str(EMA2)}"].shift())
-
-   
-    trade_periods = range(1950,2023)
-    data = []
-    for year in trade_periods:
-        total_expenses = 0
-        trade_counts = 0 #to count the number of trades
-        cash_balance = 0 
-        etfs_holding = 0
-        capital_invested = 0
-        position_condition = False
-        buy_date = None
-        df_trade = df[df.Year == year] #between works inclusively 
-        for index, row in df_trade.iterrows():
-            if not position_condition and row["Buy"]:
-                #first purchase
-                if cash_balance == 0:  
-                    etfs_holding = etf_purchased
-                    capital_invested = etf_purchased * row["ETF Price"]
-                    if verbose:
-                        print("Date:", row['Date'])
-                        print("Bought", etfs_holding, "ETFs at a price of: ",row["ETF Price"] )
-                        print("Capital invested to this trade:", etfs_holding * row["ETF Price"])
-                        print("Cash in hand:", cash_balance)
-                        print()
-
-                #remaining purchases
-                else:
-                    etfs_holding = cash_balance // row["ETF Price"]
-                    cash_balance = cash_balance - etfs_holding * row["ETF Price"]
-                    if verbose:
-                        print("Date:", row["Date"],
-                            "\nBought", etfs_holding,"ETF's", "at a price of:", row["ETF Price"], 
-                            "\nCapital invested to this trade:", etfs_holding * row["ETF Price"],
-                            "\nCash in hand:", cash_balance)
-                        print()
-
-                position_condition = True
-                buy_date = row['Date']
-            
-            #sell condition
-            elif position_condition and row["Sell"]:
-                trade_counts += 1
-                cash_balance += etfs_holding * row["ETF Price"]
-                days_held = (row['Date'] - buy_date).days
-                cash_balance -= etfs_holding * row["ETF Price"] * expense_rate * days_held / 365
-                total_expenses += etfs_holding * row["ETF Price"] * expense_rate * days_held / 365
-                position_condition = False
-                if verbose:
-
-                    print("Date:", row['Date'],
-                        "\nSold",etfs_holding, "ETF's at a price of:",row["ETF Price"],
-                        "\nCapital gained from trade:", etfs_holding * row["ETF Price"],
-                        "\nExpense payment:", etfs_holding * row["ETF Price"] * expense_rate * days_held / 365,
-                        "\nNet cash:", cash_balance)
-                    print()
-
-                etfs_holding = 0
-        
-        #the last open condition
-        if position_condition:
-            sell_date = df_trade.iloc[-1]['Date']
-            cash_balance += etfs_holding * df_trade.iloc[-1]["ETF Price"]
-            days_held = (sell_date - buy_date).days
-            cash_balance -= etfs_holding * df_trade.iloc[-1]["ETF Price"] * expense_rate * days_held / 365
-            trade_counts += 1
-            total_expenses +=  etfs_holding * df_trade.iloc[-1]["ETF Price"] * expense_rate * days_held / 365
-            if verbose:
-                print("Date:", row['Date'],
-                    "\nSold",etfs_holding, "ETF's at a price of:",df_trade.iloc[-1]["ETF Price"],
-                "\nCapital gained from trade:", etfs_holding * df_trade.iloc[-1]["ETF Price"],
-                "\nExpense payment:", etfs_holding * df_trade.iloc[-1]["ETF Price"] * expense_rate * days_held / 365,
-                "\nNet cash:", cash_balance)
-            etfs_holding = 0
-
-        
-        if capital_invested == 0:
-            continue
-
-
-        capital_earned = cash_balance - capital_invested
-        nominal_return = capital_earned / capital_invested * 100
-        data.append((year,trade_counts,capital_invested,cash_balance,total_expenses,capital_earned,nominal_return))
-    
-        
-        
-    
-    results = pd.DataFrame(data  = data,
-                           columns = ["Period","Trade Counts","Capital Invested","Final Capital","Expenses","Capital Gained","(%)Annual_Return_Without_Dividends"
-                                        ]).set_index("Period")
-    
-    return results
-
-
-def simulate_trade_EMA_gold(df, ounce_purhcased=20, EMA1 = 12, EMA2 =26, verbose = False):
+    df = as_frame(df)
+    first_year, last_year = 1950, 2022
+    with stage("simulate_trade_EMA", rows=len(df)):
+        with stage("load", rows=len(df)):
+            dates = _as_dates(df["Date"] if "Date" in df.columns else df.index)
+            close = df["Close"].values
+        summary, trades, price = _simulate_crossover(dates, close, first_year, last_year,
+                                                     etf_purchased, expense_rate, 10, EMA1, EMA2)
+        if verbose or ledger:
+            with stage("ledger", rows=len(trades["buy_row"])):
+                trade_ledger = _trade_ledger(trades, dates, price, first_year)
+        if verbose:
+            with stage("verbose output", rows=len(trade_ledger)):
+                _print_trades(trade_ledger, trades["signal_exit"], "ETF's", "ETFs")
+
+        with stage("assembly", rows=len(summary["capital_invested"])):
+            traded = summary["capital_invested"] != 0
+            results = trade_results_frame(np.arange(first_year, last_year + 1)[traded], summary["trade_counts"][traded],
+                                           summary["capital_invested"][traded], summary["final_capital"][traded],
+                                           summary["expenses"][traded], gold=False)
+            return (results, trade_ledger) if ledger else results
+
+
+@cached(side_effects=("verbose",))
+def simulate_trade_EMA_gold(df, ounce_purhcased=20, EMA1 = 12, EMA2 =26, verbose = False, ledger = False):
     """
     Computes EMA Crossover Trading over price data
     Parameters
     ----------
-    df : pandas.DataFrame
-        The DataFrame containing the data.
-    etf_purchased : int
-        The number of ETFs purchased.
-    expense_rate: float
-        The expense rate of SPY ETF.
+    df : pandas.DataFrame or PriceSeries
+        The DataFrame containing the data, indexed by date.
+    ounce_purhcased : int
+        The ounces of gold purchased.
     EMA1: int
         Span of the fast EMA.
     EMA2: int
         Span of the slow EMA.
     verbose: bool
         To show a summary of the trading process.
+    ledger: bool
+        Whether to also return the ledger of the individual trades (see trade_statistics).
     
     Returns
     -------
     results: pd.DataFrame
         The results of the simulation
+    trades: pd.DataFrame
+        With ledger=True, one row per trade with its entry and exit dates and prices,
+        quantity, holding days, expense and cash after entry and exit
 
     """
+    df = as_frame(df)
+    #gold has no expense ratio and is traded at its own price
+    first_year, last_year = 1970, 2022
+    with stage("simulate_trade_EMA_gold", rows=len(df)):
+        with stage("load", rows=len(df)):
+            dates = _as_dates(df.index)
+            close = df["Close"].values
+        summary, trades, price = _simulate_crossover(dates, close, first_year, last_year,
+                                                     ounce_purhcased, 0, 1, EMA1, EMA2)
+        if verbose or ledger:
+            with stage("ledger", rows=len(trades["buy_row"])):
+                trade_ledger = _trade_ledger(trades, dates, price, first_year)
+        if verbose:
+            with stage("verbose output", rows=len(trade_ledger)):
+                _print_trades(trade_ledger, trades["signal_exit"], "ounces of gold", "ounces of gold", expenses=False)
+
+        with stage("assembly", rows=len(summary["capital_invested"])):
+            traded = summary["capital_invested"] != 0
+            results = trade_results_frame(np.arange(first_year, last_year + 1)[traded], summary["trade_counts"][traded],
+                                           summary["capital_invested"][traded], summary["final_capital"][traded],
+                                           summary["expenses"][traded], gold=True)
+            return (results, trade_ledger) if ledger else results
+
+
+_sweep_state = {}
+
+
+def _sweep_inputs(arrays, settings):
+    """
+    Combines the sweep arrays (dates, year groups, trading prices, EMA matrix) with the trade settings
+    """
+    state = dict(settings)
+    state.update(dates=arrays["dates"], groups=arrays["groups"], price=arrays["price"],
+                 ema={span: arrays["ema"][i] for i, span in enumerate(settings["spans"])})
+    return state
 
-    #dataframe operations
-    df = df.copy()
-    df["Year"] = pd.to_datetime(df.index).year
-    df[f"EMA{str(EMA1)}"] = df['Close'].ewm(span=EMA1, adjust=False).mean()
-    df[f"EMA{str(EMA2)}"] = df['Close'].ewm(span=EMA2, adjust=False).mean()
-
-    #buy-sell signals
-    df["Buy"] = (df[f"EMA{str(EMA1)}"] > df[f"EMA{str(EMA2)}"]) & (df[f"EMA{str(EMA1)}"].shift() <= df[f"EMA{str(EMA2)}"].shift())
-    df["Sell"] = (df[f"EMA{str(EMA1)}"] < df[f"EMA{str(EMA2)}"]) & (df[f"EMA{str(EMA1)}"].shift() >= df[f"EMA{str(EMA2)}"].shift())
-
-   
-    trade_periods = range(1970,2023)
-    data = []
-    for year in trade_periods:
-        trade_counts = 0 #to count the number of trades
-        cash_balance = 0 
-        etfs_holding = 0
-        capital_invested = 0
-        position_condition = False
-        df_trade = df[df.Year == year] 
-        for index, row in df_trade.iterrows():
-            if not position_condition and row["Buy"]:
-                #first purchase
-                if cash_balance == 0:  
-                    etfs_holding = ounce_purhcased
-                    capital_invested = ounce_purhcased * row["Close"]
-                    if verbose:
-                        print("Date:", row['Date'])
-                        print("Bought", ounce_purhcased, "ounces of gold at a price of: ",row["Close"] )
-                        print("Capital invested to this trade:", etfs_holding * row["Close"])
-                        print("Cash in hand:", cash_balance)
-                        print()
-
-                #remaining purchases
-                else:
-                    etfs_holding = cash_balance // row["Close"]
-                    cash_balance = cash_balance - etfs_holding * row["Close"]
-                    if verbose:
-                        print("Date:", row["Date"],
-                            "\nBought", etfs_holding,"ounces of gold", "at a price of:", row["Close"], 
-                            "\nCapital invested to this trade:", etfs_holding * row["Close"],
-                            "\nCash in hand:", cash_balance)
-                        print()
-
-                position_condition = True
-            
-            #sell condition
-            elif position_condition and row["Sell"]:
-                trade_counts += 1
-                cash_balance += etfs_holding * row["Close"]
-                position_condition = False
-                if verbose:
-
-                    print("Date:", row['Date'],
-                        "\nSold",etfs_holding, "ounces of gold at a price of:",row["Close"],
-                        "\nCapital gained from trade:", etfs_holding * row["Close"],
-                        "\nNet cash:", cash_balance)
-                    print()
-
-                etfs_holding = 0
-        
-        #the last open condition
-        if position_condition:
-            cash_balance += etfs_holding * df_trade.iloc[-1]["Close"]
-            trade_counts += 1
-            if verbose:
-                print("Date:", row['Date'],
-                    "\nSold",etfs_holding, "ounces of gold at a price of:",df_trade.iloc[-1]["Close"],
-                "\nCapital gained from trade:", etfs_holding * df_trade.iloc[-1]["Close"],
-                "\nNet cash:", cash_balance)
-            etfs_holding = 0
-
-        
-        if capital_invested == 0:
-            continue
-
-
-        capital_earned = cash_balance - capital_invested
-        nominal_return = capital_earned / capital_invested * 100
-        data.append((year,trade_counts,capital_invested,cash_balance,capital_earned,nominal_return))
-    
-        
-        
-    
-    results = pd.DataFrame(data  = data,
-                           columns = ["Period","Trade Counts","Capital Invested","Final Capital","Capital Gained","(%)Annual_Return"
-                                        ]).set_index("Period")
-    
+
+def _init_sweep_worker(handle, settings):
+    """
+    Attaches the shared sweep arrays once per worker process
+    """
+    from shared_store import attach
+
+    _sweep_state.update(_sweep_inputs(attach(handle), settings))
+
+
+def _sweep_batch(state, pairs):
+    """
+    Backtests a batch of (EMA1, EMA2) pairs against the cached EMAs
+    Parameters
+    ----------
+    state: dict
+        The dates, year groups, trading prices, EMA cache and trade settings
+    pairs: list
+        The (EMA1, EMA2) pairs of the batch
+
+    Returns
+    -------
+    results: list
+        The yearly summary of each pair
+    """
+    results = []
+    for EMA1, EMA2 in pairs:
+        buy, sell = crossover_signals(state["ema"][EMA1], state["ema"][EMA2])
+        summary, _ = backtest_crossover(state["dates"], state["groups"], state["price"], buy, sell,
+                                         state["n_groups"], state["units"], state["expense_rate"])
+        results.append(summary)
     return results
 
 
+def _sweep_worker(pairs):
+    return _sweep_batch(_sweep_state, pairs)
+
+
+@cached(execution=("batch_size", "max_workers"))
+def sweep_trade_EMA(df, fast_spans = range(2, 201), slow_spans = range(2, 201), gold = False, units = 20,
+                    expense_rate = 0.00095, batch_size = 250, max_workers = None):
+    """
+    Runs the EMA Crossover Trading simulation for every (EMA1, EMA2) pair with EMA1 < EMA2.
+
+    Each distinct span is computed once and shared by all the pairs using it, and the
+    pairs are evaluated in batches spread across a process pool. The workers attach the
+    dates, prices and EMAs published in shared memory instead of receiving copies.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame or PriceSeries
+        The DataFrame containing the data. Gold prices are expected to be indexed by date
+        as in simulate_trade_EMA_gold.
+    fast_spans: iterable
+        The spans tried for the fast EMA.
+    slow_spans: iterable
+        The spans tried for the slow EMA.
+    gold: bool
+        Whether to simulate gold (1970-2022, no expenses, unscaled prices) instead of SPY (1950-2022).
+    units: int
+        The number of ETFs / ounces bought by the first purchase of a year.
+    expense_rate: float
+        The expense rate of SPY ETF, ignored for gold.
+    batch_size: int
+        The number of pairs evaluated by a worker at once.
+    max_workers: int
+        The number of worker processes, 1 runs the sweep in the current process.
+
+    Returns
+    -------
+    results: pd.DataFrame
+        One row per pair and traded year with the columns of simulate_trade_EMA
+        (simulate_trade_EMA_gold for gold) plus EMA1 and EMA2
+    """
+    df = as_frame(df)
+    pairs = [(fast, slow) for fast in fast_spans for slow in slow_spans if fast < slow]
+    if gold:
+        first_year, last_year, price_scale, expense_rate = 1970, 2022, 1, 0
+    else:
+        first_year, last_year, price_scale = 1950, 2022, 10
+
+    with stage("sweep_trade_EMA", rows=len(df)):
+        with stage("load", rows=len(df)):
+            dates = _as_dates(df.index if gold or "Date" not in df.columns else df["Date"])
+            close = np.asarray(df["Close"].values, dtype=float)
+
+        spans = sorted({span for pair in pairs for span in pair})
+        with stage("indicators", rows=len(spans) * len(close)):
+            arrays = {"dates": dates,
+                      "groups": _year_groups(dates, first_year, last_year),
+                      "price": close / price_scale if price_scale != 1 else close,
+                      "ema": np.array([_ema(close, span) for span in spans]).reshape(len(spans), len(close))}
+            settings = {"spans": spans,
+                        "n_groups": last_year - first_year + 1,
+                        "units": units,
+                        "expense_rate": expense_rate}
+
+        #signals and yearly loops run in the workers, they are recorded as one stage
+        batches = [pairs[i:i + batch_size] for i in range(0, len(pairs), batch_size)]
+        with stage("yearly loop", rows=len(pairs) * len(close)):
+            if max_workers == 1:
+                state = _sweep_inputs(arrays, settings)
+                summaries = [summary for batch in batches for summary in _sweep_batch(state, batch)]
+            else:
+                from concurrent.futures import ProcessPoolExecutor
+                from shared_store import SharedArrays
+
+                #the workers attach the arrays in shared memory instead of receiving a pickled copy each
+                with SharedArrays(arrays) as store, ProcessPoolExecutor(max_workers=max_workers, initializer=_init_sweep_worker,
+                                                                         initargs=(store.handle, settings)) as executor:
+                    summaries = [summary for batch_results in executor.map(_sweep_worker, batches) for summary in batch_results]
+
+        n_groups = settings["n_groups"]
+        with stage("assembly", rows=len(summaries) * n_groups):
+            stacked = {key: np.array([summary[key] for summary in summaries]).reshape(len(summaries), n_groups)
+                       for key in ("trade_counts", "capital_invested", "final_capital", "expenses")}
+            trade_counts, capital_invested = stacked["trade_counts"], stacked["capital_invested"]
+            final_capital, expenses = stacked["final_capital"], stacked["expenses"]
+
+            pair_index, group = np.nonzero(capital_invested != 0)
+            pairs = np.array(pairs, dtype=int).reshape(-1, 2)
+            results = trade_results_frame(first_year + group, trade_counts[pair_index, group], capital_invested[pair_index, group],
+                                           final_capital[pair_index, group], expenses[pair_index, group], gold).reset_index()
+            results.insert(0, "EMA2", pairs[pair_index, 1])
+            results.insert(0, "EMA1", pairs[pair_index, 0])
+            return results
+
+
+@cached
 def simulate_control_group_gold(df, ounce_purchased = 20):
     """
     Simulates the nominal and real returns of a control group.
     Parameters
     ----------
-    df : pandas.DataFrame
+    df : pandas.DataFrame or PriceSeries
         The DataFrame containing the data.
-    etf_purchased : int
-        The number of ETFs purchased.
-    expense_rate: float
-        The expense rate of SPY ETF.
+    ounce_purchased : int
+        The ounces of gold purchased.
     
     Returns
     -------
     results: pd.DataFrame
         The result of the control group simulations
     """
-    
-    #20 years investment periods
-    investment_periods = range(1970, 2023)
-    data = []
-
-    for year in investment_periods:
-        buy_price = df[(df.Year == year) & (df["Month"] == 1)].Close.mean() 
-        sell_price = df[(df.Year == year) & (df["Month"] == 12)].Close.mean() 
-        portfolio_value_start = buy_price * ounce_purchased
-        portfolio_value_end = sell_price * ounce_purchased
-        capital_earned = portfolio_value_end - portfolio_value_start
-        nominal_return = capital_earned / portfolio_value_start * 100
-        data.append((year, portfolio_value_start, portfolio_value_end, capital_earned, nominal_return))
-
-    results = pd.DataFrame(data = data,
-                           columns = ["Period","Capital Invested","Final Capital","Capital Gained", "(%)Annual_Return"]
-                           ).set_index("Period")
-    
-    return results
\ No newline at end of file
+    first_year, last_year = 1970, 2022
+    with stage("simulate_control_group_gold", rows=len(df)):
+        with stage("monthly means", rows=len(df)):
+            monthly_means = price_monthly_means(df, first_year, last_year)
+        with stage("assembly", rows=len(monthly_means)):
+            return control_group_frame(monthly_means, first_year, ounce_purchased, 0, 1, gold=True)